@@ -1,6 +1,6 @@
 import traceback
 from typing import Dict, List, Union
-from flask import Response, request, stream_with_context
+from flask import Response, jsonify, request, stream_with_context
 
 from backend.api.file import _get_file_path_from_node
 from backend.api.language_model import get_llm
@@ -26,10 +26,41 @@ from real_agents.adapters.callbacks import AgentStreamingStdOutCallbackHandler
 from real_agents.adapters.data_model import DatabaseDataModel, DataModel, JsonDataModel, TableDataModel
 from real_agents.adapters.executors import ChatExecutor
 from real_agents.adapters.interactive_executor import initialize_agent
-from real_agents.data_agent import CodeGenerationExecutor, KaggleDataLoadingExecutor
+from real_agents.data_agent import CodeGenerationExecutor, KaggleDataLoadingExecutor, PythonEvaluator
+from real_agents.data_agent.sql.example_selector import get_default_example_selector
 from real_agents.adapters.memory import ConversationReActBufferMemory, ReadOnlySharedStringMemory
 
 
+def convert_grounding_source_as_db(grounding_source_dict: Dict[str, DataModel]) -> DatabaseDataModel:
+    """Gets the database the SQL queries of a chat run against, with all its grounded tables."""
+    db_grounding_source = [
+        gs for _, gs in grounding_source_dict.items() if
+        isinstance(gs, DatabaseDataModel)
+    ]
+    table_grounding_source = [
+        gs for _, gs in grounding_source_dict.items() if
+        isinstance(gs, TableDataModel)
+    ]
+    assert len(db_grounding_source) <= 1
+    if len(table_grounding_source) == 0:
+        db_grounding_source[0].refresh([])
+        return db_grounding_source[0]
+    if len(db_grounding_source) == 0:
+        # The tables are queried through the db view of the first one
+        t_gs = table_grounding_source[0]
+        if t_gs.db_view is None:
+            t_gs.set_db_view(
+                DatabaseDataModel.from_table_data_model(t_gs))
+        db_grounding_source.append(t_gs.db_view)
+    db_gs = db_grounding_source[0]
+    # Keeps the cached database referenced while the chat uses it, and makes it again if it was collected
+    db_gs.refresh(table_grounding_source)
+    # Only loads the tables new or changed since the last call of the turn, and drops the ones no longer grounded.
+    # The agent process gets a copy of the grounding sources, so a new turn starts over, from the db cache
+    db_gs.sync_tables(table_grounding_source)
+    return db_gs
+
+
 def create_data_agent_executor(
         grounding_source_dict: Dict[str, DataModel],
         code_interpreter_languages: List[str],
@@ -39,6 +70,9 @@ def create_data_agent_executor(
         user_id: str = None,
         chat_id: str = None,
         code_execution_mode: str = "local",
+        stream_handler: AgentStreamingStdOutCallbackHandler = None,
+        bypass_execution_cache: bool = False,
+        progressive: bool = False,
 ) -> AgentExecutor:
     """Creates a data agent executor for data analysis tasks.
 
@@ -51,6 +85,9 @@ def create_data_agent_executor(
         user_id: User identifier.
         chat_id: Chat session identifier.
         code_execution_mode: Execution mode - "local" or "docker".
+        stream_handler: Streaming handler that receives live output of running code.
+        bypass_execution_cache: Whether to always re-execute the generated Python code.
+        progressive: Whether to stream approximate results on the samples of the large tables before the exact ones.
 
     Returns:
         Configured agent executor for data analysis.
@@ -66,11 +103,16 @@ def create_data_agent_executor(
     python_code_executor = CodeGenerationExecutor(
         programming_language="python", memory=read_only_memory)
     sql_code_executor = CodeGenerationExecutor(
-        programming_language="sql", memory=read_only_memory)
+        programming_language="sql", memory=read_only_memory, example_selector=get_default_example_selector())
     echart_code_executor = CodeGenerationExecutor(
         programming_language="python", memory=read_only_memory, usage="echarts"
     )
     kaggle_data_loader = KaggleDataLoadingExecutor()
+    on_output = stream_handler.on_execution_output if stream_handler is not None else None
+    # The tables to sample in the progressive mode
+    progressive_tables = [
+        gs for gs in grounding_source_dict.values() if isinstance(gs, TableDataModel)
+    ] if progressive else None
 
     def run_python_code_builder(term: str) -> Union[Dict, DataModel]:
         """Executes Python code generation and execution."""
@@ -84,6 +126,9 @@ def create_data_agent_executor(
                 chat_id=chat_id,
                 code_execution_mode=code_execution_mode,
                 jupyter_kernel_pool=jupyter_kernel_pool,
+                on_output=on_output,
+                bypass_cache=bypass_execution_cache,
+                progressive_tables=progressive_tables,
             )
 
             logger.bind(msg_head=f"PythonCodeBuilder results").debug(results)
@@ -123,38 +168,13 @@ def create_data_agent_executor(
     def run_sql_code_builder(term: str) -> Union[Dict, DataModel]:
         """Executes SQL query generation and execution."""
         try:
-            def convert_grounding_source_as_db(
-                    grounding_source_dict: Dict[str, DataModel]
-            ) -> Union[List[TableDataModel], DatabaseDataModel]:
-                db_grounding_source = [
-                    gs for _, gs in grounding_source_dict.items() if
-                    isinstance(gs, DatabaseDataModel)
-                ]
-                table_grounding_source = [
-                    gs for _, gs in grounding_source_dict.items() if
-                    isinstance(gs, TableDataModel)
-                ]
-                assert len(db_grounding_source) <= 1
-                if len(table_grounding_source) == 0:
-                    return db_grounding_source[0]
-                else:
-                    for t_gs in table_grounding_source:
-                        if len(db_grounding_source) == 0:
-                            if t_gs.db_view is None:
-                                t_gs.set_db_view(
-                                    DatabaseDataModel.from_table_data_model(t_gs))
-                            db_gs = t_gs.db_view
-                            db_grounding_source.append(db_gs)
-                        else:
-                            db_gs = db_grounding_source[0]
-                            db_gs.insert_table_data_model(t_gs)
-                    return db_gs
-
             input_grounding_source = convert_grounding_source_as_db(grounding_source_dict)
             results = sql_code_executor.run(
                 user_intent=term,
                 grounding_source=input_grounding_source,
                 llm=llm,
+                on_output=on_output,
+                progressive_tables=progressive_tables,
             )
 
             logger.bind(msg_head=f"SQLQueryBuilder results").debug(results)
@@ -191,6 +211,7 @@ def create_data_agent_executor(
                 chat_id=chat_id,
                 code_execution_mode=code_execution_mode,
                 jupyter_kernel_pool=jupyter_kernel_pool,
+                bypass_cache=bypass_execution_cache,
             )
 
             logger.bind(msg_head=f"EchartsVisualization results").debug(results)
@@ -315,6 +336,8 @@ def chat() -> Response:
         api_call = request_json.get("api_call", None)
         llm_name = request_json["llm_name"]
         temperature = request_json.get("temperature", 0.7)
+        bypass_execution_cache = request_json.get("bypass_execution_cache", False)
+        progressive = request_json.get("progressive", False)
         stop_words = ["[RESPONSE_BEGIN]", "TOOL RESPONSE"]
         kwargs = {
             "temperature": temperature,
@@ -366,6 +389,10 @@ def chat() -> Response:
             # Handle regular chat request
             grounding_source_dict = grounding_source_pool.get_pool_info_with_id(
                 user_id, chat_id, default_value={})
+            # Profiles, samples and shares the grounded tables, once, before the agent process gets them
+            for gs in grounding_source_dict.values():
+                if isinstance(gs, TableDataModel):
+                    gs.prepare()
             
             # Create agent executor
             agent_executor = create_data_agent_executor(
@@ -377,6 +404,9 @@ def chat() -> Response:
                 user_id=user_id,
                 chat_id=chat_id,
                 code_execution_mode=app.config["CODE_EXECUTION_MODE"],
+                stream_handler=stream_handler,
+                bypass_execution_cache=bypass_execution_cache,
+                progressive=progressive,
             )
             
             # Load conversation history
@@ -418,3 +448,8 @@ def chat() -> Response:
             return Response(response=None, status=f"{UNAUTH} Invalid Authentication")
         return Response(response=None, status=f"{OVERLOAD} Server is currently overloaded")
 
+
+@app.route("/api/execution_cache_stats", methods=["GET"])
+def execution_cache_stats() -> Response:
+    """Returns the hits, misses, bypasses and hit rate of the python execution result cache."""
+    return jsonify(PythonEvaluator.get_cache_stats())
@@ -0,0 +1,75 @@
+import os
+from itertools import chain
+from typing import Iterator
+
+from flask import Response, request
+
+from backend.api.chat import convert_grounding_source_as_db
+from backend.app import app
+from backend.main import grounding_source_pool, jupyter_kernel_pool, logger
+from backend.schemas import DEFAULT_USER_ID, UNFOUND, UNSUPPORTED
+from real_agents.adapters.data_export import EXPORT_BATCH_ROWS, EXPORT_FORMATS, encode_batches, stream_file
+from real_agents.data_agent import PythonEvaluator
+
+
+def _export_response(chunks: Iterator[bytes], export_format: str, file_name: str) -> Response:
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    return Response(
+        chunks,
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{file_name}.{extension}"'},
+    )
+
+
+@app.route("/api/export", methods=["POST"])
+def export() -> Response:
+    """Streams the full result of a SQL query on the chat's tables, or of a dataframe variable of the chat's kernel.
+
+    The result is computed again from its handle (the query or the variable name), without going through the LLM,
+    and streamed as Parquet, Arrow IPC or CSV. The queries run as the agent's do: read-only, preflighted, on databases
+    which cannot read files (read-only SQLite files, locked DuckDB databases), cut after SQL_EXPORT_MAX_ROWS rows and
+    interrupted after SQL_EXPORT_TIMEOUT seconds.
+    """
+    request_json = request.get_json()
+    user_id = request_json.pop("user_id", DEFAULT_USER_ID)
+    chat_id = request_json["chat_id"]
+    export_format = request_json.get("format", "csv")
+    file_name = os.path.basename(request_json.get("file_name", "export")) or "export"
+    if export_format not in EXPORT_FORMATS:
+        return Response(response=f"Unknown export format {export_format}", status=UNSUPPORTED)
+
+    logger.bind(user_id=user_id, chat_id=chat_id, api="/export", msg_head="Request received").debug(request_json)
+
+    if "sql" in request_json:
+        grounding_source_dict = grounding_source_pool.get_pool_info_with_id(user_id, chat_id, default_value={})
+        if not grounding_source_dict:
+            return Response(response="The chat has no table to query", status=UNFOUND)
+        try:
+            db = convert_grounding_source_as_db(grounding_source_dict)
+            chunks = encode_batches(db.raw_data.iter_batches(request_json["sql"], EXPORT_BATCH_ROWS), export_format)
+            # Runs the query, so that its errors are returned before the response starts
+            first_chunk = next(chunks)
+        except Exception as e:
+            logger.bind(user_id=user_id, chat_id=chat_id, api="/export", msg_head="Export error").error(str(e))
+            return Response(response=str(e), status=UNSUPPORTED)
+        return _export_response(chain([first_chunk], chunks), export_format, file_name)
+
+    if "variable" in request_json:
+        if app.config["CODE_EXECUTION_MODE"] != "docker":
+            # The local kernel lives in the agent process of each turn, and is gone by now
+            return Response(response="Kernel variables can only be exported in docker mode", status=UNSUPPORTED)
+        kernel_manager = PythonEvaluator.kernel_manager
+        kernel_info = jupyter_kernel_pool.get_pool_info_with_id(user_id, chat_id, None)
+        kid = kernel_info["kid"] if kernel_info is not None else kernel_manager.find_kernel(user_id, chat_id)
+        if kid is None:
+            return Response(response="The chat has no kernel", status=UNFOUND)
+        try:
+            path = kernel_manager.export(user_id, chat_id, kid, request_json["variable"], export_format)
+        except Exception as e:
+            logger.bind(user_id=user_id, chat_id=chat_id, api="/export", msg_head="Export error").error(str(e))
+            return Response(response=str(e), status=UNFOUND)
+        # The kernel working directory is the user's folder
+        file_path = os.path.join(app.config["UPLOAD_FOLDER"], user_id, path)
+        return _export_response(stream_file(file_path, remove=True), export_format, file_name)
+
+    return Response(response="Either sql or variable is required", status=UNSUPPORTED)
@@ -0,0 +1,86 @@
+import os
+
+import pandas as pd
+from flask import Response, jsonify, request
+
+from backend.api.chat import convert_grounding_source_as_db
+from backend.api.file import _get_file_path_from_node
+from backend.app import app
+from backend.main import grounding_source_pool, jupyter_kernel_pool, logger
+from backend.schemas import DEFAULT_USER_ID, UNFOUND, UNSUPPORTED
+from backend.utils.utils import create_personal_folder
+from real_agents.adapters.data_model import KaggleDataModel, TableDataModel
+from real_agents.adapters.data_model.pagination import DEFAULT_PAGE_SIZE, get_query_page, make_page, page_window
+from real_agents.data_agent import PythonEvaluator
+
+
+@app.route("/api/table_page", methods=["POST"])
+def table_page() -> Response:
+    """Returns a page of a table of the chat, sorted and filtered on the server, with the number of matching rows.
+
+    The table is a grounded file (activated_file, and table_path for a Kaggle dataset), the full result of a SQL
+    query on the chat's tables (sql, or the result handle shown with a truncated result), or a dataframe variable of
+    the chat's kernel (variable). Only the rows of the
+    page are sent, the front-end table fetches the other pages as they are shown.
+    """
+    request_json = request.get_json()
+    user_id = request_json.pop("user_id", DEFAULT_USER_ID)
+    chat_id = request_json["chat_id"]
+    page_index = request_json.get("page_index", 0)
+    page_size = request_json.get("page_size", DEFAULT_PAGE_SIZE)
+    sorting = request_json.get("sorting", [])
+    filters = request_json.get("filters", [])
+
+    logger.bind(user_id=user_id, chat_id=chat_id, api="/table_page", msg_head="Request received").debug(request_json)
+
+    try:
+        if "activated_file" in request_json:
+            grounding_source_dict = grounding_source_pool.get_pool_info_with_id(user_id, chat_id, default_value={})
+            file_path = _get_file_path_from_node(create_personal_folder(user_id), request_json["activated_file"])
+            gs = grounding_source_dict.get(file_path)
+            if isinstance(gs, TableDataModel):
+                return jsonify(gs.get_page(page_index, page_size, sorting, filters))
+            if isinstance(gs, KaggleDataModel) and request_json.get("table_path") in gs.raw_data:
+                return jsonify(gs.get_page(request_json["table_path"], page_index, page_size, sorting, filters))
+            return Response(response="The chat has no such table", status=UNFOUND)
+
+        if "sql" in request_json or "handle" in request_json:
+            grounding_source_dict = grounding_source_pool.get_pool_info_with_id(user_id, chat_id, default_value={})
+            if not grounding_source_dict:
+                return Response(response="The chat has no table to query", status=UNFOUND)
+            db = convert_grounding_source_as_db(grounding_source_dict)
+            if "sql" in request_json:
+                command = request_json["sql"]
+            else:
+                try:
+                    command = db.raw_data.get_result_command(request_json["handle"])
+                except KeyError as e:
+                    return Response(response=str(e), status=UNFOUND)
+            return jsonify(get_query_page(db.raw_data, command, page_index, page_size, sorting, filters))
+
+        if "variable" in request_json:
+            if app.config["CODE_EXECUTION_MODE"] != "docker":
+                # The local kernel lives in the agent process of each turn, and is gone by now
+                return Response(response="Kernel variables can only be paged in docker mode", status=UNSUPPORTED)
+            kernel_manager = PythonEvaluator.kernel_manager
+            kernel_info = jupyter_kernel_pool.get_pool_info_with_id(user_id, chat_id, None)
+            kid = kernel_info["kid"] if kernel_info is not None else kernel_manager.find_kernel(user_id, chat_id)
+            if kid is None:
+                return Response(response="The chat has no kernel", status=UNFOUND)
+            start, stop = page_window(page_index, page_size)
+            path, total = kernel_manager.page(
+                user_id, chat_id, kid, request_json["variable"], start, stop, sorting, filters
+            )
+            # The kernel working directory is the user's folder
+            file_path = os.path.join(app.config["UPLOAD_FOLDER"], user_id, path)
+            try:
+                page = pd.read_parquet(file_path)
+            finally:
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+            return jsonify(make_page(page, total, page_index, stop - start))
+    except Exception as e:
+        logger.bind(user_id=user_id, chat_id=chat_id, api="/table_page", msg_head="Table page error").error(str(e))
+        return Response(response=str(e), status=UNSUPPORTED)
+
+    return Response(response="Either activated_file, sql, handle or variable is required", status=UNSUPPORTED)
@@ -2,6 +2,8 @@ import os
 import warnings
 import threading
 
+import multiprocess
+
 from backend.app import app
 from backend.kernel_publisher import start_kernel_publisher
 from backend.utils.threading import ThreadManager
@@ -11,6 +13,9 @@ from backend.memory import (
     MessageMemoryManager,
     UserMemoryManager,
 )
+from real_agents.adapters.data_model.database import SQL_ENGINE, db_cache
+from real_agents.adapters.data_model.index_advisor import IndexAdvisor
+from real_agents.data_agent import PythonEvaluator
 
 warnings.filterwarnings("ignore", category=UserWarning)
 
@@ -34,13 +39,25 @@ threading_pool: ThreadManager = ThreadManager()
 
 message_id_register = VariableRegister(name="message_id_register", backend=VARIABLE_REGISTER_BACKEND)
 
-# Monitor kernel execution and manage long-running kernels
-if app.config["CODE_EXECUTION_MODE"] == "docker":
-    threading.Thread(target=start_kernel_publisher, args=(), daemon=True).start()
 
-if __name__ == "__main__":
-    import multiprocess
+def start_background_threads() -> None:
+    """Start the server's background threads, once per server: the agent processes import this module too."""
+    # Monitor kernel execution and manage long-running kernels
+    if app.config["CODE_EXECUTION_MODE"] == "docker":
+        threading.Thread(target=start_kernel_publisher, args=(), daemon=True).start()
+        # Stop idle kernels and keep track of the kernels' memory for eviction
+        threading.Thread(target=PythonEvaluator.kernel_manager.run_reaper, args=(), daemon=True).start()
+
+    # Index the columns of the materialized tables the SQL queries keep filtering, joining or grouping on
+    if SQL_ENGINE == "sqlite":
+        threading.Thread(target=IndexAdvisor(db_cache).run, args=(), daemon=True).start()
 
+
+# Not in the spawned agent processes, named after their Process object from the start, while importing this module
+if multiprocess.current_process().name == "MainProcess":
+    start_background_threads()
+
+if __name__ == "__main__":
     multiprocess.set_start_method("spawn", True)
     app.run()
 
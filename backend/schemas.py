@@ -2,6 +2,8 @@
 APP_TYPE = "data_agent"
 TIME_STEP = 0.035
 TIMEOUT_SECONDS = 90
+# Time given to the agent process to interrupt its running queries before it is killed
+CANCEL_GRACE_SECONDS = 1
 STREAM_BLOCK_TYPES = ["image", "echarts"]
 STREAM_TOKEN_TYPES = ["tool", "transition", "execution_result", "error", "kaggle_search", "kaggle_connect", "plain"]
 EXECUTION_RESULT_MAX_TOKENS = 1000
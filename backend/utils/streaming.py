@@ -14,6 +14,7 @@ from backend.utils.utils import error_rendering
 from backend.memory import MessageMemoryManager
 from backend.schemas import (
     TIMEOUT_SECONDS,
+    CANCEL_GRACE_SECONDS,
     HEARTBEAT_INTERVAL,
     STREAM_BLOCK_TYPES,
     STREAM_TOKEN_TYPES,
@@ -21,8 +22,10 @@ from backend.schemas import (
 )
 from real_agents.data_agent import DataSummaryExecutor
 from real_agents.adapters.callbacks.agent_streaming import AgentStreamingStdOutCallbackHandler
+from real_agents.adapters.data_model.shared_table import sharing_tables
 from real_agents.adapters.agent_helpers import Agent, AgentExecutor
 from real_agents.adapters.llm import BaseLanguageModel
+from real_agents.adapters.sql_guard import watch_cancellation
 
 
 def check_url_exists(text: str) -> bool:
@@ -146,8 +149,12 @@ def _wrap_agent_caller(
     err_pool: Dict[str, Any],
     memory_pool: Dict[str, Any],
     callbacks: List,
+    cancel_event: Any = None,
 ) -> None:
     """Wrapper function to call the agent executor in a separate process."""
+    if cancel_event is not None:
+        # Killing the process does not stop the queries running on a database server
+        watch_cancellation(cancel_event)
     try:
         _ = interaction_executor(inputs, callbacks=callbacks)
         message_list_from_memory = MessageMemoryManager.save_agent_memory_to_list(interaction_executor.memory)
@@ -205,6 +212,7 @@ def single_round_chat_with_agent_streaming(
         err_pool: Dict[str, Any] = share_manager.dict()
         memory_pool: Dict[str, Any] = share_manager.dict()
         share_list = share_manager.list()
+        cancel_event = share_manager.Event()
         memory_pool[chat_id] = []
 
         stream_handler.for_display = share_list
@@ -220,11 +228,14 @@ def single_round_chat_with_agent_streaming(
                 err_pool,
                 memory_pool,
                 [stream_handler],
+                cancel_event,
             ),
         )
 
         threading_pool.register_thread(chat_id, chat_thread)
-        chat_thread.start()
+        # The grounding sources go to the agent process as handles to shared files, not as copies
+        with sharing_tables():
+            chat_thread.start()
         empty_s_time: float = -1
         last_heartbeat_time: float = -1
         timeout = TIMEOUT_SECONDS
@@ -245,6 +256,7 @@ def single_round_chat_with_agent_streaming(
         # Initialize display stream
         display_stream = DisplayStream(execution_result_max_tokens=EXECUTION_RESULT_MAX_TOKENS)
         is_block_first, current_block_type = False, None
+        is_live_output = False
         intermediate_list, final_list = [], []
         
         try:
@@ -257,6 +269,8 @@ def single_round_chat_with_agent_streaming(
                         empty_s_time = time.time()
                     else:
                         if time.time() - empty_s_time > timeout and chat_thread.is_alive():
+                            cancel_event.set()
+                            chat_thread.join(CANCEL_GRACE_SECONDS)
                             threading_pool.timeout_thread(chat_id)
                             break
 
@@ -274,6 +288,17 @@ def single_round_chat_with_agent_streaming(
 
                 while len(stream_handler.for_display) > 0:
                     token = stream_handler.for_display.pop(0)
+
+                    if token["type"] == "execution_result":
+                        # Live output of a running cell, the full result still arrives with the tool observation
+                        token["text"] = _render_preprocess(token["text"])
+                        yield _streaming_token(token, False, user_id, chat_id, not is_live_output)
+                        is_live_output = True
+                        continue
+                    elif is_live_output:
+                        # Render what follows the live output as a new block
+                        is_live_output, current_block_type = False, None
+
                     items_to_display = display_stream.display(token)
 
                     if items_to_display is None:
@@ -463,7 +488,8 @@ def single_round_chat_with_executor(
 
     empty_s_time: float = -1
     timeout = TIMEOUT_SECONDS
-    chat_thread.start()
+    with sharing_tables():
+        chat_thread.start()
     
     yield pack_json(
         {
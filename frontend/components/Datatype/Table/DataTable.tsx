@@ -1,19 +1,96 @@
-import MaterialReactTable from 'material-react-table';
-import React, { FC, memo, useEffect, useState } from 'react';
+import MaterialReactTable, {
+  MRT_ColumnFiltersState,
+  MRT_PaginationState,
+  MRT_SortingState,
+} from 'material-react-table';
+import React, { FC, memo, useContext, useEffect, useRef, useState } from 'react';
+import toast from 'react-hot-toast';
+
+import { API_TABLE_PAGE } from '@/utils/app/const';
+
+import HomeContext from '@/pages/api/home/home.context';
 
 interface Props {
   content: string;
 }
+
+// Tables with a source are paged, sorted and filtered by the backend, the others hold all their rows
 const DataTable: FC<Props> = memo(({ content }) => {
+  const {
+    state: { chat_id },
+  } = useContext(HomeContext);
+
   const [data, setData] = useState([]);
   const [columns, setColumns] = useState([]);
+  const [source, setSource] = useState<any>(null);
+  const [rowCount, setRowCount] = useState(0);
+  const [isLoading, setIsLoading] = useState(false);
+  const [pagination, setPagination] = useState<MRT_PaginationState>({
+    pageIndex: 0,
+    pageSize: 10,
+  });
+  const [sorting, setSorting] = useState<MRT_SortingState>([]);
+  const [columnFilters, setColumnFilters] = useState<MRT_ColumnFiltersState>(
+    [],
+  );
+  // The first page comes with the content
+  const fetched = useRef(false);
 
   useEffect(() => {
     const table = JSON.parse(content);
     setColumns(table.columns);
     setData(table.data);
+    setRowCount(table.total ?? table.data.length);
+    if (table.source) {
+      setSource(table.source);
+      setPagination({ pageIndex: 0, pageSize: table.page_size });
+    }
   }, []);
 
+  useEffect(() => {
+    if (!source) {
+      return;
+    }
+    if (!fetched.current) {
+      fetched.current = true;
+      return;
+    }
+    setIsLoading(true);
+    fetch(API_TABLE_PAGE, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({
+        ...source,
+        chat_id,
+        page_index: pagination.pageIndex,
+        page_size: pagination.pageSize,
+        sorting,
+        filters: columnFilters,
+      }),
+    })
+      .then((response) => {
+        if (!response.ok) {
+          return response.text().then((text) => {
+            throw new Error(text);
+          });
+        }
+        return response.json();
+      })
+      .then((page) => {
+        setData(page.data);
+        setRowCount(page.total);
+        setIsLoading(false);
+      })
+      .catch((error) => {
+        toast.error(error.message);
+        setIsLoading(false);
+      });
+  }, [source, pagination.pageIndex, pagination.pageSize, sorting, columnFilters]);
+
+  const manual = source !== null;
+
   return (
     <MaterialReactTable
       columns={columns}
@@ -21,6 +98,15 @@ const DataTable: FC<Props> = memo(({ content }) => {
       enableColumnResizing
       initialState={{ density: 'compact' }}
       enableBottomToolbar={true}
+      enableGlobalFilter={!manual}
+      manualPagination={manual}
+      manualSorting={manual}
+      manualFiltering={manual}
+      rowCount={rowCount}
+      onPaginationChange={setPagination}
+      onSortingChange={setSorting}
+      onColumnFiltersChange={setColumnFilters}
+      state={{ pagination, sorting, columnFilters, isLoading }}
       muiBottomToolbarProps={{
         sx: {
           zIndex: 0,
@@ -22,6 +22,7 @@ export const API_GET_DATA = `${API_ENDPOINT}/get_file` as const;
 export const API_SNOWFLAKE = `${API_ENDPOINT}/snowflake` as const;
 export const API_SQL_QUERY = `${API_ENDPOINT}/sql_query` as const;
 export const API_GET_TABLE_DATA = `${API_ENDPOINT}/get_table_data` as const;
+export const API_TABLE_PAGE = `${API_ENDPOINT}/table_page` as const;
 export const API_SNOWFLAKE_DISCONNECT = `${API_ENDPOINT}/snowflake_disconnect` as const;
 export const API_SET_GROUNDING_SOURCE =
   `${API_ENDPOINT}/set_grounding_source` as const;
@@ -261,6 +261,12 @@ class AgentStreamingStdOutCallbackHandler(StreamingStdOutCallbackHandler):
         for char_item in self.json_tmp_stack:
             self.for_display.append({"text": char_item["text"], "type": "plain", "llm_call_id": self.llm_call_id})
 
+    def on_execution_output(self, text: str, stream_name: str = "stdout") -> None:
+        """Run on new stdout/stderr text of a running code cell."""
+        self.for_display.append(
+            {"text": text, "type": "execution_result", "stream": stream_name, "llm_call_id": self.llm_call_id}
+        )
+
     def on_tool_end(self, output: Union[DataModel, str], **kwargs: Any) -> None:
         """Run on tool end to add observation data model."""
         self.for_display.append({"text": output, "type": "block", "llm_call_id": self.llm_call_id})
@@ -0,0 +1,191 @@
+"""Encoding of full results (SQL query results, kernel dataframes) as Parquet, Arrow IPC or CSV byte streams.
+
+The rows are encoded batch by batch, so that exporting a result takes the memory of a batch whatever its size (Parquet
+and Arrow IPC spill the batches to a temporary file first, to type the columns from all of them).
+"""
+import csv
+import io
+import os
+import tempfile
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", 10000))
+EXPORT_CHUNK_BYTES = 1024**2
+# Format -> (mimetype, file extension)
+EXPORT_FORMATS: Dict[str, Tuple[str, str]] = {
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow"),
+    "csv": ("text/csv", "csv"),
+}
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file collecting what the writers write, to be drained between batches."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+def _to_array(column: Sequence[Any]) -> Any:
+    import pyarrow as pa
+
+    try:
+        return pa.array(column)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Values of several types, e.g., in a SQLite column, are exported as strings
+        return pa.array([None if value is None else str(value) for value in column], type=pa.string())
+
+
+def _is_number(type_: Any) -> bool:
+    import pyarrow as pa
+
+    return pa.types.is_integer(type_) or pa.types.is_floating(type_)
+
+
+def _unify_type(current: Any, new: Any) -> Any:
+    """The type of a column whose batches are of types current and new: numbers are promoted to floats, nulls take
+    the other type, and other mixes fall back to strings."""
+    import pyarrow as pa
+
+    if current is None or pa.types.is_null(current):
+        return new
+    if pa.types.is_null(new) or new == current:
+        return current
+    if _is_number(current) and _is_number(new):
+        return pa.float64()
+    return pa.string()
+
+
+def _cast(array: Any, target: Any) -> Any:
+    import pyarrow as pa
+
+    if array.type == target:
+        return array
+    try:
+        return array.cast(target)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        # E.g., nested or binary values to strings
+        return pa.array([None if value is None else str(value) for value in array.to_pylist()], type=pa.string())
+
+
+def _spill_batches(
+    batches: Iterable[Tuple[List[str], Sequence[Sequence[Any]]]], spill: Any
+) -> Tuple[List[str], List[Any]]:
+    """Write the batches to the spill file, each as a length-prefixed IPC stream of its own types, returning the
+    headers and the column types unified across the batches."""
+    import pyarrow as pa
+
+    headers: Optional[List[str]] = None
+    types: List[Any] = []
+    for batch_headers, rows in batches:
+        if headers is None:
+            headers, types = [str(header) for header in batch_headers], [None] * len(batch_headers)
+        if not rows:
+            continue
+        arrays = [_to_array(column) for column in zip(*rows)]
+        types = [_unify_type(current, array.type) for current, array in zip(types, arrays)]
+        record_batch = pa.RecordBatch.from_arrays(arrays, names=headers)
+        buffer = io.BytesIO()
+        with pa.ipc.new_stream(buffer, record_batch.schema) as writer:
+            writer.write_batch(record_batch)
+        data = buffer.getvalue()
+        spill.write(len(data).to_bytes(8, "little"))
+        spill.write(data)
+    return headers or [], types
+
+
+def _read_spilled_batches(spill: Any) -> Iterator[Any]:
+    import pyarrow as pa
+
+    spill.seek(0)
+    while True:
+        size = spill.read(8)
+        if not size:
+            return
+        yield pa.ipc.open_stream(spill.read(int.from_bytes(size, "little"))).read_next_batch()
+
+
+def encode_batches(batches: Iterable[Tuple[List[str], Sequence[Sequence[Any]]]], export_format: str) -> Iterator[bytes]:
+    """Encode (headers, rows) batches in the export format, yielding the bytes of each batch once written.
+
+    Parquet and Arrow IPC require pyarrow and a schema for the whole stream: the batches are first spilled to a
+    temporary file while their column types are unified (integers and floats as floats, a column without any value as
+    strings, other mixes as strings), then written with the unified types.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {export_format}, expected one of {', '.join(EXPORT_FORMATS)}")
+    if export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for index, (headers, rows) in enumerate(batches):
+            if index == 0:
+                writer.writerow(headers)
+            writer.writerows(rows)
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+        return
+
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError(f"Exporting as {export_format} requires pyarrow, use `pip install pyarrow`")
+    with tempfile.TemporaryFile() as spill:
+        headers, types = _spill_batches(batches, spill)
+        # Columns without any value cannot be typed
+        types = [pa.string() if type_ is None or pa.types.is_null(type_) else type_ for type_ in types]
+        schema = pa.schema(list(zip(headers, types)))
+        sink = _ChunkSink()
+        if export_format == "parquet":
+            writer = pq.ParquetWriter(sink, schema)
+        else:
+            writer = pa.ipc.new_stream(sink, schema)
+        try:
+            for spilled_batch in _read_spilled_batches(spill):
+                record_batch = pa.RecordBatch.from_arrays(
+                    [_cast(column, field.type) for column, field in zip(spilled_batch.columns, schema)], schema=schema
+                )
+                if export_format == "parquet":
+                    # A row group per batch
+                    writer.write_table(pa.Table.from_batches([record_batch]))
+                else:
+                    writer.write_batch(record_batch)
+                chunk = sink.drain()
+                if chunk:
+                    yield chunk
+        finally:
+            writer.close()
+        yield sink.drain()
+
+
+def stream_file(path: str, chunk_bytes: int = EXPORT_CHUNK_BYTES, remove: bool = False) -> Iterator[bytes]:
+    """Read a file chunk by chunk, removing it afterwards if asked to."""
+    try:
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_bytes)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        if remove and os.path.exists(path):
+            os.remove(path)
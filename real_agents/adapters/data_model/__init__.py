@@ -1,3 +1,4 @@
+from real_agents.adapters.data_model.arrow_table import ArrowTable, ArrowTableDataModel
 from real_agents.adapters.data_model.base import DataModel
 from real_agents.adapters.data_model.database import DatabaseDataModel
 from real_agents.adapters.data_model.image import ImageDataModel
@@ -10,6 +11,8 @@ from real_agents.adapters.data_model.table import TableDataModel
 __all__ = [
     "DataModel",
     "TableDataModel",
+    "ArrowTable",
+    "ArrowTableDataModel",
     "DatabaseDataModel",
     "ImageDataModel",
     "JsonDataModel",
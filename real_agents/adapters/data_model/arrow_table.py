@@ -0,0 +1,197 @@
+"""Tables backed by Arrow IPC (Feather v2) or Parquet files, read without loading the whole file into memory."""
+from __future__ import annotations
+
+import os
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from real_agents.adapters.data_model.table import TableDataModel
+
+ARROW_EXTENSIONS = (".arrow", ".feather", ".ipc")
+PARQUET_EXTENSIONS = (".parquet",)
+ARROW_BATCH_ROWS = 50000
+
+
+class ArrowTable:
+    """Read-only, DataFrame-like view of an Arrow IPC or Parquet file.
+
+    Arrow IPC files are memory-mapped, Parquet files are read by row groups: only the rows and columns asked for are
+    loaded, the shape and null counts come from the file metadata. Pickled as its path, the file is mapped again in
+    the agent processes instead of being copied to them.
+    """
+
+    def __init__(self, path: str) -> None:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Arrow and Parquet tables require pyarrow, use `pip install pyarrow`")
+        self.path = path
+        self._parquet: Any = None
+        self._table: Any = None
+        if path.lower().endswith(PARQUET_EXTENSIONS):
+            self._parquet = pq.ParquetFile(path, memory_map=True)
+            self.schema = self._parquet.schema_arrow
+            self._num_rows = self._parquet.metadata.num_rows
+            # First row of each row group
+            self._row_group_starts = np.cumsum(
+                [0] + [self._parquet.metadata.row_group(i).num_rows for i in range(self._parquet.num_row_groups)]
+            )
+        else:
+            # Zero-copy, the buffers of uncompressed files point into the mapped file
+            self._table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+            self.schema = self._table.schema
+            self._num_rows = self._table.num_rows
+        self._empty = self.schema.empty_table().to_pandas()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {"path": self.path}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(state["path"])
+
+    def __len__(self) -> int:
+        return self._num_rows
+
+    @property
+    def columns(self) -> pd.Index:
+        return self._empty.columns
+
+    @property
+    def dtypes(self) -> pd.Series:
+        return self._empty.dtypes
+
+    @property
+    def shape(self) -> tuple:
+        return self._num_rows, len(self.columns)
+
+    def _to_pandas(self, table: Any, positions: Union[range, Sequence[int]]) -> pd.DataFrame:
+        df = table.to_pandas()
+        if isinstance(df.index, pd.RangeIndex):
+            # Indexed by row position in the file, as the rows of a DataFrame of the whole table
+            df.index = pd.RangeIndex(positions.start, positions.stop) if isinstance(positions, range) else positions
+        return df
+
+    def head(self, n: int = 5) -> pd.DataFrame:
+        n = min(max(n, 0), self._num_rows)
+        if self._parquet is None:
+            table = self._table.slice(0, n)
+        else:
+            # Only the first row group is read
+            batch = next(self._parquet.iter_batches(batch_size=n), None) if n else None
+            table = self._from_batches([batch] if batch is not None else [])
+        return self._to_pandas(table, range(0, n))
+
+    def _from_batches(self, batches: List[Any]) -> Any:
+        import pyarrow as pa
+
+        return pa.Table.from_batches(batches, schema=self.schema)
+
+    def slice(self, start: int, stop: int) -> pd.DataFrame:
+        """The rows from start to stop, a zero-copy slice of an Arrow IPC file, read from the row groups they fall in
+        for a Parquet file."""
+        start, stop = min(max(start, 0), self._num_rows), min(max(stop, 0), self._num_rows)
+        if self._parquet is None:
+            return self._to_pandas(self._table.slice(start, max(stop - start, 0)), range(start, max(stop, start)))
+        return self.take(np.arange(start, max(stop, start)))
+
+    def take(self, positions: Sequence[int]) -> pd.DataFrame:
+        """The rows at the sorted positions, reading the row groups of a Parquet file one at a time."""
+        positions = np.asarray(positions, dtype=np.int64)
+        if self._parquet is None:
+            return self._to_pandas(self._table.take(positions), positions)
+        import pyarrow as pa
+
+        row_groups = np.searchsorted(self._row_group_starts, positions, side="right") - 1
+        pieces = []
+        for row_group in np.unique(row_groups):
+            local_positions = positions[row_groups == row_group] - self._row_group_starts[row_group]
+            pieces.append(self._parquet.read_row_group(int(row_group)).take(local_positions))
+        table = pa.concat_tables(pieces) if pieces else self.schema.empty_table()
+        return self._to_pandas(table, positions)
+
+    def _read_column(self, name: str) -> Any:
+        if self._parquet is None:
+            return self._table.column(name)
+        return self._parquet.read(columns=[name]).column(0)
+
+    def column(self, key: Union[int, str]) -> pd.Series:
+        """A single column, the only one read from the file."""
+        name = self.columns[key] if isinstance(key, int) else key
+        series = self._read_column(name).to_pandas()
+        series.name = name
+        return series
+
+    def __getitem__(self, key: str) -> pd.Series:
+        return self.column(key)
+
+    def iter_batches(self, batch_rows: int = ARROW_BATCH_ROWS) -> Iterator[pd.DataFrame]:
+        start = 0
+        if self._parquet is None:
+            batches = self._table.to_batches(max_chunksize=batch_rows)
+        else:
+            batches = self._parquet.iter_batches(batch_size=batch_rows)
+        for batch in batches:
+            yield self._to_pandas(self._from_batches([batch]), range(start, start + batch.num_rows))
+            start += batch.num_rows
+
+    def to_arrow(self) -> Any:
+        """The whole file as a pyarrow Table, mapped for Arrow IPC files, read for Parquet files."""
+        return self._table if self._parquet is None else self._parquet.read()
+
+    def to_pandas(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """Load the table, or only some of its columns, into memory."""
+        if self._parquet is None:
+            table = self._table if columns is None else self._table.select(columns)
+        else:
+            table = self._parquet.read(columns=columns, use_pandas_metadata=columns is None)
+        return self._to_pandas(table, range(0, self._num_rows))
+
+    def to_sql(self, name: str, con: Any, if_exists: str = "fail", batch_rows: int = ARROW_BATCH_ROWS) -> None:
+        """Write the table with `DataFrame.to_sql`, batch by batch."""
+        for batch in self.iter_batches(batch_rows):
+            batch.to_sql(name, con, if_exists=if_exists)
+            if_exists = "append"
+
+    def null_count(self) -> pd.Series:
+        """Missing values of each column, from the Arrow buffers or the Parquet statistics, without reading values."""
+        counts = {}
+        for name in self.columns:
+            if self._parquet is None:
+                counts[name] = self._table.column(name).null_count
+                continue
+            index = self.schema.get_field_index(name)
+            metadata = self._parquet.metadata
+            statistics = [metadata.row_group(i).column(index).statistics for i in range(metadata.num_row_groups)]
+            if all(stat is not None and stat.has_null_count for stat in statistics):
+                counts[name] = sum(stat.null_count for stat in statistics)
+            else:
+                counts[name] = self._read_column(name).null_count
+        return pd.Series(counts, dtype="int64")
+
+    def nunique(self, dropna: bool = True) -> pd.Series:
+        """Distinct values of each column, from the Parquet statistics when they have them (written by some writers
+        for single row group files), else counted a column at a time."""
+        import pyarrow.compute as pc
+
+        counts = {}
+        for name in self.columns:
+            if self._parquet is not None and self._parquet.num_row_groups == 1:
+                stat = self._parquet.metadata.row_group(0).column(self.schema.get_field_index(name)).statistics
+                if stat is not None and stat.distinct_count and dropna:
+                    counts[name] = stat.distinct_count
+                    continue
+            values = self._read_column(name)
+            counts[name] = pc.count_distinct(values, mode="only_valid" if dropna else "all").as_py()
+        return pd.Series(counts, dtype="int64")
+
+
+class ArrowTableDataModel(TableDataModel):
+    """A table data model over an Arrow IPC (Feather v2) or Parquet file, raw_data being an ArrowTable."""
+
+    @classmethod
+    def from_file(cls, path: str, raw_data_name: Optional[str] = None) -> ArrowTableDataModel:
+        raw_data_name = raw_data_name or os.path.basename(path)
+        return cls.from_raw_data(ArrowTable(path), raw_data_name=raw_data_name, raw_data_path=path)
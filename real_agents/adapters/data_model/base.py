@@ -1,9 +1,12 @@
 from __future__ import annotations
 
+import os
 import uuid
-from typing import Any
+from typing import Any, Callable, Dict, Tuple
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+from real_agents.adapters.data_model.utils import fingerprint_file
 
 
 class DataModel(BaseModel):
@@ -15,6 +18,8 @@ class DataModel(BaseModel):
     raw_data_path: str
     llm_side_data: Any  # could be string or potentially images for future needs
     human_side_data: Any
+    llm_side_data_cache: Dict[Tuple[Any, ...], Any] = Field(default_factory=dict, exclude=True)
+    """(fingerprint, *serialization parameters) -> LLM side data, so that the data is only serialized once."""
 
     def __hash__(self) -> int:
         return hash(self.id)
@@ -29,12 +34,35 @@ class DataModel(BaseModel):
     def get_id(self) -> str:
         return self.id
 
+    def get_fingerprint(self) -> str:
+        """Fingerprint of the data, i.e., the content hash of the source file if there is one."""
+        if isinstance(self.raw_data_path, str) and os.path.isfile(self.raw_data_path):
+            return fingerprint_file(self.raw_data_path)
+        return self.id
+
     def get_raw_data(self) -> Any:
         return self.raw_data
 
     def get_llm_side_data(self) -> Any:
         return self.raw_data
 
+    def _get_cached_llm_side_data(self, parameters: Tuple[Any, ...], serialize: Callable[[], Any]) -> Any:
+        """The LLM side data serialized with the parameters, computed by serialize the first time only.
+
+        Keyed by the fingerprint too, so that a data file changed in place is serialized again.
+        """
+        fingerprint = self.get_fingerprint()
+        key = (fingerprint, *parameters)
+        if key not in self.llm_side_data_cache:
+            # The serializations of the previous versions of the data are dropped
+            self.llm_side_data_cache = {
+                cached_key: value
+                for cached_key, value in self.llm_side_data_cache.items()
+                if cached_key[0] == fingerprint
+            }
+            self.llm_side_data_cache[key] = serialize()
+        return self.llm_side_data_cache[key]
+
     def get_human_side_data(self) -> Any:
         return self.raw_data
 
@@ -1,34 +1,229 @@
 from __future__ import annotations
 
+import itertools
 import os
-from typing import Any
+import shutil
+import sqlite3
+from contextlib import closing
+from typing import Any, Dict, List, Optional, Union
 
 import pandas as pd
-from sqlalchemy import create_engine, inspect
+from loguru import logger
 
+from real_agents.adapters.data_model.arrow_table import ArrowTable
 from real_agents.adapters.data_model.base import DataModel
+from real_agents.adapters.data_model.db_cache import DBCache, get_tables_key
+from real_agents.adapters.data_model.sqlite_loader import LOAD_CHUNK_ROWS, bulk_load, bulk_load_chunks
 from real_agents.adapters.data_model.table import TableDataModel
 from real_agents.adapters.data_model.templates.skg_templates.database_templates import serialize_db
+from real_agents.adapters.data_model.utils import fingerprint_file
 from real_agents.adapters.schema import SQLDatabase
 
+# "sqlite" materializes the tables into a database file, "duckdb" queries the DataFrames (or Parquet files) in place
+SQL_ENGINE = os.getenv("SQL_ENGINE", "sqlite")
+db_cache = DBCache()
+
+
+def _get_duckdb_source(table_data_model: TableDataModel) -> Union[pd.DataFrame, Any, str]:
+    """Parquet uploads are read from the file, Arrow files from their mapping, the others from the loaded DataFrame."""
+    raw_data_path = table_data_model.raw_data_path
+    if isinstance(raw_data_path, str) and raw_data_path.endswith(".parquet") and os.path.isfile(raw_data_path):
+        return raw_data_path
+    if isinstance(table_data_model.raw_data, ArrowTable):
+        return table_data_model.raw_data.to_arrow()
+    return table_data_model.raw_data
+
+
+def _write_table(table_data_model: TableDataModel, db_path: str) -> None:
+    raw_data = table_data_model.raw_data
+    if isinstance(raw_data, ArrowTable):
+        # Loaded batch by batch, the table is never fully in memory
+        chunks = raw_data.iter_batches(LOAD_CHUNK_ROWS)
+        bulk_load_chunks(raw_data.head(0), chunks, table_data_model.raw_data_name, db_path)
+    else:
+        bulk_load(raw_data, table_data_model.raw_data_name, db_path)
+
+
+def _write_table_to_engine(table_data_model: TableDataModel, engine: Any) -> None:
+    """As `_write_table`, into a database without a file (e.g., an in-memory SQLite one) through `to_sql`."""
+    raw_data = table_data_model.raw_data
+    if isinstance(raw_data, ArrowTable):
+        # The schema first, so that an empty table is created too
+        chunks = itertools.chain([raw_data.head(0)], raw_data.iter_batches(LOAD_CHUNK_ROWS))
+        for i, chunk in enumerate(chunks):
+            chunk.to_sql(table_data_model.raw_data_name, engine, if_exists="replace" if i == 0 else "append")
+    else:
+        raw_data.to_sql(table_data_model.raw_data_name, engine, if_exists="replace")
+
+
+def _open_cached_db(db_path: str, cache_key: str) -> SQLDatabase:
+    # Read-only, the cached databases are shared and must keep matching their key
+    db = SQLDatabase.from_sqlite_file(db_path)
+    db.set_fingerprint(cache_key)
+    # For the index advisor, which indexes the cached databases in place
+    db.query_log_path = db_cache.get_log_path(cache_key)
+    return db
+
 
 class DatabaseDataModel(DataModel):
     """A data model for database."""
 
+    cache_key: Optional[str] = None
+    """Key of the database in the db cache, None if the database is not a materialization of tables."""
+    cache_holder: Optional[str] = None
+    """Id referencing the cache entry, i.e., the id of the table the database was materialized from."""
+    base_key: Optional[str] = None
+    """Key of the database the tables were added to (e.g., the fingerprint of an uploaded one), None if made of tables."""
+    synced_tables: Dict[str, str] = {}
+    """Name -> fingerprint of the tables loaded from table data models.
+
+    Only kept by this object: the agent process syncs a copy of the grounding sources, lost at the end of the turn.
+    """
+
+    @classmethod
+    def from_table_data_model(cls, table_data_model: TableDataModel, sql_engine: str = SQL_ENGINE) -> DatabaseDataModel:
+        synced_tables = {table_data_model.raw_data_name: table_data_model.get_fingerprint()}
+        if sql_engine == "duckdb":
+            db = SQLDatabase.from_duckdb({table_data_model.raw_data_name: _get_duckdb_source(table_data_model)})
+            db.set_fingerprint(get_tables_key(None, synced_tables))
+            return cls.from_raw_data(
+                raw_data=db, raw_data_name=table_data_model.raw_data_name, synced_tables=synced_tables
+            )
+
+        # Keyed by the content of the table, so the same upload is only imported once across chats and restarts
+        cache_key = get_tables_key(None, synced_tables)
+        db_path = db_cache.materialize(
+            cache_key,
+            table_data_model.raw_data_name,
+            holder=table_data_model.id,
+            write=lambda path: _write_table(table_data_model, path),
+        )
+        return cls.from_raw_data(
+            raw_data=_open_cached_db(db_path, cache_key),
+            raw_data_name=table_data_model.raw_data_name,
+            cache_key=cache_key,
+            cache_holder=table_data_model.id,
+            synced_tables=synced_tables,
+        )
+
     @classmethod
-    def from_table_data_model(cls, table_data_model: TableDataModel) -> DatabaseDataModel:
-        os.makedirs(f".db_cache/{table_data_model.id}", exist_ok=True)
-        db_path = os.path.join(
-            f".db_cache/{table_data_model.id}", os.path.splitext(table_data_model.raw_data_name)[0] + ".db"
+    def from_sqlite_file(cls, db_path: str, raw_data_name: str) -> DatabaseDataModel:
+        """An uploaded SQLite database, opened read-only."""
+        return cls.from_raw_data(
+            raw_data=SQLDatabase.from_sqlite_file(db_path), raw_data_name=raw_data_name, raw_data_path=db_path
         )
-        engine = create_engine(f"sqlite:///{db_path}")
-        table_data_model.raw_data.to_sql(table_data_model.raw_data_name, engine, if_exists="replace")
-        db = SQLDatabase(engine)
-        return cls.from_raw_data(raw_data=db, raw_data_name=table_data_model.raw_data_name)
 
     def insert_table_data_model(self, table_data_model: TableDataModel) -> None:
-        engine = self.raw_data.engine
-        table_data_model.raw_data.to_sql(table_data_model.raw_data_name, engine)
+        self._sync_tables(
+            {**self.synced_tables, table_data_model.raw_data_name: table_data_model.get_fingerprint()},
+            {table_data_model.raw_data_name: table_data_model},
+        )
+
+    def sync_tables(self, table_data_models: List[TableDataModel]) -> None:
+        """Make the tables loaded into the database those of table_data_models, only loading the new or changed ones.
+
+        The tables no longer given are dropped, the database's own tables (e.g., of an uploaded database) are kept.
+        Nothing is done when the tables are already in sync, i.e., on the later calls of the same agent turn. A new
+        turn syncs a fresh copy: a SQLite database is then opened from the db cache, keyed by the set of tables, and
+        only loaded when that set was not seen before.
+        """
+        sources = {table_data_model.raw_data_name: table_data_model for table_data_model in table_data_models}
+        self._sync_tables({name: source.get_fingerprint() for name, source in sources.items()}, sources)
+
+    def _sync_tables(self, fingerprints: Dict[str, str], sources: Dict[str, TableDataModel]) -> None:
+        if fingerprints == self.synced_tables:
+            return
+        loaded = [name for name, fingerprint in fingerprints.items() if self.synced_tables.get(name) != fingerprint]
+        dropped = [name for name in self.synced_tables if name not in fingerprints]
+        db = self.raw_data
+        if db.dialect == "duckdb":
+            for name in dropped:
+                db.unregister_table(name)
+            for name in loaded:
+                db.register_table(name, _get_duckdb_source(sources[name]))
+            db.set_fingerprint(get_tables_key(self.base_key, fingerprints))
+        elif db.database_path is None:
+            with db.engine.begin() as connection:
+                for name in dropped:
+                    connection.exec_driver_sql(f'DROP TABLE IF EXISTS "{name}"')
+            for name in loaded:
+                _write_table_to_engine(sources[name], db.engine)
+            # Make the new tables visible in the table info given to the LLM
+            db.refresh_tables()
+        else:
+            self._sync_cached_tables(fingerprints, sources)
+        self.synced_tables = fingerprints
+
+    def _sync_cached_tables(self, fingerprints: Dict[str, str], sources: Dict[str, TableDataModel]) -> None:
+        # SQLite databases are opened read-only, the synced tables make a new entry of the db cache
+        db = self.raw_data
+        if self.cache_key is None and not self.synced_tables:
+            # Tables added to an uploaded database, keyed by its content
+            self.base_key = fingerprint_file(db.database_path)
+        cache_key = get_tables_key(self.base_key, fingerprints)
+        cache_holder = self.cache_holder or self.id
+
+        # Start from the current database, or from a cached one only missing a table if it saves loading others
+        start_key, start_path, start_tables = None, db.database_path, self.synced_tables
+        if not os.path.isfile(start_path):
+            # A garbage-collected database made of tables only, made again from them
+            start_path, start_tables = None, {}
+        loaded = [name for name, fingerprint in fingerprints.items() if start_tables.get(name) != fingerprint]
+        for name in loaded if len(loaded) > 1 else []:
+            subset = {other: fingerprint for other, fingerprint in fingerprints.items() if other != name}
+            subset_key = get_tables_key(self.base_key, subset)
+            subset_path = db_cache.get_path(subset_key, self.raw_data_name) if subset else None
+            if subset_path is not None and os.path.isfile(subset_path):
+                start_key, start_path, start_tables = subset_key, subset_path, subset
+                break
+
+        def write(path: str) -> None:
+            if start_path is None:
+                for name in fingerprints:
+                    _write_table(sources[name], path)
+                return
+            shutil.copyfile(start_path, path)
+            with closing(sqlite3.connect(path)) as connection, connection:
+                for name in start_tables:
+                    if name not in fingerprints:
+                        connection.execute(f'DROP TABLE IF EXISTS "{name}"')
+            for name, fingerprint in fingerprints.items():
+                if start_tables.get(name) != fingerprint:
+                    _write_table(sources[name], path)
+
+        if start_key is not None:
+            # Not garbage-collected while copied
+            db_cache.acquire(start_key, cache_holder)
+        try:
+            db_path = db_cache.materialize(cache_key, self.raw_data_name, holder=cache_holder, write=write)
+        finally:
+            if start_key is not None:
+                db_cache.release(start_key, cache_holder)
+        self.release()
+        self.raw_data = _open_cached_db(db_path, cache_key)
+        self.cache_key, self.cache_holder = cache_key, cache_holder
+
+    def refresh(self, table_data_models: List[TableDataModel]) -> None:
+        """Refresh the reference to the cached database, each time it is used, so that it is not taken for leaked.
+
+        A database garbage-collected anyway (e.g., unused for longer than the reference TTL) is materialized again,
+        from the uploaded database, if any, and table_data_models.
+        """
+        if self.cache_key is None:
+            return
+        db_cache.acquire(self.cache_key, self.cache_holder)
+        if os.path.isfile(self.raw_data.database_path):
+            return
+        logger.bind(msg_head="DB cache entry missing").debug(self.cache_key)
+        if isinstance(self.raw_data_path, str) and os.path.isfile(self.raw_data_path):
+            self.raw_data = SQLDatabase.from_sqlite_file(self.raw_data_path)
+        self.synced_tables = {}
+        self.sync_tables(table_data_models)
+
+    def release(self) -> None:
+        """Drop the reference to the cached database, which can then be garbage-collected."""
+        if self.cache_key is not None:
+            db_cache.release(self.cache_key, self.cache_holder)
 
     def get_llm_side_data(self, serialize_method: str = "database", num_visible_rows: int = 3) -> Any:
         db = self.raw_data
@@ -38,13 +233,13 @@ class DatabaseDataModel(DataModel):
     def get_human_side_data(self) -> Any:
         # In the frontend, we show the first few rows of each table
         engine = self.raw_data.engine
-        inspector = inspect(engine)
-        table_names = inspector.get_table_names()
+        # Registered DuckDB tables are views, which the inspector does not list as tables
+        table_names = sorted(self.raw_data.get_usable_table_names())
 
         # Loop through each table name, creating a DataFrame from the first three rows of each table
         df_dict = {}
         for table_name in table_names:
-            query = f"SELECT * FROM {table_name} LIMIT 3"
+            query = f'SELECT * FROM "{table_name}" LIMIT 3'
             df = pd.read_sql(query, engine)
             df_dict[table_name] = df
         return df_dict
@@ -0,0 +1,151 @@
+"""Content-addressed cache of the SQLite materializations of tables, shared by chats, processes and restarts."""
+import hashlib
+import os
+import shutil
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+DB_CACHE_DIR = os.getenv("DB_CACHE_DIR", ".db_cache")
+DB_CACHE_MAX_BYTES = int(os.getenv("DB_CACHE_MAX_BYTES", 10 * 1024**3))
+# Unreferenced entries unused for longer than this are removed
+DB_CACHE_MAX_AGE = int(os.getenv("DB_CACHE_MAX_AGE", 7 * 24 * 3600))
+# References not refreshed for longer than this are considered leaked, e.g., by a killed process
+DB_CACHE_REF_TTL = int(os.getenv("DB_CACHE_REF_TTL", 24 * 3600))
+REFS_DIR = "refs"
+QUERY_LOG_NAME = "query_log.jsonl"
+
+
+def get_entry_key(base_key: Optional[str], fingerprint: str, name: str) -> str:
+    """Key of the database made of the entry `base_key` (None for an empty database) plus the table `name`."""
+    return hashlib.blake2b(f"{base_key or ''}\0{fingerprint}\0{name}".encode("utf-8"), digest_size=16).hexdigest()
+
+
+def get_tables_key(base_key: Optional[str], tables: Dict[str, str]) -> Optional[str]:
+    """Key of the entry base_key plus the tables {name: fingerprint}, the same whatever the order they were added in."""
+    key = base_key
+    for name, fingerprint in sorted(tables.items()):
+        key = get_entry_key(key, fingerprint, name)
+    return key
+
+
+class DBCache:
+    """Materialized databases stored as <cache_dir>/<key>/<name>.db.
+
+    An entry is referenced by its holders (e.g., the id of the table data model using it) with one file per holder
+    in <key>/refs, so that references work across processes. Only unreferenced entries are garbage-collected.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = DB_CACHE_DIR,
+        max_bytes: int = DB_CACHE_MAX_BYTES,
+        max_age: int = DB_CACHE_MAX_AGE,
+        ref_ttl: int = DB_CACHE_REF_TTL,
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.ref_ttl = ref_ttl
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def get_path(self, key: str, name: str) -> str:
+        return os.path.join(self._entry_dir(key), os.path.splitext(name)[0] + ".db")
+
+    def get_log_path(self, key: str) -> str:
+        """Log of the queries run on the entry's database."""
+        return os.path.join(self._entry_dir(key), QUERY_LOG_NAME)
+
+    def acquire(self, key: str, holder: str) -> None:
+        """Reference the entry, or refresh the reference of the holder."""
+        refs_dir = os.path.join(self._entry_dir(key), REFS_DIR)
+        os.makedirs(refs_dir, exist_ok=True)
+        with open(os.path.join(refs_dir, holder), "a"):
+            pass
+        os.utime(os.path.join(refs_dir, holder))
+        # The entry mtime is its last use, for the garbage collection
+        os.utime(self._entry_dir(key))
+
+    def release(self, key: str, holder: str) -> None:
+        try:
+            os.remove(os.path.join(self._entry_dir(key), REFS_DIR, holder))
+        except FileNotFoundError:
+            pass
+
+    def get_refcount(self, key: str) -> int:
+        """Number of live references of the entry, the leaked ones are removed on the way."""
+        refs_dir = os.path.join(self._entry_dir(key), REFS_DIR)
+        if not os.path.isdir(refs_dir):
+            return 0
+        refcount, now = 0, time.time()
+        for holder in os.listdir(refs_dir):
+            ref_path = os.path.join(refs_dir, holder)
+            try:
+                if now - os.path.getmtime(ref_path) > self.ref_ttl:
+                    os.remove(ref_path)
+                else:
+                    refcount += 1
+            except FileNotFoundError:
+                pass
+        return refcount
+
+    def materialize(self, key: str, name: str, holder: str, write: Callable[[str], None]) -> str:
+        """Get the path of the entry's database, calling write(path) to create it on a miss."""
+        self.acquire(key, holder)
+        path = self.get_path(key, name)
+        if os.path.exists(path):
+            logger.bind(msg_head="DB cache hit").trace(path)
+            return path
+        # Written aside and moved in place, so a database in the cache is always complete
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        logger.bind(msg_head="DB cache materialized").trace(path)
+        self.collect_garbage()
+        return path
+
+    def _list_entries(self) -> List[Tuple[str, float, int]]:
+        """(key, last use, bytes) of all the entries."""
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for key in os.listdir(self.cache_dir):
+            entry_dir = self._entry_dir(key)
+            if not os.path.isdir(entry_dir):
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(entry_dir, file_name))
+                for file_name in os.listdir(entry_dir)
+                if os.path.isfile(os.path.join(entry_dir, file_name))
+            )
+            entries.append((key, os.path.getmtime(entry_dir), size))
+        return entries
+
+    def collect_garbage(self) -> List[str]:
+        """Remove the unreferenced entries too old, then the least recently used ones until the cache fits."""
+        try:
+            entries = sorted(self._list_entries(), key=lambda entry: entry[1])
+        except FileNotFoundError:
+            # Raced with another process collecting garbage
+            return []
+        total_bytes = sum(size for _, _, size in entries)
+        now = time.time()
+        removed = []
+        for key, last_used, size in entries:
+            if now - last_used <= self.max_age and total_bytes <= self.max_bytes:
+                break
+            if self.get_refcount(key) > 0:
+                continue
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            total_bytes -= size
+            removed.append(key)
+        if removed:
+            logger.bind(msg_head="DB cache garbage collected").debug(removed)
+        return removed
@@ -0,0 +1,239 @@
+"""Index advisor of the cached databases: indexes the columns the logged queries keep filtering, joining or grouping on.
+
+The agent processes log their queries next to the cached database (see `SQLDatabase.query_log_path`), the advisor runs
+in the backend, and builds the indexes on a copy of the database which then replaces it. Processes which have the
+database open keep reading the previous file, the next ones open the indexed one.
+"""
+import json
+import os
+import shutil
+import sqlite3
+import time
+from collections import Counter
+from contextlib import closing
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import sqlparse
+from loguru import logger
+from sqlparse import tokens as T
+
+from real_agents.adapters.data_model.db_cache import DBCache
+from real_agents.adapters.query_log import read_queries
+from real_agents.adapters.sql_guard import TABLE_ALIAS_PATTERN, statement_guard
+
+# Queries using a column before it is indexed
+INDEX_USAGE_THRESHOLD = int(os.getenv("INDEX_USAGE_THRESHOLD", 3))
+# Smaller tables are scanned fast enough
+INDEX_MIN_ROWS = int(os.getenv("INDEX_MIN_ROWS", 10000))
+INDEX_ADVISOR_INTERVAL = int(os.getenv("INDEX_ADVISOR_INTERVAL", 60))
+INDEX_REPORT_NAME = "indexes.json"
+# Logged queries timed before and after indexing, to report the speedup
+BENCHMARK_QUERIES = 3
+BENCHMARK_TIMEOUT = 10
+
+# Clauses whose columns an index helps with, and the keywords ending them
+USAGE_CLAUSES = {"WHERE": "filter", "ON": "join", "GROUP BY": "group"}
+CLAUSE_END_KEYWORDS = {"SELECT", "FROM", "ORDER BY", "LIMIT", "UNION", "UNION ALL", "EXCEPT", "INTERSECT", "WINDOW"}
+
+
+def _unquote(name: str) -> str:
+    return name[1:-1].replace('""', '"') if name[:1] in ('"', "`", "[") else name
+
+
+def extract_column_usage(command: str, columns_by_table: Dict[str, Set[str]]) -> Set[Tuple[str, str, str]]:
+    """(table, column, kind) of the columns the query filters, joins or groups on, kind being one of USAGE_CLAUSES.
+
+    Names are resolved against columns_by_table, so anything else (functions, literals, aliases) is ignored.
+    """
+    tables = {table.lower(): table for table in columns_by_table}
+    aliases = {alias.lower(): _unquote(table) for table, alias in TABLE_ALIAS_PATTERN.findall(command)}
+    usage = set()
+    for statement in sqlparse.parse(command):
+        tokens = [token for token in statement.flatten() if not token.is_whitespace and token.ttype not in T.Comment]
+        names = {_unquote(token.value).lower() for token in tokens if token.ttype in T.Name or token.ttype in T.String.Symbol}
+        referenced = [table for name, table in tables.items() if name in names]
+        kind, qualifier, previous = None, None, None
+        for token in tokens:
+            if token.is_keyword and token.normalized in USAGE_CLAUSES:
+                kind = USAGE_CLAUSES[token.normalized]
+            elif token.is_keyword and (token.normalized in CLAUSE_END_KEYWORDS or token.normalized.endswith("JOIN")):
+                kind = None
+            elif kind is not None and (token.ttype in T.Name or token.ttype in T.String.Symbol or token.is_keyword):
+                name = _unquote(token.value)
+                if previous is not None and previous.value == ".":
+                    table = tables.get(aliases.get(qualifier.lower(), qualifier).lower()) if qualifier else None
+                    candidates = [table] if table is not None else []
+                else:
+                    qualifier, candidates = name, referenced
+                for table in candidates:
+                    for column in columns_by_table[table]:
+                        if column.lower() == name.lower():
+                            usage.add((table, column, kind))
+            previous = token
+    return usage
+
+
+def _get_columns_by_table(connection: sqlite3.Connection) -> Dict[str, Set[str]]:
+    tables = [row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    return {
+        table: {row[1] for row in connection.execute(f"PRAGMA table_info({_quote(table)})")}
+        for table in tables
+        if not table.startswith("sqlite_")
+    }
+
+
+def _get_indexed_columns(connection: sqlite3.Connection, table: str) -> Set[str]:
+    """Columns leading an index of the table, which an index on the column would not improve on."""
+    indexed = set()
+    for index in connection.execute(f"PRAGMA index_list({_quote(table)})").fetchall():
+        index_columns = connection.execute(f"PRAGMA index_info({_quote(index[1])})").fetchall()
+        if index_columns:
+            indexed.add(index_columns[0][2])
+    return indexed
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _time_query(db_path: str, command: str) -> Optional[float]:
+    """Milliseconds to run the query to its last row, None if it failed or timed out."""
+    with closing(sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)) as connection:
+        start_time = time.perf_counter()
+        try:
+            with statement_guard(connection, BENCHMARK_TIMEOUT):
+                connection.execute(command).fetchall()
+        except Exception:
+            return None
+        return (time.perf_counter() - start_time) * 1000
+
+
+class IndexAdvisor:
+    """Count the column usage of the queries logged for each entry of the db cache, and index the columns used often.
+
+    The usage counts are kept in memory along the log offsets, so each log line is read once.
+    """
+
+    def __init__(
+        self,
+        cache: DBCache,
+        usage_threshold: int = INDEX_USAGE_THRESHOLD,
+        min_rows: int = INDEX_MIN_ROWS,
+        interval: int = INDEX_ADVISOR_INTERVAL,
+    ):
+        self.cache = cache
+        self.usage_threshold = usage_threshold
+        self.min_rows = min_rows
+        self.interval = interval
+        # Entry key -> (log offset, (table, column) -> number of queries using it, queries by (table, column))
+        self._state: Dict[str, Tuple[int, Counter, Dict[Tuple[str, str], List[str]]]] = {}
+
+    def _get_db_path(self, key: str) -> Optional[str]:
+        entry_dir = os.path.join(self.cache.cache_dir, key)
+        db_files = [name for name in os.listdir(entry_dir) if name.endswith(".db")]
+        return os.path.join(entry_dir, db_files[0]) if len(db_files) == 1 else None
+
+    def advise(self, key: str) -> List[Dict[str, Any]]:
+        """Read the new queries logged for the entry, and index the columns crossing the usage threshold.
+
+        Returns the report of the indexes built, if any.
+        """
+        offset, usage, queries_by_column = self._state.get(key, (0, Counter(), {}))
+        queries, new_offset = read_queries(self.cache.get_log_path(key), offset)
+        self._state[key] = (new_offset, usage, queries_by_column)
+        db_path = self._get_db_path(key)
+        if not queries or db_path is None:
+            return []
+
+        with closing(sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)) as connection:
+            columns_by_table = _get_columns_by_table(connection)
+            for query in queries:
+                columns = {(table, column) for table, column, _ in extract_column_usage(query["sql"], columns_by_table)}
+                for column in columns:
+                    usage[column] += 1
+                    queries_by_column.setdefault(column, []).append(query["sql"])
+            candidates = []
+            for (table, column), count in usage.items():
+                if count < self.usage_threshold or column in _get_indexed_columns(connection, table):
+                    continue
+                rows = connection.execute(f"SELECT MAX(rowid) FROM {_quote(table)}").fetchone()[0] or 0
+                if rows >= self.min_rows:
+                    candidates.append((table, column))
+        if not candidates:
+            return []
+        return self.build_indexes(key, db_path, candidates, queries_by_column)
+
+    def build_indexes(
+        self,
+        key: str,
+        db_path: str,
+        columns: List[Tuple[str, str]],
+        queries_by_column: Dict[Tuple[str, str], List[str]],
+    ) -> List[Dict[str, Any]]:
+        """Index the (table, column) pairs on a copy of the database, which then replaces it, reporting the speedups."""
+        tmp_path = f"{db_path}.{os.getpid()}.index.tmp"
+        report = []
+        try:
+            shutil.copyfile(db_path, tmp_path)
+            with closing(sqlite3.connect(tmp_path)) as connection, connection:
+                for table, column in columns:
+                    index_name = f"ix_advised_{table}_{column}"
+                    connection.execute(
+                        f"CREATE INDEX IF NOT EXISTS {_quote(index_name)} ON {_quote(table)} ({_quote(column)})"
+                    )
+                # Statistics for the planner to choose between the indexes
+                connection.execute("ANALYZE")
+            for table, column in columns:
+                benchmarks = []
+                for command in list(dict.fromkeys(queries_by_column[(table, column)]))[-BENCHMARK_QUERIES:]:
+                    before_ms, after_ms = _time_query(db_path, command), _time_query(tmp_path, command)
+                    if before_ms is not None and after_ms is not None:
+                        benchmarks.append(
+                            {"sql": command, "before_ms": round(before_ms, 3), "after_ms": round(after_ms, 3)}
+                        )
+                report.append({"table": table, "column": column, "created": time.time(), "benchmarks": benchmarks})
+            # The entry may have been garbage-collected meanwhile, then there is nothing to replace
+            if not os.path.exists(db_path):
+                return []
+            os.replace(tmp_path, db_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        report_path = os.path.join(os.path.dirname(db_path), INDEX_REPORT_NAME)
+        try:
+            with open(report_path, "r", encoding="utf-8") as f:
+                previous_report = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            previous_report = []
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(previous_report + report, f, indent=2)
+        for entry in report:
+            before = sum(benchmark["before_ms"] for benchmark in entry["benchmarks"])
+            after = sum(benchmark["after_ms"] for benchmark in entry["benchmarks"])
+            speedup = f"{before / after:.1f}x on {len(entry['benchmarks'])} logged queries" if after > 0 else "n/a"
+            logger.bind(msg_head="Index advised").info(f"{key}: {entry['table']}.{entry['column']}, speedup {speedup}")
+        return report
+
+    def advise_all(self) -> List[Dict[str, Any]]:
+        report = []
+        if not os.path.isdir(self.cache.cache_dir):
+            return report
+        for key in os.listdir(self.cache.cache_dir):
+            if not os.path.isfile(self.cache.get_log_path(key)):
+                continue
+            try:
+                report += self.advise(key)
+            except (OSError, sqlite3.Error) as e:
+                # e.g., the entry was garbage-collected while being read
+                logger.bind(msg_head="Index advisor error").debug(f"{key}: {e}")
+        return report
+
+    def run(self) -> None:
+        """Advise forever, meant to run in a daemon thread of the backend."""
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.advise_all()
+            except Exception as e:
+                logger.bind(msg_head="Index advisor error").error(str(e))
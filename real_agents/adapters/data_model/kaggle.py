@@ -1,12 +1,17 @@
 from __future__ import annotations
 
-from typing import Any, Dict
+import hashlib
+import os
+from typing import Any, Dict, List, Optional
 
 import pandas as pd
 
 from real_agents.adapters.data_model.base import DataModel
+from real_agents.adapters.data_model.pagination import DEFAULT_PAGE_SIZE, get_table_page, to_react_table
+from real_agents.adapters.data_model.shared_table import is_sharing_tables, share_dataframe
 from real_agents.adapters.data_model.templates.skg_templates.database_templates import serialize_db
 from real_agents.adapters.data_model.templates.skg_templates.table_templates import serialize_df
+from real_agents.adapters.data_model.utils import fingerprint_file
 import json
 
 
@@ -18,23 +23,72 @@ class KaggleDataModel(DataModel):
     raw_data_name is Dict[str, str]
     """
 
-    def get_llm_side_data(self, serialize_method: str = "tsv", num_visible_rows: int = 3) -> Any:
-        formatted_tables = []
-        for _raw_data_path in self.raw_data_path:
-            table_data = self.raw_data[_raw_data_path]
-            table_name = self.raw_data_name[_raw_data_path]
-            table_path = _raw_data_path
-            formatted_table = serialize_df(table_data, table_name, table_path, serialize_method, num_visible_rows)
-            formatted_tables.append(formatted_table)
-        return "\n".join(formatted_tables)
+    def _get_table_fingerprint(self, path: str) -> str:
+        return fingerprint_file(path) if os.path.isfile(path) else f"{self.id}/{path}"
+
+    def get_fingerprint(self) -> str:
+        # Combine the fingerprints of all the tables of the dataset
+        fingerprints = [self._get_table_fingerprint(path) for path in self.raw_data_path]
+        return hashlib.blake2b("\n".join(fingerprints).encode("utf-8"), digest_size=16).hexdigest()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Pickled into the agent process of each turn, the large tables as handles to their shared files
+        state = super().__getstate__()
+        if is_sharing_tables() and isinstance(self.raw_data, dict):
+            raw_data = {
+                path: share_dataframe(table, self._get_table_fingerprint(path))
+                if isinstance(table, pd.DataFrame)
+                else table
+                for path, table in self.raw_data.items()
+            }
+            state["__dict__"] = {**state["__dict__"], "raw_data": raw_data}
+        return state
+
+    @classmethod
+    def from_raw_data(
+        cls, raw_data: Any, raw_data_name: Any = "<default_name>", raw_data_path: Any = "<default_path>", **kwargs: Any
+    ) -> KaggleDataModel:
+        dataset = super().from_raw_data(raw_data, raw_data_name, raw_data_path, **kwargs)
+        if isinstance(raw_data, dict):
+            # Serialized once the dataset is loaded, so that the agent turns reuse it
+            dataset.get_llm_side_data()
+        return dataset
+
+    def get_llm_side_data(
+        self, serialize_method: str = "tsv", num_visible_rows: int = 3, max_tokens: int = 1000
+    ) -> Any:
+        def serialize() -> str:
+            formatted_tables = []
+            for _raw_data_path in self.raw_data_path:
+                table_data = self.raw_data[_raw_data_path]
+                if not isinstance(table_data, pd.DataFrame):
+                    # A shared table, only the visible rows are read
+                    table_data = table_data.head(num_visible_rows)
+                table_name = self.raw_data_name[_raw_data_path]
+                table_path = _raw_data_path
+                formatted_table = serialize_df(
+                    table_data, table_name, table_path, serialize_method, num_visible_rows, max_tokens
+                )
+                formatted_tables.append(formatted_table)
+            return "\n".join(formatted_tables)
+
+        return self._get_cached_llm_side_data((serialize_method, num_visible_rows, max_tokens), serialize)
 
     @staticmethod
-    def to_react_table(table: pd.DataFrame) -> str:
-        columns = list(map(lambda item: {"accessorKey": item, "header": item}, table.columns.tolist()))
-        # FIXME: NaN may not be handled here.
-        data = table.fillna("").to_dict(orient="records")
-        table = json.dumps({"columns": columns, "data": data})
-        return table
+    def to_react_table(table: pd.DataFrame, source: Optional[Dict[str, Any]] = None) -> str:
+        # All the rows, or the first page with the source to fetch the others through the table page API
+        return to_react_table(table, source)
+
+    def get_page(
+        self,
+        table_path: str,
+        page_index: int = 0,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        sorting: Optional[List[Dict[str, Any]]] = None,
+        filters: Optional[List[Dict[str, Any]]] = None,
+    ) -> Dict[str, Any]:
+        """A page of one of the tables of the dataset, see `pagination.get_table_page`."""
+        return get_table_page(self.raw_data[table_path], page_index, page_size, sorting, filters)
 
     def get_human_side_data(self) -> Any:
         # In the frontend, we show the first few rows of each table
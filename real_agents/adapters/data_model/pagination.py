@@ -0,0 +1,208 @@
+"""Pages of tables for the front-end table, sorted and filtered on the server.
+
+Only the visible page is converted to JSON records, along with the number of rows matching the filters. The sorting
+and filters follow the state of the front-end table: `sorting` is a list of {"id": column, "desc": bool}, `filters` a
+list of {"id": column, "value": value}, a [min, max] value (either may be None) being a range and any other value a
+case-insensitive substring of the column values.
+"""
+import json
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from real_agents.adapters.schema import SQLDatabase, _quote_identifier
+
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", 50))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 1000))
+
+
+def _is_range(value: Any) -> bool:
+    return isinstance(value, (list, tuple)) and len(value) == 2
+
+
+def _is_empty(value: Any) -> bool:
+    return value in (None, "", []) or (_is_range(value) and all(bound in (None, "") for bound in value))
+
+
+def page_window(page_index: int, page_size: int) -> Tuple[int, int]:
+    """The rows of the page, from start to stop, the page size being capped."""
+    page_size = min(max(int(page_size), 1), MAX_PAGE_SIZE)
+    start = max(int(page_index), 0) * page_size
+    return start, start + page_size
+
+
+def _resolve_column(columns: pd.Index, column_id: Any) -> Any:
+    """The column named column_id, compared as strings since the front-end only knows the names as strings."""
+    for column in columns:
+        if str(column) == str(column_id):
+            return column
+    raise KeyError(f"Unknown column {column_id}")
+
+
+def _bound(series: pd.Series, value: Any) -> Any:
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return pd.Timestamp(value)
+    if pd.api.types.is_numeric_dtype(series):
+        return float(value)
+    return str(value)
+
+
+def _filter_mask(series: pd.Series, value: Any) -> np.ndarray:
+    if _is_range(value):
+        low, high = value
+        mask = series.notna()
+        if low not in (None, ""):
+            mask &= series >= _bound(series, low)
+        if high not in (None, ""):
+            mask &= series <= _bound(series, high)
+        return mask.to_numpy()
+    needle = str(value).lower()
+    return (series.notna() & series.astype(str).str.lower().str.contains(needle, regex=False)).to_numpy()
+
+
+def select_rows(
+    get_column: Callable[[Any], pd.Series],
+    columns: pd.Index,
+    sorting: Optional[List[Dict[str, Any]]] = None,
+    filters: Optional[List[Dict[str, Any]]] = None,
+) -> Optional[np.ndarray]:
+    """Positions of the rows matching the filters, in the sorting order, None if the table is neither sorted nor
+    filtered. Only the columns sorted or filtered on are read, through get_column."""
+    positions = None
+    for column_filter in filters or []:
+        if _is_empty(column_filter.get("value")):
+            continue
+        series = get_column(_resolve_column(columns, column_filter["id"]))
+        mask = _filter_mask(series.reset_index(drop=True), column_filter["value"])
+        positions = np.flatnonzero(mask) if positions is None else positions[mask[positions]]
+    if sorting:
+        names = [_resolve_column(columns, sort["id"]) for sort in sorting]
+        keys = pd.DataFrame({i: get_column(name).to_numpy() for i, name in enumerate(names)})
+        if positions is not None:
+            keys = keys.iloc[positions]
+        # Stable, the rows of equal keys keep their order, and missing values last whatever the direction
+        keys = keys.sort_values(
+            by=list(range(len(names))),
+            ascending=[not sort.get("desc", False) for sort in sorting],
+            kind="stable",
+            na_position="last",
+        )
+        positions = keys.index.to_numpy()
+    return positions
+
+
+def to_records(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """JSON-safe records, missing values as None and dates in ISO format."""
+    df = df.copy(deep=False)
+    df.columns = [str(column) for column in df.columns]
+    return json.loads(df.to_json(orient="records", date_format="iso", default_handler=str))
+
+
+def make_page(
+    df: pd.DataFrame, total: int, page_index: int, page_size: int, columns: Optional[List[Any]] = None
+) -> Dict[str, Any]:
+    """The page as the front-end table takes it, with the number of rows of all the pages."""
+    columns = df.columns.tolist() if columns is None else columns
+    return {
+        "columns": [{"accessorKey": str(column), "header": str(column)} for column in columns],
+        "data": to_records(df),
+        "total": int(total),
+        "page_index": int(page_index),
+        "page_size": int(page_size),
+    }
+
+
+def get_table_page(
+    table: Any,
+    page_index: int = 0,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    sorting: Optional[List[Dict[str, Any]]] = None,
+    filters: Optional[List[Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """A page of a DataFrame or an ArrowTable.
+
+    The page of a table neither sorted nor filtered is a window by position, a slice of the Arrow IPC mapping or of
+    the Parquet row groups it falls in for an ArrowTable. Otherwise the positions of the matching rows are computed
+    from the sorted and filtered columns only, and the rows of the page are taken at their positions.
+    """
+    start, stop = page_window(page_index, page_size)
+    get_column = (lambda name: table[name]) if isinstance(table, pd.DataFrame) else table.column
+    positions = select_rows(get_column, table.columns, sorting, filters)
+    if positions is None:
+        total = len(table)
+        if isinstance(table, pd.DataFrame):
+            page = table.iloc[start:stop]
+        else:
+            page = table.slice(start, min(stop, total))
+    else:
+        total = len(positions)
+        window = positions[start:stop]
+        if isinstance(table, pd.DataFrame):
+            page = table.iloc[window]
+        else:
+            # Read in file order, indexed by position, then put back in the sorting order
+            page = table.take(np.sort(window)).loc[window]
+    return make_page(page, total, page_index, stop - start, table.columns.tolist())
+
+
+def to_react_table(table: Any, source: Optional[Dict[str, Any]] = None, page_size: int = DEFAULT_PAGE_SIZE) -> str:
+    """The table for the front-end table.
+
+    With a source, the arguments locating the table for the table page API (e.g., {"activated_file": node}), only
+    the first page is sent along with the source, and the front-end table fetches the others, sorted and filtered by
+    the backend. Without, all the rows are sent, to be paged by the front-end table.
+    """
+    if source is None:
+        page = make_page(table if isinstance(table, pd.DataFrame) else table.to_pandas(), len(table), 0, len(table))
+    else:
+        page = {**get_table_page(table, 0, page_size), "source": source}
+    return json.dumps(page)
+
+
+def _sql_bound(value: Any) -> Any:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def get_query_page(
+    db: SQLDatabase,
+    command: str,
+    page_index: int = 0,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    sorting: Optional[List[Dict[str, Any]]] = None,
+    filters: Optional[List[Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """A page of the result of a read-only query on a SQLDatabase, sorted and filtered by the database.
+
+    Only the rows of the page are fetched, the rows matching the filters are counted by the database.
+    """
+    start, stop = page_window(page_index, page_size)
+    conditions, parameters = [], {}
+    for i, column_filter in enumerate(filters or []):
+        value = column_filter.get("value")
+        if _is_empty(value):
+            continue
+        column = _quote_identifier(str(column_filter["id"]))
+        if _is_range(value):
+            for j, (operator, bound) in enumerate(zip((">=", "<="), value)):
+                if bound not in (None, ""):
+                    conditions.append(f"{column} {operator} :filter_{i}_{j}")
+                    parameters[f"filter_{i}_{j}"] = _sql_bound(bound)
+        else:
+            # LIKE wildcards in the value are matched literally
+            pattern = str(value).lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            conditions.append(f"LOWER(CAST({column} AS VARCHAR)) LIKE :filter_{i} ESCAPE '\\'")
+            parameters[f"filter_{i}"] = f"%{pattern}%"
+    # Missing values last whatever the direction, as for the tables
+    order_by = ", ".join(
+        f"{column} IS NULL, {column} {'DESC' if sort.get('desc', False) else 'ASC'}"
+        for sort in sorting or []
+        for column in [_quote_identifier(str(sort["id"]))]
+    )
+    result = db.query_page(command, start, stop - start, " AND ".join(conditions), order_by, parameters)
+    page = pd.DataFrame.from_records(result.rows, columns=result.headers)
+    return make_page(page, result.total_rows, page_index, stop - start)
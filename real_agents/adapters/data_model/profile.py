@@ -0,0 +1,182 @@
+"""Column profiles of the tables, computed once at upload and persisted next to the data.
+
+Numeric, datetime and boolean columns are hashed once (vectorized), the hashes give both a HyperLogLog estimate of the
+distinct values and the most frequent values. Text columns are factorized, faster than hashing Python strings.
+"""
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+PROFILE_TOP_K = 5
+PROFILE_HISTOGRAM_BINS = 10
+# 2^12 registers, a standard error of about 1.04 / sqrt(2^12) = 1.6% on the distinct counts
+HLL_PRECISION = 12
+PROFILE_WORKERS = int(os.getenv("PROFILE_WORKERS", min(8, os.cpu_count() or 1)))
+# Next to the data file, hidden from the file tree
+PROFILE_DIR = ".profiles"
+# Columns with more distinct values than this share of their values are mostly unique, their top values are not kept
+UNIQUE_RATIO = 0.9
+# Bumped when the profile format changes, the persisted profiles are computed again
+PROFILE_VERSION = 1
+
+
+def _json_value(value: Any) -> Any:
+    if value is None or (pd.api.types.is_scalar(value) and pd.isna(value)):
+        return None
+    if isinstance(value, (pd.Timestamp, pd.Timedelta)):
+        return str(value)
+    if isinstance(value, np.generic):
+        value = value.item()
+    return value if isinstance(value, (str, int, float, bool)) else str(value)
+
+
+def hll_estimate(hashes: np.ndarray, precision: int = HLL_PRECISION) -> int:
+    """HyperLogLog estimate of the number of distinct 64-bit hashes."""
+    if len(hashes) == 0:
+        return 0
+    m = 1 << precision
+    registers = np.zeros(m, dtype=np.int64)
+    index = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+    # The next 52 bits, exact as floats: frexp gives their bit length, the rank is the position of the first 1
+    rest = ((hashes << np.uint64(precision)) >> np.uint64(12)).astype(np.float64)
+    rank = 53 - np.frexp(rest)[1]
+    ranks = pd.Series(rank).groupby(index).max()
+    registers[ranks.index.to_numpy()] = ranks.to_numpy()
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.power(2.0, -registers))
+    zeros = int(np.count_nonzero(registers == 0))
+    if estimate <= 2.5 * m and zeros > 0:
+        # Linear counting for the small cardinalities
+        estimate = m * np.log(m / zeros)
+    return int(round(estimate))
+
+
+def profile_column(series: pd.Series, top_k: int = PROFILE_TOP_K, bins: int = PROFILE_HISTOGRAM_BINS) -> Dict[str, Any]:
+    """dtype, null count, min/max (orderable non-text columns), distinct estimate, top-k values and histogram."""
+    values = series.dropna()
+    profile: Dict[str, Any] = {
+        "name": str(series.name),
+        "dtype": str(series.dtype),
+        "count": int(len(values)),
+        "null_count": int(len(series) - len(values)),
+        "min": None,
+        "max": None,
+        "distinct": 0,
+        "top_k": [],
+        "histogram": None,
+    }
+    if len(values) == 0:
+        return profile
+    is_numeric = pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values)
+    is_datetime = pd.api.types.is_datetime64_any_dtype(values)
+    if is_numeric or is_datetime or pd.api.types.is_bool_dtype(values):
+        profile["min"], profile["max"] = _json_value(values.min()), _json_value(values.max())
+        # Hashed in a vectorized way, the distinct values are estimated from the hashes
+        hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+        profile["distinct"] = hll_estimate(hashes)
+        if not pd.api.types.is_float_dtype(values) and profile["distinct"] < UNIQUE_RATIO * len(values):
+            # Counted by hash, each top hash is mapped back to its first value
+            for value_hash, count in pd.Series(hashes).value_counts().head(top_k).items():
+                position = int(np.argmax(hashes == value_hash))
+                profile["top_k"].append([_json_value(values.iloc[position]), int(count)])
+    else:
+        # Text and other object columns: hashing Python objects costs more than factorizing them, which counts the
+        # distinct values exactly in a single pass
+        try:
+            codes, uniques = pd.factorize(values)
+        except TypeError:
+            # Unhashable values, e.g., lists
+            codes, uniques = pd.factorize(values.astype(str))
+        profile["distinct"] = int(len(uniques))
+        if profile["distinct"] < UNIQUE_RATIO * len(values):
+            counts = np.bincount(codes)
+            top = np.argsort(-counts, kind="stable")[:top_k]
+            profile["top_k"] = [[_json_value(uniques[code]), int(counts[code])] for code in top]
+
+    if is_numeric or is_datetime:
+        numbers = values.to_numpy(dtype=np.int64 if is_datetime else np.float64)
+        numbers = numbers[np.isfinite(numbers)] if not is_datetime else numbers
+        if len(numbers) > 0:
+            counts, edges = np.histogram(numbers, bins=bins)
+            if is_datetime:
+                edges = [str(pd.Timestamp(int(edge))) for edge in edges]
+            else:
+                edges = [float(edge) for edge in edges]
+            profile["histogram"] = {"bin_edges": edges, "counts": counts.tolist()}
+    return profile
+
+
+def profile_table(table_data: Any, workers: int = PROFILE_WORKERS) -> Dict[str, Any]:
+    """Profile of each column of a DataFrame or an ArrowTable, in parallel across columns.
+
+    The columns of an ArrowTable are read one at a time by each worker.
+    """
+
+    def profile_position(position: int) -> Dict[str, Any]:
+        if isinstance(table_data, pd.DataFrame):
+            return profile_column(table_data.iloc[:, position])
+        return profile_column(table_data.column(position))
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        columns = list(pool.map(profile_position, range(table_data.shape[1])))
+    return {"version": PROFILE_VERSION, "num_rows": int(table_data.shape[0]), "columns": columns}
+
+
+def get_profile_path(raw_data_path: str) -> str:
+    directory, file_name = os.path.split(raw_data_path)
+    return os.path.join(directory, PROFILE_DIR, f"{file_name}.json")
+
+
+def load_profile(raw_data_path: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+    """The persisted profile of the data file, None if there is none for this version of the file."""
+    try:
+        with open(get_profile_path(raw_data_path), "r") as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if profile.get("fingerprint") != fingerprint or profile.get("version") != PROFILE_VERSION:
+        return None
+    return profile
+
+
+def save_profile(raw_data_path: str, fingerprint: str, profile: Dict[str, Any]) -> None:
+    path = get_profile_path(raw_data_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Written aside and renamed, so that a concurrent reader never sees a partial profile
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({**profile, "fingerprint": fingerprint}, f)
+    os.replace(tmp_path, path)
+
+
+def _format_value(value: Any) -> str:
+    return json.dumps(value) if isinstance(value, str) else str(value)
+
+
+def describe_profile(profile: Dict[str, Any], max_top_k: int = 3) -> str:
+    """One line per column, for the prompts, e.g., 'region (object): 0 missing, ~4 distinct, top: "n" (2723), ...'."""
+    lines = []
+    for column in profile["columns"]:
+        facts = [f"{column['null_count']} missing", f"~{column['distinct']} distinct"]
+        if column["min"] is not None:
+            facts.append(f"range [{column['min']}, {column['max']}]")
+        if column["top_k"]:
+            top = ", ".join(f"{_format_value(value)} ({count})" for value, count in column["top_k"][:max_top_k])
+            facts.append(f"top: {top}")
+        lines.append(f"{column['name']} ({column['dtype']}): {', '.join(facts)}")
+    return "\n".join(lines)
+
+
+def summarize_profile(profile: Dict[str, Any]) -> Dict[str, float]:
+    """Table level figures: rows, columns, missing values and average distinct values per column."""
+    columns: List[Dict[str, Any]] = profile["columns"]
+    return {
+        "num_rows": profile["num_rows"],
+        "num_columns": len(columns),
+        "null_count": sum(column["null_count"] for column in columns),
+        "distinct_avg": float(np.mean([column["distinct"] for column in columns])) if columns else 0.0,
+    }
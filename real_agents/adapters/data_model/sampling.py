@@ -0,0 +1,140 @@
+"""Stratified samples of large tables, on which the progressive mode answers approximately before the exact run."""
+import os
+from typing import Any, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# Tables with fewer rows are answered exactly right away
+PROGRESSIVE_MIN_ROWS = int(os.getenv("PROGRESSIVE_MIN_ROWS", 1000000))
+PROGRESSIVE_SAMPLE_ROWS = int(os.getenv("PROGRESSIVE_SAMPLE_ROWS", 100000))
+# Columns with more distinct values are not used as strata
+SAMPLE_MAX_STRATA = 100
+# Rows kept of each stratum (at most its size) whatever its share, so that the small groups are not missed
+SAMPLE_MIN_STRATUM_ROWS = 10
+# Rows looked at to pick the stratification column
+STRATA_PROBE_ROWS = 10000
+# Relative to the user's folder, i.e., the working directory of the kernel
+SAMPLE_DIR = ".samples"
+# Sums and counts are not scaled up: the strata are not sampled at the same rate, and the code is arbitrary
+APPROXIMATE_RESULT_HEADER = (
+    "[Approximate result computed on {description}, totals (sums, counts...) not extrapolated to the full tables;"
+    " the exact result follows once computed]\n"
+)
+APPROXIMATE_RESULT_FOOTER = "\n[End of the approximate result]\n"
+
+
+def _column(df: Any, position: int) -> pd.Series:
+    # ArrowTables only read the column
+    return df.iloc[:, position] if isinstance(df, pd.DataFrame) else df.column(position)
+
+
+def _pick_strata_position(df: Any) -> Optional[int]:
+    """Position of the categorical column with the most distinct values up to SAMPLE_MAX_STRATA, e.g., a region."""
+    probe = df.head(STRATA_PROBE_ROWS)
+    best_position, best_count = None, 1
+    for position in range(df.shape[1]):
+        dtype = df.dtypes.iloc[position]
+        if not (
+            pd.api.types.is_string_dtype(dtype)
+            or pd.api.types.is_categorical_dtype(dtype)
+            or pd.api.types.is_bool_dtype(dtype)
+        ):
+            continue
+        count = probe.iloc[:, position].nunique(dropna=False)
+        if best_count < count <= SAMPLE_MAX_STRATA:
+            best_position, best_count = position, count
+    # The probe may miss values of the full column
+    if best_position is None or _column(df, best_position).nunique(dropna=False) > SAMPLE_MAX_STRATA:
+        return None
+    return best_position
+
+
+def stratified_sample(df: Any, n_rows: int = PROGRESSIVE_SAMPLE_ROWS, seed: int = 0) -> pd.DataFrame:
+    """About n_rows rows sampled in proportion to the strata of a categorical column, uniformly if there is none.
+
+    Each stratum keeps at least SAMPLE_MIN_STRATUM_ROWS rows. The sample is deterministic, so that the databases
+    materialized from it are shared across processes, and the rows keep their order. df is a DataFrame or an
+    ArrowTable, of which only the stratification column and the sampled rows are read.
+    """
+    if len(df) <= n_rows:
+        return df if isinstance(df, pd.DataFrame) else df.to_pandas()
+    rng = np.random.default_rng(seed)
+    position = _pick_strata_position(df)
+    if position is None:
+        selected = rng.choice(len(df), n_rows, replace=False)
+    else:
+        # Missing values (-1) are a stratum too
+        codes = pd.factorize(_column(df, position))[0] + 1
+        counts = np.bincount(codes)
+        quotas = np.minimum(
+            counts, np.maximum(np.round(counts * n_rows / len(df)).astype(int), SAMPLE_MIN_STRATUM_ROWS)
+        )
+        # Rows of each stratum in random order, the first quota ones are kept
+        order = np.lexsort((rng.random(len(df)), codes))
+        sorted_codes = codes[order]
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        ranks = np.arange(len(df)) - starts[sorted_codes]
+        selected = order[ranks < quotas[sorted_codes]]
+    selected = np.sort(selected)
+    return df.iloc[selected] if isinstance(df, pd.DataFrame) else df.take(selected)
+
+
+def describe_samples(tables: List[Any]) -> str:
+    """E.g., 'stratified samples of "sales.csv" (0.83%: 100,000 of 12,000,000 rows)', for the tables having a sample."""
+    descriptions = [
+        f'"{table.raw_data_name}" ({100 * len(table.sample.raw_data) / len(table.raw_data):.2g}%: '
+        f"{len(table.sample.raw_data):,} of {len(table.raw_data):,} rows)"
+        for table in tables
+        if table.sample is not None
+    ]
+    return f"stratified samples of {', '.join(descriptions)}"
+
+
+def write_sample_file(table: Any, data_dir_splitter: str = "backend/data/") -> bool:
+    """Write the sample of an uploaded table under SAMPLE_DIR of its user's folder, at the same relative path and in
+    the same format as the upload, so that the code loading the upload loads the sample when run from SAMPLE_DIR.
+
+    Tables without a sample are linked, to be loaded in full. Returns whether a sample file is there, formats other
+    than CSV, TSV, Excel and Parquet are not sampled.
+    """
+    raw_data_path = table.raw_data_path
+    if not isinstance(raw_data_path, str) or data_dir_splitter not in raw_data_path:
+        return False
+    data_dir, relative_path = raw_data_path.rsplit(data_dir_splitter, 1)
+    user_id, _, pretty_path = relative_path.strip("/").partition("/")
+    sample_path = os.path.join(data_dir + data_dir_splitter, user_id, SAMPLE_DIR, pretty_path)
+    os.makedirs(os.path.dirname(sample_path), exist_ok=True)
+    if table.sample is None:
+        if not os.path.lexists(sample_path) and os.path.isfile(raw_data_path):
+            # Relative, to resolve in the kernel too
+            os.symlink(os.path.relpath(raw_data_path, os.path.dirname(sample_path)), sample_path)
+        return False
+
+    # The sample file is rewritten when the upload changes
+    id_path = f"{sample_path}.id"
+    if os.path.isfile(sample_path) and os.path.isfile(id_path):
+        with open(id_path, "r") as f:
+            if f.read() == table.sample.id:
+                return True
+    sample = table.sample.raw_data
+    if not isinstance(sample, pd.DataFrame):
+        # Shared with the agent process as an ArrowTable
+        sample = sample.to_pandas()
+    extension = os.path.splitext(pretty_path)[1].lower()
+    if extension not in (".csv", ".tsv", ".xlsx", ".parquet"):
+        return False
+    if os.path.lexists(sample_path):
+        # e.g., the link of the upload before it was large enough to be sampled
+        os.remove(sample_path)
+    if extension == ".csv":
+        sample.to_csv(sample_path, index=False)
+    elif extension == ".tsv":
+        sample.to_csv(sample_path, sep="\t", index=False)
+    elif extension == ".xlsx":
+        sample.to_excel(sample_path, index=False)
+    else:
+        sample.to_parquet(sample_path, index=False)
+    with open(id_path, "w") as f:
+        f.write(table.sample.id)
+    return True
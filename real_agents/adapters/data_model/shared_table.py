@@ -0,0 +1,117 @@
+"""Large DataFrames handed to the agent processes as memory-mapped Arrow files instead of pickled copies.
+
+Each agent turn runs in a new process which receives the grounding sources pickled. A DataFrame of at least
+SHARED_TABLE_MIN_ROWS rows is written once (per content) as an uncompressed Arrow IPC file, and pickled as an
+ArrowTable, i.e., as the file path: the processes map the file, its pages are shared through the page cache and never
+copied, so that starting a turn no longer grows with the size of the tables. Set SHARED_TABLE_DIR to a tmpfs folder
+(e.g., under /dev/shm) to keep the files in memory.
+
+Only the pickling within `sharing_tables()` shares the tables, the files may be collected afterwards and the data
+models pickled to be stored keep their DataFrames.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+import pandas as pd
+from loguru import logger
+
+SHARED_TABLE_DIR = os.getenv("SHARED_TABLE_DIR", ".shared_tables")
+SHARED_TABLE_MIN_ROWS = int(os.getenv("SHARED_TABLE_MIN_ROWS", 10000))
+# The least recently shared files are removed beyond
+SHARED_TABLE_MAX_BYTES = int(os.getenv("SHARED_TABLE_MAX_BYTES", 10 * 1024**3))
+# Nor the files shared for less than this, the agent processes started with them may not have mapped them yet
+SHARED_TABLE_MIN_AGE = int(os.getenv("SHARED_TABLE_MIN_AGE", 600))
+
+# Per thread, the Flask requests pickle in their own threads
+_sharing = threading.local()
+
+
+@contextmanager
+def sharing_tables() -> Iterator[None]:
+    """Share the large tables of the data models pickled within, e.g., when starting an agent process."""
+    previous = is_sharing_tables()
+    _sharing.enabled = True
+    try:
+        yield
+    finally:
+        _sharing.enabled = previous
+
+
+def is_sharing_tables() -> bool:
+    return getattr(_sharing, "enabled", False)
+
+
+def get_shared_path(key: str, shared_dir: str = SHARED_TABLE_DIR) -> str:
+    return os.path.join(shared_dir, f"{key}.arrow")
+
+
+def _write_shared_file(df: pd.DataFrame, path: str) -> None:
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Written aside and renamed, so that a process never maps a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        # Uncompressed, the buffers of the mapped file are used as they are
+        with pa.ipc.new_file(tmp_path, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def collect_garbage(
+    shared_dir: str = SHARED_TABLE_DIR, max_bytes: int = SHARED_TABLE_MAX_BYTES, min_age: int = SHARED_TABLE_MIN_AGE
+) -> None:
+    """Remove the least recently shared files until they fit in max_bytes, except those shared in the last min_age
+    seconds.
+
+    The processes which mapped a removed file keep reading it, the next turns write it again.
+    """
+    try:
+        entries = [entry for entry in os.scandir(shared_dir) if entry.name.endswith(".arrow")]
+    except FileNotFoundError:
+        return
+    entries = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in entries)
+    total_bytes = sum(size for _, size, _ in entries)
+    now = time.time()
+    for mtime, size, path in entries:
+        # From the oldest, the next ones are recent too
+        if total_bytes <= max_bytes or now - mtime < min_age:
+            break
+        try:
+            os.remove(path)
+            total_bytes -= size
+        except FileNotFoundError:
+            pass
+
+
+def share_dataframe(df: pd.DataFrame, key: str, shared_dir: str = SHARED_TABLE_DIR) -> Any:
+    """The DataFrame as an ArrowTable over its shared file, keyed by key (e.g., the fingerprint of its content),
+    written the first time only. The DataFrame itself if it is small, or cannot be written as Arrow (e.g., columns
+    of mixed types) or without pyarrow, to be pickled as before."""
+    if len(df) < SHARED_TABLE_MIN_ROWS:
+        return df
+    from real_agents.adapters.data_model.arrow_table import ArrowTable
+
+    path = get_shared_path(key, shared_dir)
+    try:
+        if os.path.isfile(path):
+            # The mtime is the last share, for the garbage collection
+            os.utime(path)
+        else:
+            start_time = time.perf_counter()
+            _write_shared_file(df, path)
+            logger.bind(msg_head="Table shared").debug(
+                {"path": path, "rows": len(df), "seconds": round(time.perf_counter() - start_time, 3)}
+            )
+            collect_garbage(shared_dir)
+        return ArrowTable(path)
+    except Exception as e:
+        logger.bind(msg_head="Table not shared").trace(e)
+        return df
@@ -1,29 +1,103 @@
 from __future__ import annotations
 
-import json
-from typing import Any
+import os
+from typing import Any, Dict, List, Optional
 
 from pandas import DataFrame
 
 from real_agents.adapters.data_model.base import DataModel
-from real_agents.adapters.data_model.templates.skg_templates.table_templates import serialize_df
+from real_agents.adapters.data_model.pagination import DEFAULT_PAGE_SIZE, get_table_page, to_react_table
+from real_agents.adapters.data_model.profile import describe_profile, load_profile, profile_table, save_profile
+from real_agents.adapters.data_model.sampling import PROGRESSIVE_MIN_ROWS, PROGRESSIVE_SAMPLE_ROWS, stratified_sample
+from real_agents.adapters.data_model.shared_table import is_sharing_tables, share_dataframe
+from real_agents.adapters.data_model.templates.skg_templates.table_templates import serialize_df, truncate_to_tokens
 
 
 class TableDataModel(DataModel):
     """A data model for table."""
 
     db_view: DataModel = None
+    sample: DataModel = None
+    """Stratified sample of a large table, for the progressive mode, None for the smaller tables."""
+    profile: Optional[Dict[str, Any]] = None
+    """Column profiles (dtype, nulls, min/max, distinct estimate, top-k, histogram), see `profile.profile_table`."""
+
+    def prepare(self) -> None:
+        """Profile, sample and serialize a grounded table, so that the agent turns reuse them.
+
+        Not done by `from_raw_data`, which also wraps the intermediate results of the tools: only the tables the chat
+        is grounded on are prepared, each step being skipped once done.
+        """
+        self.get_profile()
+        if self.sample is None and len(self.raw_data) >= PROGRESSIVE_MIN_ROWS:
+            self.sample = TableDataModel(
+                # Keyed by the content, as the databases materialized from the sample
+                id=f"{self.get_fingerprint()}.sample{PROGRESSIVE_SAMPLE_ROWS}",
+                raw_data=stratified_sample(self.raw_data, PROGRESSIVE_SAMPLE_ROWS),
+                raw_data_name=self.raw_data_name,
+                raw_data_path=f"{self.raw_data_path}.sample",
+            )
+        # As the code generation tools serialize it
+        self.get_llm_side_data()
+        # The shared files are written once, not at the first turn
+        self.get_shared_raw_data()
+        if self.sample is not None:
+            self.sample.get_shared_raw_data()
+
+    def get_profile(self) -> Dict[str, Any]:
+        """The column profiles, loaded from next to the data file if they were computed for its content already."""
+        if self.profile is None:
+            has_file = isinstance(self.raw_data_path, str) and os.path.isfile(self.raw_data_path)
+            fingerprint = self.get_fingerprint()
+            profile = load_profile(self.raw_data_path, fingerprint) if has_file else None
+            if profile is None:
+                profile = profile_table(self.raw_data)
+                if has_file:
+                    save_profile(self.raw_data_path, fingerprint, profile)
+            self.profile = profile
+        return self.profile
+
+    def get_shared_raw_data(self) -> Any:
+        """The raw data as handed to the agent processes, large DataFrames as memory-mapped Arrow files."""
+        if isinstance(self.raw_data, DataFrame):
+            return share_dataframe(self.raw_data, self.get_fingerprint())
+        return self.raw_data
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Pickled into the agent process of each turn, which gets a handle to the shared file instead of a copy, see
+        # `shared_table.sharing_tables`
+        state = super().__getstate__()
+        if is_sharing_tables():
+            state["__dict__"] = {**state["__dict__"], "raw_data": self.get_shared_raw_data()}
+        return state
 
     def set_db_view(self, db_data_model: DataModel) -> None:
         self.db_view = db_data_model
 
-    def get_llm_side_data(self, serialize_method: str = "tsv", num_visible_rows: int = 3) -> Any:
+    def _get_table_data(self, num_visible_rows: int) -> Any:
+        """The data to serialize, of which the first num_visible_rows rows are shown."""
+        if not isinstance(self.raw_data, DataFrame):
+            # A shared table, only the visible rows are read
+            return self.raw_data.head(num_visible_rows)
+        return self.raw_data
+
+    def get_llm_side_data(
+        self, serialize_method: str = "tsv", num_visible_rows: int = 3, max_tokens: int = 1000
+    ) -> Any:
         # Show the first few rows for observation.
-        table_data = self.raw_data
         table_name = self.raw_data_name
         table_path = self.raw_data_path
-        formatted_table = serialize_df(table_data, table_name, table_path, serialize_method, num_visible_rows)
-        return formatted_table
+
+        def serialize() -> str:
+            table_data = self._get_table_data(num_visible_rows)
+            string = serialize_df(table_data, table_name, table_path, serialize_method, num_visible_rows, max_tokens)
+            if serialize_method == "tsv" and self.profile is not None:
+                # What the first rows do not tell, e.g., the values to filter on
+                string += f"Column profiles of the whole table ({self.profile['num_rows']} rows):\n"
+                string = truncate_to_tokens(string + describe_profile(self.profile) + "\n", max_tokens)
+            return string
+
+        return self._get_cached_llm_side_data((serialize_method, num_visible_rows, max_tokens), serialize)
 
     def get_human_side_data(self, mode: str = "HEAD") -> Any:
         # We support different mode for the front-end display.
@@ -31,14 +105,21 @@ class TableDataModel(DataModel):
         if mode == "HEAD":
             return self.raw_data.head()
         elif mode == "FULL":
-            return self.raw_data
+            return self.raw_data if isinstance(self.raw_data, DataFrame) else self.raw_data.to_pandas()
         else:
             raise ValueError(f"Unsupported mode: {mode}")
 
+    def get_page(
+        self,
+        page_index: int = 0,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        sorting: Optional[List[Dict[str, Any]]] = None,
+        filters: Optional[List[Dict[str, Any]]] = None,
+    ) -> Dict[str, Any]:
+        """A page of the table for the front-end table, sorted and filtered, see `pagination.get_table_page`."""
+        return get_table_page(self.raw_data, page_index, page_size, sorting, filters)
+
     @staticmethod
-    def to_react_table(table: DataFrame) -> str:
-        columns = list(map(lambda item: {"accessorKey": item, "header": item}, table.columns.tolist()))
-        # FIXME: NaN may not be handled here.
-        data = table.fillna("").to_dict(orient="records")
-        table = json.dumps({"columns": columns, "data": data})
-        return table
+    def to_react_table(table: DataFrame, source: Optional[Dict[str, Any]] = None) -> str:
+        # All the rows, or the first page with the source to fetch the others through the table page API
+        return to_react_table(table, source)
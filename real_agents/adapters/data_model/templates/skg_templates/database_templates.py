@@ -1,52 +1,48 @@
 import sqlite3
-from typing import Dict, Union
+from contextlib import closing
+from typing import Dict, Iterable, Optional, Union
 
 import pandas as pd
 import tiktoken
 
 
 from real_agents.adapters.data_model.templates.skg_templates.table_templates import (
+    TABLE_RENDERERS,
     convert as convert_table,
 )
 from real_agents.adapters.schema import SQLDatabase
 
 
-def convert(db_input: Union[str, Dict[str, pd.DataFrame]], visible_rows_num: int = 3) -> Dict[str, str]:
+def convert(
+    db_input: Union[str, Dict[str, pd.DataFrame]], visible_rows_num: int = 3, formats: Optional[Iterable[str]] = None
+) -> Dict[str, str]:
     """
     Convert database data to string representations in different formats.
 
-    :param db_input: the path to the sqlite database file, or a pd.DataFrame.
+    :param db_input: the path to the sqlite database file, or a dictionary of pd.DataFrame.
     :param visible_rows_num: the number of rows to be displayed in each table.
-    :return: A dictionary with the string database representations in different formats.
+    :param formats: the formats to render (keys of TABLE_RENDERERS), all of them if None.
+    :return: A dictionary with the string database representations in the requested formats.
     """
     if isinstance(db_input, str):
-        conn = sqlite3.connect(db_input)
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        table_names = [name[0] for name in cursor.fetchall()]
-        dfs = {table_name: pd.read_sql_query(f"SELECT * FROM {table_name}", conn) for table_name in table_names}
+        with closing(sqlite3.connect(db_input)) as conn:
+            table_names = [
+                name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type='table';").fetchall()
+            ]
+            # One more row than displayed tells whether the table has more
+            dfs = {
+                table_name: pd.read_sql_query(f'SELECT * FROM "{table_name}" LIMIT {visible_rows_num + 1}', conn)
+                for table_name in table_names
+            }
     elif isinstance(db_input, dict) and all(isinstance(df, pd.DataFrame) for df in db_input.values()):
         dfs = db_input
     else:
         raise ValueError("db_input should be either a SQLite database file path or a dictionary of pandas DataFrames")
 
-    representations = {
-        "Markdown": "",
-        "HTML": "",
-        "LaTeX": "",
-        "CSV": "",
-        "TSV": "",
-        "reStructuredText": "",
-        "BBCode": "",
-        "MediaWiki": "",
-        "Org mode": "",
-        "PrettyTable": "",
-        "SQL": "",
-    }
-
+    formats = list(TABLE_RENDERERS) if formats is None else list(formats)
+    representations = {_format: "" for _format in formats}
     for table_name, df in dfs.items():
-        table_data = {"cols": df.columns.tolist(), "rows": df.values.tolist()}
-        table_representations = convert_table(table_data, table_name, visible_rows_num)
+        table_representations = convert_table(df, table_name, visible_rows_num, formats)
         for _format, table_representation in table_representations.items():
             representations[_format] += table_representation + "\n\n"
 
@@ -61,14 +57,18 @@ def serialize_db(
 ) -> str:
     """Convert database engine to a string representation."""
     if serialize_method == "database":
-        # TODO: Now access the internal variable
-        setattr(db, "_sample_rows_in_table_info", num_visible_rows)
-        string = db.get_table_info()
-        # Truncate the string if it is too long
-        enc = tiktoken.get_encoding("cl100k_base")
-        enc_tokens = enc.encode(string)
-        if len(enc_tokens) > max_tokens:
-            string = enc.decode(enc_tokens[:max_tokens])
+
+        def render() -> str:
+            string = db.get_table_info(sample_rows=num_visible_rows)
+            # Truncate the string if it is too long
+            enc = tiktoken.get_encoding("cl100k_base")
+            enc_tokens = enc.encode(string)
+            if len(enc_tokens) > max_tokens:
+                string = enc.decode(enc_tokens[:max_tokens])
+            return string
+
+        # Cached with the database version, repeated turns reuse the rendered text
+        string = db.cached_render(render, "serialize_db", num_visible_rows, max_tokens)
     else:
         raise ValueError("Unknown serialization method.")
     return string
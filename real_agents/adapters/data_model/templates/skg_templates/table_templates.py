@@ -1,142 +1,203 @@
-import subprocess
-import sys
-from copy import deepcopy
-from typing import Any, Dict, Union
+import datetime
+import importlib
+import time
+from typing import Any, Callable, Dict, Iterable, Optional, Union
 
 import pandas as pd
-from sqlalchemy import create_engine
+from sqlalchemy import BigInteger, Boolean, Column, Date, DateTime, Float, MetaData, Table, Text
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.schema import CreateTable
 import tiktoken
 
-from real_agents.adapters.schema import SQLDatabase
+from real_agents.adapters.data_model.sqlite_loader import get_column_type, get_columns
+
+# Sample values are cut to this length, as in the table info of SQL databases
+SAMPLE_VALUE_MAX_CHARS = 100
+# SQLAlchemy types of the column types of the tables written by `sqlite_loader`
+SQL_COLUMN_TYPES = {
+    "BOOLEAN": Boolean, "BIGINT": BigInteger, "FLOAT": Float, "DATETIME": DateTime, "DATE": Date, "TEXT": Text
+}
+
+
+def _require(module_name: str, package: str) -> Any:
+    """Import an optional dependency of a format, once per process."""
+    try:
+        return importlib.import_module(module_name)
+    except ImportError:
+        raise ImportError(f"This format requires {package}, use `pip install {package}`")
+
+
+def _markdown_table(df: pd.DataFrame, table_name: str) -> str:
+    _require("tabulate", "tabulate")
+    return df.to_markdown(index=False)
+
+
+def _bbcode_table(df: pd.DataFrame, table_name: str) -> str:
+    bbcode_table = "[table]\n"
+    for row in df.itertuples(index=False):
+        bbcode_table += "[tr]\n"
+        for value in row:
+            bbcode_table += f"[td]{value}[/td]\n"
+        bbcode_table += "[/tr]\n"
+    bbcode_table += "[/table]"
+    return bbcode_table
+
+
+def _mediawiki_table(df: pd.DataFrame, table_name: str) -> str:
+    mediawiki_table = '{| class="wikitable"\n|-\n'
+    for col in df.columns:
+        mediawiki_table += f"! {col}\n"
+    for row in df.itertuples(index=False):
+        mediawiki_table += "|-\n"
+        for value in row:
+            mediawiki_table += f"| {value}\n"
+    mediawiki_table += "|}"
+    return mediawiki_table
+
+
+def _org_table(df: pd.DataFrame, table_name: str) -> str:
+    columns = [str(col) for col in df.columns]
+    org_table = "| " + " | ".join(columns) + " |\n|-" + " | -".join(["-" * len(col) for col in columns]) + " |\n"
+    for row in df.itertuples(index=False):
+        org_table += "| " + " | ".join([str(value) for value in row]) + " |\n"
+    return org_table
+
+
+def _pretty_table(df: pd.DataFrame, table_name: str) -> str:
+    pretty_table = _require("prettytable", "prettytable").PrettyTable()
+    pretty_table.field_names = list(df.columns)
+    for row in df.itertuples(index=False):
+        pretty_table.add_row(list(row))
+    return str(pretty_table)
+
+
+def _sql_table(df: pd.DataFrame, table_name: str) -> str:
+    sql_table_str = f"CREATE TABLE {table_name}(\n"
+    for col in df.columns:
+        sql_table_str += f"{col} text,\n"
+    # Remove the last comma and add the primary key constraint
+    sql_table_str = sql_table_str[:-2] + f",\nPRIMARY KEY ({df.columns[0]})\n);"
+
+    sql_table_str += "\n/*\n{} example rows:\n".format(len(df))
+    for row in df.itertuples(index=False):
+        sql_table_str += "\t".join([str(cell) for cell in row]) + "\n"
+    sql_table_str += "*/"
+    return sql_table_str
+
+
+# Format -> renderer of the visible rows of a table, only the requested formats are rendered
+TABLE_RENDERERS: Dict[str, Callable[[pd.DataFrame, str], str]] = {
+    "Markdown": _markdown_table,
+    "HTML": lambda df, table_name: df.to_html(index=False),
+    "LaTeX": lambda df, table_name: df.to_latex(index=False),
+    "CSV": lambda df, table_name: df.to_csv(index=False),
+    "TSV": lambda df, table_name: df.to_csv(index=False, sep="\t"),
+    "reStructuredText": lambda df, table_name: df.to_string(index=False),
+    "BBCode": _bbcode_table,
+    "MediaWiki": _mediawiki_table,
+    "Org mode": _org_table,
+    "PrettyTable": _pretty_table,
+    "SQL": _sql_table,
+}
+
+
+def get_visible_rows(table_data: Union[pd.DataFrame, Dict[str, Any]], visible_rows_num: int = 3) -> pd.DataFrame:
+    """The first visible_rows_num rows, followed by a row of "..." if the table has more rows."""
+    if isinstance(table_data, pd.DataFrame):
+        cols, rows = table_data.columns, table_data.head(visible_rows_num).values.tolist()
+        total_rows = len(table_data)
+    elif isinstance(table_data, dict) and "cols" in table_data and "rows" in table_data:
+        cols, rows = table_data["cols"], list(table_data["rows"][:visible_rows_num])
+        total_rows = len(table_data["rows"])
+    else:
+        raise TypeError("table_data must be a dataframe or a dictionary with 'cols' and 'rows' as keys.")
+    if total_rows > visible_rows_num:
+        rows.append(["..."] * len(cols))
+    return pd.DataFrame(rows, columns=cols)
 
 
 def convert(
-    table_data: Union[pd.DataFrame, Dict[str, Any]], table_name: str = "table", visible_rows_num: int = 3
+    table_data: Union[pd.DataFrame, Dict[str, Any]],
+    table_name: str = "table",
+    visible_rows_num: int = 3,
+    formats: Optional[Iterable[str]] = None,
 ) -> Dict[str, str]:
     """
     Convert table data to string representations in different formats.
 
-    :param table_data: A dictionary with "cols" (list of strings) and "rows"
+    :param table_data: A dataframe, or a dictionary with "cols" (list of strings) and "rows"
                         (list of lists of strings) as keys.
     :param table_name: The name of the table.
     :param visible_rows_num: The number of rows to be displayed in the representation.
-    :return: A dictionary with the string table representations in different formats.
+    :param formats: The formats to render (keys of TABLE_RENDERERS), all of them if None.
+    :return: A dictionary with the string table representations in the requested formats.
     """
-
-    def install_required_packages() -> None:
-        packages = ["tabulate", "prettytable"]
-
-        for package in packages:
-            subprocess.check_call([sys.executable, "-m", "pip", "install", package])
-
-    # Call the function to install the required packages
-    install_required_packages()
-    from prettytable import PrettyTable
-
-    # Handle situation when the table_data is already a dataframe, FIXME: this is a hack
-    new_table_data = {}
-    if isinstance(table_data, pd.DataFrame):
-        new_table_data["cols"] = table_data.columns
-        new_table_data["rows"] = table_data.values.tolist()
-    table_data = new_table_data
-
-    # Type check for table_data
-    if not isinstance(table_data, dict) or "cols" not in table_data or "rows" not in table_data:
-        raise TypeError("table_data must be a dictionary with 'cols' and 'rows' as keys.")
-
-    table_data_for_observable = deepcopy(table_data)
-    if len(table_data_for_observable["rows"]) > visible_rows_num:
-        table_data_for_observable["rows"] = table_data_for_observable["rows"][:visible_rows_num]
-        table_data_for_observable["rows"].append(["..."] * len(table_data_for_observable["cols"]))
-
-    # Create dataframe from table_data
-    df = pd.DataFrame(table_data_for_observable["rows"], columns=table_data_for_observable["cols"])
-
-    # Generate tables in different formats
-    markdown_table = df.to_markdown(index=False)
-    html_table = df.to_html(index=False)
-    latex_table = df.to_latex(index=False)
-    csv_table = df.to_csv(index=False)
-    tsv_table = df.to_csv(index=False, sep="\t")
-    rest_table = df.to_string(index=False)
-
-    def bbcode_mode_table(data_frame: pd.DataFrame) -> str:
-        bbcode_table = "[table]\n"
-        for row in data_frame.itertuples(index=False):
-            bbcode_table += "[tr]\n"
-            for value in row:
-                bbcode_table += f"[td]{value}[/td]\n"
-            bbcode_table += "[/tr]\n"
-        bbcode_table += "[/table]"
-        return bbcode_table
-
-    def mediawiki_mode_table(data_frame: pd.DataFrame) -> str:
-        mediawiki_table = '{| class="wikitable"\n|-\n'
-        for col in data_frame.columns:
-            mediawiki_table += f"! {col}\n"
-        for row in data_frame.itertuples(index=False):
-            mediawiki_table += "|-\n"
-            for value in row:
-                mediawiki_table += f"| {value}\n"
-        mediawiki_table += "|}"
-        return mediawiki_table
-
-    def org_mode_table(data_frame: pd.DataFrame) -> str:
-        org_table = (
-            "| "
-            + " | ".join(data_frame.columns)
-            + " |\n|-"
-            + " | -".join(["-" * len(col) for col in data_frame.columns])
-            + " |\n"
-        )
-        for row in data_frame.itertuples(index=False):
-            org_table += "| " + " | ".join([str(value) for value in row]) + " |\n"
-        return org_table
-
-    bbcode_table = bbcode_mode_table(df)
-    mediawiki_table = mediawiki_mode_table(df)
-    org_table = org_mode_table(df)
-
-    pretty_table = PrettyTable()
-    pretty_table.field_names = table_data["cols"]
-    for row in table_data["rows"]:
-        pretty_table.add_row(row)
-    pretty_table = str(pretty_table)
-
-    # New function to generate SQL table
-    def sql_mode_table(data_frame: pd.DataFrame, _table_name: str) -> str:
-        sql_table_str = f"CREATE TABLE {table_name}(\n"
-
-        for col in data_frame.columns:
-            sql_table_str += f"{col} text,\n"
-
-        # Remove the last comma and add the primary key constraint
-        sql_table_str = sql_table_str[:-2] + f",\nPRIMARY KEY ({data_frame.columns[0]})\n);"
-
-        sql_table_str += "\n/*\n{} example rows:\n".format(len(data_frame))
-        for i, _row in data_frame.iterrows():
-            _row = "\t".join([str(_cell) for _cell in _row.to_list()])
-            sql_table_str += f"{_row}\n"
-        sql_table_str += "*/"
-
-        return sql_table_str
-
-    sql_table = sql_mode_table(df, table_name)
-
-    # Return the representation in different formats as a dictionary
-    return {
-        "Markdown": markdown_table,
-        "HTML": html_table,
-        "LaTeX": latex_table,
-        "CSV": csv_table,
-        "TSV": tsv_table,
-        "reStructuredText": rest_table,
-        "BBCode": bbcode_table,
-        "MediaWiki": mediawiki_table,
-        "Org mode": org_table,
-        "PrettyTable": pretty_table,
-        "SQL": sql_table,
-    }
+    formats = list(TABLE_RENDERERS) if formats is None else list(formats)
+    unknown_formats = [_format for _format in formats if _format not in TABLE_RENDERERS]
+    if unknown_formats:
+        raise ValueError(f"Unknown formats {unknown_formats}, expected some of {', '.join(TABLE_RENDERERS)}")
+    df = get_visible_rows(table_data, visible_rows_num)
+    return {_format: TABLE_RENDERERS[_format](df, table_name) for _format in formats}
+
+
+def benchmark_convert(
+    n_rows: int = 100000, formats: Optional[Iterable[str]] = None, repeat: int = 20
+) -> Dict[str, float]:
+    """Seconds per `convert` call of a n_rows table, for each format alone."""
+    df = pd.DataFrame({"id": range(n_rows), "name": [f"name {i}" for i in range(n_rows)], "value": 0.5})
+    timings = {}
+    for _format in TABLE_RENDERERS if formats is None else formats:
+        # The first call imports the optional dependencies
+        convert(df, "table", formats=[_format])
+        start = time.perf_counter()
+        for _ in range(repeat):
+            convert(df, "table", formats=[_format])
+        timings[_format] = (time.perf_counter() - start) / repeat
+    return timings
+
+
+def _sample_value(value: Any) -> str:
+    """The value as it reads back from SQLite once written by `sqlite_loader.bulk_load`."""
+    if value is None or (pd.api.types.is_scalar(value) and pd.isna(value)):
+        return "None"
+    if isinstance(value, pd.Timestamp):
+        value = value.tz_localize(None).to_pydatetime() if value.tz is not None else value.to_pydatetime()
+    elif isinstance(value, datetime.timedelta):
+        # Written as seconds
+        value = value.total_seconds()
+    return str(value)[:SAMPLE_VALUE_MAX_CHARS]
+
+
+def sql_table_info(table_data: pd.DataFrame, table_name: str, num_visible_rows: int = 3) -> str:
+    """CREATE TABLE statement and sample rows of the dataframe, as `SQLDatabase.get_table_info` renders it once
+    written to SQLite by `sqlite_loader.bulk_load`, without writing it.
+
+    The column types are those `bulk_load` (as `to_sql`) picks, the sample rows are the first rows.
+    """
+    head = table_data.head(num_visible_rows)
+    columns = get_columns(head)
+    table = Table(
+        table_name,
+        MetaData(),
+        *[Column(str(name), SQL_COLUMN_TYPES[get_column_type(values)]) for name, values in columns],
+    )
+    table_info = str(CreateTable(table).compile(dialect=sqlite.dialect())).rstrip()
+    if not num_visible_rows:
+        return table_info
+
+    rows = zip(*[[_sample_value(value) for value in values] for _, values in columns])
+    columns_str = "\t".join(column.name for column in table.columns)
+    sample_rows_str = "\n".join("\t".join(row) for row in rows)
+    return f"{table_info}\n\n/*\n{num_visible_rows} rows from {table.name} table:\n{columns_str}\n{sample_rows_str}\n*/"
+
+
+def truncate_to_tokens(string: str, max_tokens: int) -> str:
+    """Truncate the string if it is too long."""
+    enc = tiktoken.get_encoding("cl100k_base")
+    enc_tokens = enc.encode(string)
+    if len(enc_tokens) > max_tokens:
+        string = enc.decode(enc_tokens[:max_tokens])
+    return string
 
 
 def serialize_df(
@@ -157,18 +218,14 @@ def serialize_df(
             '(only a small part of the whole table) called "{}":\n'.format(num_visible_rows, pretty_path, table_name)
         )
         string += table_data.head(num_visible_rows).to_csv(sep="\t", index=False)
-        # Truncate the string if it is too long
-        enc = tiktoken.get_encoding("cl100k_base")
-        enc_tokens = enc.encode(string)
-        if len(enc_tokens) > max_tokens:
-            string = enc.decode(enc_tokens[:max_tokens])
+        string = truncate_to_tokens(string, max_tokens)
     elif serialize_method == "database":
-        engine = create_engine("sqlite:///:memory:")
-        table_data.to_sql(table_name, engine)
-        db = SQLDatabase(engine)
-        # TODO: Now access the internal variable
-        setattr(db, "_sample_rows_in_table_info", num_visible_rows)
-        string = db.get_table_info()
+        string = sql_table_info(table_data, table_name, num_visible_rows)
     else:
         raise ValueError("Unknown serialization method.")
     return string
+
+
+if __name__ == "__main__":
+    for _format, seconds in benchmark_convert().items():
+        print(f"{_format}: {seconds * 1000:.2f} ms per call")
@@ -1,2 +1,23 @@
+import hashlib
+import os
+from typing import Dict, Tuple
+
+# (path, size, mtime) -> content hash, so each file version is only hashed once per process
+_FILE_FINGERPRINTS: Dict[Tuple[str, int, int], str] = {}
+
+
 def indent_multiline_string(multiline_string: str, indent: int = 1) -> str:
     return "\n".join("\t" * indent + line for line in multiline_string.split("\n"))
+
+
+def fingerprint_file(path: str, chunk_size: int = 1 << 20) -> str:
+    """Content hash of a file, identical files share the fingerprint whatever their path or mtime."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _FILE_FINGERPRINTS:
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+        _FILE_FINGERPRINTS[key] = digest.hexdigest()
+    return _FILE_FINGERPRINTS[key]
@@ -0,0 +1,125 @@
+"""Registry of the SQLAlchemy engines, shared by the databases opened on the same file or URI."""
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+from loguru import logger
+from sqlalchemy import MetaData, create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+ENGINE_REGISTRY_MAX_SIZE = int(os.getenv("ENGINE_REGISTRY_MAX_SIZE", 32))
+SQLITE_POOL_SIZE = 4
+SQLITE_MMAP_BYTES = int(os.getenv("SQLITE_MMAP_BYTES", 256 * 1024**2))
+
+
+class LazyMetaData(MetaData):
+    """Metadata reflected when the tables are first needed, rather than when a database is created on it.
+
+    The pending reflections are merged by engine and schema, so that the databases created on a shared engine add
+    their tables to a single one, bounded by the tables of the database, and dropped once reflected.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        # (bind, schema, views) -> (reflect arguments, table names, None for all the tables)
+        self._pending_reflections: Dict[Tuple, Tuple[Dict[str, Any], Optional[Set[str]]]] = {}
+        self._reflection_lock = threading.Lock()
+
+    def _table_key(self, name: str, schema: Optional[str]) -> str:
+        return f"{schema}.{name}" if schema else name
+
+    def reflect(self, only: Optional[Iterable[str]] = None, **kwargs: Any) -> None:
+        key = (kwargs.get("bind"), kwargs.get("schema"), kwargs.get("views", False))
+        with self._reflection_lock:
+            _, pending_tables = self._pending_reflections.get(key, (kwargs, set()))
+            if only is None or pending_tables is None:
+                pending_tables = None
+            else:
+                # The tables already reflected are skipped
+                schema = kwargs.get("schema")
+                pending_tables |= {name for name in only if self._table_key(name, schema) not in self.tables}
+            if pending_tables is None or pending_tables:
+                self._pending_reflections[key] = (kwargs, pending_tables)
+
+    def ensure_reflected(self) -> None:
+        # Shared by several databases, each asking for its own tables, the tables already reflected are skipped
+        with self._reflection_lock:
+            while self._pending_reflections:
+                _, (kwargs, pending_tables) = self._pending_reflections.popitem()
+                if pending_tables is not None:
+                    schema = kwargs.get("schema")
+                    pending_tables = [
+                        name for name in pending_tables if self._table_key(name, schema) not in self.tables
+                    ]
+                    if not pending_tables:
+                        continue
+                super().reflect(only=pending_tables, **kwargs)
+
+
+def _set_mmap(dbapi_connection: Any, connection_record: Any) -> None:
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_BYTES}")
+    cursor.close()
+
+
+class EngineRegistry:
+    """Engines (hence connection pools) and reflected metadata, keyed by URI, least recently used ones dropped first.
+
+    SQLite files are keyed by their size and mtime too, so that a file replaced by a new one gets a new engine.
+    """
+
+    def __init__(self, max_size: int = ENGINE_REGISTRY_MAX_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Tuple, Tuple[Engine, MetaData]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: Tuple, create: Any) -> Tuple[Engine, MetaData]:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            entry = self._entries[key] = (create(), LazyMetaData())
+            if len(self._entries) > self.max_size:
+                _, (engine, _) = self._entries.popitem(last=False)
+                # Only closes the idle connections, databases still using the engine keep working
+                engine.dispose()
+        logger.bind(msg_head="Engine created").trace(key)
+        return entry
+
+    def get_engine(self, uri: str, **engine_args: Any) -> Engine:
+        return self._get((uri, tuple(sorted(engine_args.items()))), lambda: create_engine(uri, **engine_args))[0]
+
+    def get_sqlite_engine(self, path: str, read_only: bool = True) -> Engine:
+        """Engine of a SQLite file, read-only files are opened as immutable (no locking nor change detection)."""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+
+        def create() -> Engine:
+            if read_only:
+                uri = f"sqlite:///file:{path}?mode=ro&immutable=1&uri=true"
+            else:
+                uri = f"sqlite:///{path}"
+            # Pooled, the connections are not tied to the thread which opened them
+            engine = create_engine(
+                uri,
+                poolclass=QueuePool,
+                pool_size=SQLITE_POOL_SIZE,
+                connect_args={"check_same_thread": False},
+            )
+            event.listen(engine, "connect", _set_mmap)
+            return engine
+
+        return self._get(("sqlite", path, read_only, stat.st_size, stat.st_mtime_ns), create)[0]
+
+    def get_metadata(self, engine: Engine) -> Optional[LazyMetaData]:
+        """Metadata shared by the databases on the engine, None if the engine is not in the registry."""
+        with self._lock:
+            for registered_engine, metadata in self._entries.values():
+                if registered_engine is engine:
+                    return metadata
+        return None
+
+
+engine_registry = EngineRegistry()
@@ -1,8 +1,10 @@
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional
 
 from langchain.base_language import BaseLanguageModel
 from langchain.schema import AIMessage, HumanMessage
 
+from real_agents.adapters.data_model import TableDataModel
+from real_agents.adapters.data_model.profile import describe_profile
 from real_agents.adapters.memory import ConversationReActBufferMemory
 from real_agents.adapters.executors.question_suggestion.chat_memory import QuestionSuggestionChainChatMemory
 from real_agents.adapters.executors.question_suggestion.base import QuestionSuggestionChainBase
@@ -18,7 +20,11 @@ class QuestionSuggestionExecutor:
         mode: str = "",
         user_profile: str = "",
         chat_memory: ConversationReActBufferMemory = ConversationReActBufferMemory(),
+        tables: Optional[List[TableDataModel]] = None,
     ) -> Dict[str, Any]:
+        for table in tables or []:
+            # The column profiles computed at upload, e.g., the frequent values, inspire more specific questions
+            user_intent += f"\nColumns of the table {table.raw_data_name}:\n{describe_profile(table.get_profile())}"
         if mode == "base":
             method = QuestionSuggestionChainBase.from_prompt(llm)
             inputs = {"input_string": user_intent, "num_questions": num_questions}
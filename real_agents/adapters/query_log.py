@@ -0,0 +1,43 @@
+"""Append-only log of the SQL queries run on a database, read by the index advisor."""
+import json
+import os
+import time
+from typing import Any, Dict, List, Tuple
+
+from loguru import logger
+
+# The log stops growing beyond this size, the advisor has seen enough queries by then
+QUERY_LOG_MAX_BYTES = int(os.getenv("QUERY_LOG_MAX_BYTES", 1024**2))
+
+
+def append_query(log_path: str, command: str, elapsed_ms: float) -> None:
+    """Record an executed query, a single append so that concurrent processes do not interleave their lines."""
+    try:
+        if os.path.exists(log_path) and os.path.getsize(log_path) > QUERY_LOG_MAX_BYTES:
+            return
+        line = json.dumps({"sql": command, "ms": round(elapsed_ms, 3), "time": time.time()}) + "\n"
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write(line)
+    except OSError as e:
+        # e.g., the database was garbage-collected meanwhile, the log is best effort
+        logger.bind(msg_head="Query log error").debug(e)
+
+
+def read_queries(log_path: str, offset: int = 0) -> Tuple[List[Dict[str, Any]], int]:
+    """Queries logged from the byte offset on, and the offset to read the next ones from."""
+    queries = []
+    try:
+        with open(log_path, "r", encoding="utf-8") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith("\n"):
+                    # Being written, read next time
+                    break
+                offset += len(line.encode("utf-8"))
+                try:
+                    queries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return queries, offset
@@ -1,9 +1,38 @@
+from __future__ import annotations
+
+import math
+import os
+import re
+import time
+import uuid
+from collections import OrderedDict
 from typing import NamedTuple
 from langchain import SQLDatabase
-from sqlalchemy import text
-from sqlalchemy.engine import Row
+from loguru import logger
+import pandas as pd
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import Engine, Row
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import StaticPool
 from tabulate import tabulate
-from typing import List, Any
+from typing import Callable, Dict, Iterator, List, Any, Optional, Tuple, Union
+
+from real_agents.adapters.engine_registry import LazyMetaData, engine_registry
+from real_agents.adapters.query_log import append_query
+from real_agents.adapters.sql_cache import SQLResultCache, is_read_only, is_volatile
+from real_agents.adapters.sql_guard import (
+    SQL_EXPORT_MAX_ROWS,
+    SQL_EXPORT_TIMEOUT,
+    SQL_STATEMENT_TIMEOUT,
+    check_join_rows,
+    estimate_join_rows,
+    find_duckdb_nested_loops,
+    find_sqlite_nested_scans,
+    get_row_limit,
+    has_join_condition,
+    is_streamed_sqlite_plan,
+    statement_guard,
+)
 
 
 class AgentTransition(NamedTuple):
@@ -14,9 +43,208 @@ class AgentTransition(NamedTuple):
 
 
 EMPTY_RESULT_STR = "NONE"  # to show NONE result in front-end.
+# Caps of the query results formatted for the LLM, the rest stays available through the result handle
+SQL_RESULT_MAX_ROWS = int(os.getenv("SQL_RESULT_MAX_ROWS", 100))
+SQL_RESULT_MAX_BYTES = int(os.getenv("SQL_RESULT_MAX_BYTES", 16 * 1024))
+# Rows of a truncated result scanned (without being kept) to count them, the count is a lower bound beyond
+SQL_COUNT_SCAN_ROWS = int(os.getenv("SQL_COUNT_SCAN_ROWS", 100000))
+SQL_FETCH_BATCH_ROWS = 1000
+MAX_RESULT_HANDLES = 64
+RESULT_HANDLE_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
+class QueryResult(NamedTuple):
+    """First rows of a query result."""
+
+    headers: List[str]
+    rows: List[Row]
+    # Total number of rows, a lower bound if total_rows_exact is False
+    total_rows: int
+    total_rows_exact: bool
+    # Handle to page through the full result, None if all the rows are there
+    handle: Optional[str] = None
+
+    @property
+    def truncated(self) -> bool:
+        return len(self.rows) < self.total_rows or not self.total_rows_exact
+
+
+def _quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def lock_duckdb(engine: Engine) -> None:
+    """Forbid the queries of the DuckDB database to read or write files (e.g., `read_csv('/etc/passwd')`, COPY or
+    ATTACH), and to change this setting back. The registered tables are Python objects, still readable."""
+    with engine.begin() as connection:
+        connection.exec_driver_sql("SET enable_external_access = false")
+        connection.exec_driver_sql("SET lock_configuration = true")
+
+
+def register_duckdb_table(engine: Engine, name: str, data: Union[pd.DataFrame, Any, str]) -> None:
+    """Expose a DataFrame, an Arrow table or a Parquet file (by path) as a DuckDB view, the data is scanned in place
+    and never copied."""
+    if isinstance(data, str):
+        try:
+            import pyarrow.dataset as ds
+        except ImportError:
+            raise ImportError("Parquet tables require pyarrow, use `pip install pyarrow`")
+        # Scanned through pyarrow, the queries themselves cannot read files
+        data = ds.dataset(data, format="parquet")
+    connection = engine.raw_connection()
+    try:
+        connection.register(name, data)
+    finally:
+        connection.close()
 
 
 class SQLDatabase(SQLDatabase):
+    # Shared by all the databases, the entries are keyed by database version
+    result_cache: Optional[SQLResultCache] = SQLResultCache()
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        # Reflecting every table is skipped when the rendered table info is cached
+        if kwargs.get("metadata") is None:
+            kwargs["metadata"] = LazyMetaData()
+        super().__init__(*args, **kwargs)
+        # Result handle -> query, the most recent ones are kept
+        self._result_handles: OrderedDict = OrderedDict()
+        # Content fingerprint of the database, set by the owner when known
+        self._fingerprint: Optional[str] = None
+        # Set by each write, a new version only known to this instance
+        self._write_token: Optional[str] = None
+        # Table name -> row count (None if unknown), for the plan preflight
+        self._row_counts: Dict[str, Optional[int]] = {}
+        # Where the executed queries are logged for the index advisor, not logged if None
+        self.query_log_path: Optional[str] = None
+
+    @classmethod
+    def from_duckdb(cls, tables: Optional[Dict[str, Union[pd.DataFrame, str]]] = None, **kwargs: Any) -> SQLDatabase:
+        """Create an in-memory DuckDB database over DataFrames or Parquet files (by path), keyed by table name."""
+        try:
+            import duckdb_engine  # noqa: F401
+        except ImportError:
+            raise ImportError("The duckdb engine requires duckdb, use `pip install duckdb duckdb-engine`")
+        # A single connection, since DataFrames are only visible to the connection which registered them
+        engine = create_engine("duckdb:///:memory:", poolclass=StaticPool)
+        # The queries come from the LLM and the clients
+        lock_duckdb(engine)
+        for name, data in (tables or {}).items():
+            register_duckdb_table(engine, name, data)
+        # The registered tables are views
+        return cls(engine, view_support=True, **kwargs)
+
+    @classmethod
+    def from_sqlite_file(cls, path: str, read_only: bool = True, **kwargs: Any) -> SQLDatabase:
+        """Open a SQLite file through the engine registry, sharing its connections and metadata."""
+        engine = engine_registry.get_sqlite_engine(path, read_only=read_only)
+        return cls(engine, metadata=engine_registry.get_metadata(engine), **kwargs)
+
+    @property
+    def engine(self) -> Engine:
+        return self._engine
+
+    @property
+    def database_path(self) -> Optional[str]:
+        """Path of the SQLite file, None for the other databases."""
+        database = self._engine.url.database
+        if self.dialect != "sqlite" or not database or database == ":memory:":
+            return None
+        return database[len("file:") :].split("?")[0] if database.startswith("file:") else database
+
+    def set_fingerprint(self, fingerprint: str) -> None:
+        self._fingerprint = fingerprint
+        self._write_token = None
+
+    def get_version(self) -> str:
+        """Version of the database content, which changes with any write to the database."""
+        if self._write_token is not None:
+            return self._write_token
+        if self._fingerprint is not None:
+            return self._fingerprint
+        path = self.database_path
+        if path is not None and os.path.isfile(path):
+            # Writes from other processes change the file too
+            stat = os.stat(path)
+            return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        # Nothing to identify the content with, results are only reused by this instance
+        return f"{self._engine.url}:{os.getpid()}:{id(self)}"
+
+    def mark_written(self) -> None:
+        """Invalidate the cached results of the database."""
+        self._write_token = uuid.uuid4().hex
+        self._row_counts = {}
+
+    def register_table(self, name: str, data: Union[pd.DataFrame, Any, str]) -> None:
+        """Add a DataFrame, an Arrow table or a Parquet file to a DuckDB database."""
+        if self.dialect != "duckdb":
+            raise ValueError(f"Only duckdb databases can register tables, got {self.dialect}.")
+        register_duckdb_table(self._engine, name, data)
+        self.refresh_tables(view_support=True)
+
+    def unregister_table(self, name: str) -> None:
+        """Remove a table registered in a DuckDB database."""
+        if self.dialect != "duckdb":
+            raise ValueError(f"Only duckdb databases can unregister tables, got {self.dialect}.")
+        with self._engine.begin() as connection:
+            connection.exec_driver_sql(f"DROP VIEW IF EXISTS {_quote_identifier(name)}")
+        self.refresh_tables(view_support=True)
+
+    def refresh_tables(self, view_support: bool = False) -> None:
+        """Reload the table list and schemas, e.g., after tables were added to the database."""
+        self._inspector = inspect(self._engine)
+        self._all_tables = set(
+            self._inspector.get_table_names(schema=self._schema)
+            + (self._inspector.get_view_names(schema=self._schema) if view_support else [])
+        )
+        usable_tables = self.get_usable_table_names()
+        self._usable_tables = set(usable_tables) if usable_tables else self._all_tables
+        # Start from new metadata so that replaced tables are reflected again
+        self._metadata = LazyMetaData()
+        self._metadata.reflect(
+            views=view_support, bind=self._engine, only=list(self._usable_tables), schema=self._schema
+        )
+        self.mark_written()
+
+    def cached_render(self, render: Callable[[], str], *options: Any) -> str:
+        """Text rendered from the database, cached by database version and the options it depends on."""
+        if self.result_cache is None:
+            return render()
+        cache_key = self.result_cache.make_render_key(self.get_version(), *options)
+        cached = self.result_cache.get(cache_key)
+        if cached is not None:
+            return cached["text"]
+        rendered = render()
+        self.result_cache.set(cache_key, {"text": rendered})
+        return rendered
+
+    def get_table_info(self, table_names: Optional[List[str]] = None, sample_rows: Optional[int] = None) -> str:
+        """Get information about specified tables, with sample_rows sample rows per table (default of the database).
+
+        Cached, so that repeated turns do not reflect and query every table again.
+        """
+        if sample_rows is None:
+            sample_rows = self._sample_rows_in_table_info
+
+        def render() -> str:
+            if isinstance(self._metadata, LazyMetaData):
+                self._metadata.ensure_reflected()
+            default_sample_rows = self._sample_rows_in_table_info
+            self._sample_rows_in_table_info = sample_rows
+            try:
+                return super(SQLDatabase, self).get_table_info(table_names)
+            finally:
+                self._sample_rows_in_table_info = default_sample_rows
+
+        return self.cached_render(
+            render,
+            "table_info",
+            sorted(table_names) if table_names is not None else None,
+            sample_rows,
+            self._indexes_in_table_info,
+            self._custom_table_info,
+        )
+
     @staticmethod
     def _pretty_format(headers: Any, result: List[Row]) -> str:
         dicts = [dict(zip(headers, row)) for row in result]
@@ -27,27 +255,232 @@ class SQLDatabase(SQLDatabase):
 
         return tab_result
 
-    def run(self, command: str, fetch: str = "all") -> str:
-        """Execute a SQL command and return a string representing the results.
+    def _count_rows(self, connection: Any, table_name: str) -> Optional[int]:
+        if table_name not in self._row_counts:
+            try:
+                # The largest rowid, read from the end of the table b-tree instead of counting
+                count = connection.exec_driver_sql(f"SELECT MAX(rowid) FROM {_quote_identifier(table_name)}").scalar()
+            except SQLAlchemyError:
+                # e.g., a subquery, a CTE or a table without rowid
+                count = None
+            self._row_counts[table_name] = count
+        return self._row_counts[table_name]
 
-        If the statement returns rows, a string of the results is returned.
-        If the statement returns no rows, an empty string is returned.
+    def preflight(self, command: str) -> None:
+        """Reject the query if its plan has a nested loop join estimated to give too many rows.
+
+        The rows of a join without a condition are its row combinations, fewer with a condition no index serves (e.g.,
+        an inequality), and at most the LIMIT of the query when the rows are returned as the join produces them.
+        Only the plan is computed, from `EXPLAIN QUERY PLAN` for SQLite and `EXPLAIN` for DuckDB.
+        Statements the engine cannot explain are left to the execution to report.
         """
-        with self._engine.begin() as connection:
+        joins = []
+        row_limit = get_row_limit(command)
+        try:
+            with self._engine.connect() as connection:
+                if self.dialect == "sqlite":
+                    plan = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {command}").fetchall()
+                    # The plan does not tell the conditions of the joins, read from the query
+                    has_condition = has_join_condition(command)
+                    streamed = is_streamed_sqlite_plan(command, plan)
+                    for tables in find_sqlite_nested_scans(command, plan):
+                        counts = [self._count_rows(connection, table) for table in tables]
+                        description = " and ".join(
+                            f'"{table}" ({count:,} rows)' if count else f'"{table}"'
+                            for table, count in zip(tables, counts)
+                        )
+                        # Unknown counts are taken as a single row, not to reject on a guess
+                        join_rows = estimate_join_rows(
+                            math.prod(count or 1 for count in counts), has_condition, row_limit if streamed else None
+                        )
+                        joins.append((join_rows, description, has_condition))
+                elif self.dialect == "duckdb":
+                    plan_json = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {command}").fetchall()[0][1]
+                    for nested_loop in find_duckdb_nested_loops(plan_json):
+                        description = " and ".join(f"{rows:,.0f} rows" for rows in nested_loop.sides)
+                        join_rows = nested_loop.estimated_rows
+                        if nested_loop.under_limit and row_limit is not None:
+                            join_rows = min(join_rows, row_limit)
+                        joins.append((join_rows, description, nested_loop.has_condition))
+        except Exception as e:
+            # e.g., a plan format of another version, the query is left to the execution guard
+            logger.bind(msg_head="SQL preflight skipped").trace(e)
+            return
+        for join_rows, description, has_condition in joins:
+            check_join_rows(join_rows, description, has_condition)
+
+    def query(
+        self,
+        command: str,
+        max_rows: int = SQL_RESULT_MAX_ROWS,
+        count_scan_rows: int = SQL_COUNT_SCAN_ROWS,
+        timeout: Optional[float] = SQL_STATEMENT_TIMEOUT,
+    ) -> Optional[QueryResult]:
+        """Execute a SQL command and fetch at most max_rows rows, None if the statement returns no rows.
+
+        The rows are streamed, the rows beyond max_rows are only counted up to count_scan_rows (0 to not count).
+        Results of read-only deterministic queries are cached by database version.
+        Queries are preflighted (see `preflight`), and interrupted after timeout seconds or when cancelled.
+        """
+        read_only, cache_key = is_read_only(command), None
+        if self.result_cache is not None and read_only and not is_volatile(command):
+            cache_key = self.result_cache.make_key(self.get_version(), command, max_rows, count_scan_rows)
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                return self._make_result(command, **cached)
+        if read_only:
+            self.preflight(command)
+
+        start_time = time.perf_counter()
+        with self._engine.begin() as connection, statement_guard(connection.connection.connection, timeout):
             if self._schema is not None:
                 connection.exec_driver_sql(f"SET search_path TO {self._schema}")
-            cursor = connection.execute(text(command))
-            if cursor.returns_rows:
-                headers = cursor.keys()
-                if fetch == "all":
-                    result = cursor.fetchall()
-                elif fetch == "one":
-                    # result = cursor.fetchone()[0]  # type: ignore
-                    result = [cursor.fetchone()]  # type: ignore
+            cursor = connection.execution_options(stream_results=True).execute(text(command))
+            if not cursor.returns_rows:
+                if not read_only:
+                    self.mark_written()
+                return None
+            headers = list(cursor.keys())
+            rows = cursor.fetchmany(max_rows)
+            total_rows, total_rows_exact = len(rows), True
+            if len(rows) == max_rows and count_scan_rows > 0:
+                while total_rows < count_scan_rows:
+                    batch = cursor.fetchmany(min(SQL_FETCH_BATCH_ROWS, count_scan_rows - total_rows))
+                    if not batch:
+                        break
+                    total_rows += len(batch)
                 else:
-                    raise ValueError("Fetch parameter must be either 'one' or 'all'")
+                    # Stopped scanning before the end of the result
+                    total_rows_exact = False
+            cursor.close()
+        if not read_only:
+            # e.g., DuckDB returns the count of inserted rows
+            self.mark_written()
+
+        if read_only and self.query_log_path is not None:
+            append_query(self.query_log_path, command, (time.perf_counter() - start_time) * 1000)
+
+        rows = [tuple(row) for row in rows]
+        if cache_key is not None:
+            self.result_cache.set(
+                cache_key,
+                {"headers": headers, "rows": rows, "total_rows": total_rows, "total_rows_exact": total_rows_exact},
+            )
+        return self._make_result(command, headers, rows, total_rows, total_rows_exact)
 
-                # pretty format
-                tab_result = self._pretty_format(headers, result)
-                return tab_result
-        return ""
+    def _make_result(
+        self, command: str, headers: List[str], rows: List[Any], total_rows: int, total_rows_exact: bool
+    ) -> QueryResult:
+        handle = None
+        # Only read-only queries, which can be run again to page through their result
+        if (total_rows > len(rows) or not total_rows_exact) and is_read_only(command):
+            handle = uuid.uuid4().hex
+            self._result_handles[handle] = command
+            if len(self._result_handles) > MAX_RESULT_HANDLES:
+                self._result_handles.popitem(last=False)
+            if self.result_cache is not None:
+                # The agent process is gone when the result is paged, e.g., through the table page API
+                self.result_cache.set(handle, {"command": command})
+        return QueryResult(headers, rows, total_rows, total_rows_exact, handle)
+
+    def get_result_command(self, handle: str) -> str:
+        """The query of a result handle, given by this database or by another process (through the SQL cache)."""
+        command = self._result_handles.get(handle)
+        if command is None and self.result_cache is not None and RESULT_HANDLE_PATTERN.fullmatch(handle):
+            entry = self.result_cache.get(handle)
+            command = entry.get("command") if entry is not None else None
+        if command is None:
+            raise KeyError(f"Unknown or expired result handle {handle}")
+        return command
+
+    def query_page(
+        self,
+        command: str,
+        offset: int = 0,
+        limit: int = SQL_RESULT_MAX_ROWS,
+        where: str = "",
+        order_by: str = "",
+        parameters: Optional[Dict[str, Any]] = None,
+    ) -> QueryResult:
+        """Fetch a page of the full result of a read-only query, filtered by the where and sorted by the order_by
+        clauses (over the columns of the result, bound to parameters), with the number of rows matching the filter.
+        """
+        if not is_read_only(command):
+            raise ValueError("Only read-only queries can be paged.")
+        self.preflight(command)
+        command = command.strip().rstrip(";")
+        where = f" WHERE {where}" if where else ""
+        order_by = f" ORDER BY {order_by}" if order_by else ""
+        parameters = {**(parameters or {}), "limit": limit, "offset": offset}
+        with self._engine.connect() as connection, statement_guard(connection.connection.connection):
+            cursor = connection.execute(
+                text(f"SELECT * FROM ({command}) AS _result{where}{order_by} LIMIT :limit OFFSET :offset"), parameters
+            )
+            headers, rows = list(cursor.keys()), [tuple(row) for row in cursor.fetchall()]
+            total_rows = connection.execute(
+                text(f"SELECT COUNT(*) FROM ({command}) AS _result{where}"), parameters
+            ).scalar()
+        return QueryResult(headers, rows, total_rows, True)
+
+    def iter_batches(
+        self,
+        command: str,
+        batch_rows: int = SQL_FETCH_BATCH_ROWS,
+        timeout: Optional[float] = SQL_EXPORT_TIMEOUT,
+        max_rows: Optional[int] = SQL_EXPORT_MAX_ROWS,
+    ) -> Iterator[Tuple[List[str], List[tuple]]]:
+        """Stream the full result of a read-only query as (headers, rows) batches, e.g., to export it.
+
+        The first batch is yielded even if empty, so that the headers are known. The query is preflighted and
+        interrupted after timeout seconds, as in `query`, and the result is cut after max_rows rows (None for all).
+        """
+        if not is_read_only(command):
+            raise ValueError("Only read-only queries can be exported.")
+        self.preflight(command)
+        remaining_rows = max_rows if max_rows is not None else float("inf")
+        with self._engine.connect() as connection, statement_guard(connection.connection.connection, timeout):
+            cursor = connection.execution_options(stream_results=True).execute(text(command))
+            if not cursor.returns_rows:
+                raise ValueError("The query returns no rows.")
+            headers = list(cursor.keys())
+            rows = cursor.fetchmany(int(min(batch_rows, remaining_rows)))
+            remaining_rows -= len(rows)
+            yield headers, [tuple(row) for row in rows]
+            while rows and remaining_rows > 0:
+                rows = cursor.fetchmany(int(min(batch_rows, remaining_rows)))
+                remaining_rows -= len(rows)
+                if rows:
+                    yield headers, [tuple(row) for row in rows]
+            if remaining_rows <= 0 and cursor.fetchone() is not None:
+                logger.bind(msg_head="SQL export truncated").warning(f"Cut after {max_rows} rows: {command}")
+            cursor.close()
+
+    def format_result(self, result: QueryResult, max_bytes: int = SQL_RESULT_MAX_BYTES) -> str:
+        """Format the rows as a table of at most max_bytes UTF-8 bytes, noting the truncation if any."""
+        rows = result.rows
+        tab_result = self._pretty_format(result.headers, rows)
+        while len(tab_result.encode("utf-8")) > max_bytes and len(rows) > 1:
+            rows = rows[: len(rows) // 2]
+            tab_result = self._pretty_format(result.headers, rows)
+        if len(rows) < result.total_rows or not result.total_rows_exact:
+            total = f"{result.total_rows}" if result.total_rows_exact else f"more than {result.total_rows}"
+            tab_result += f"\n(Showing the first {len(rows)} of {total} rows"
+            tab_result += f", result handle: {result.handle})" if result.handle is not None else ")"
+        return tab_result
+
+    def run(self, command: str, fetch: str = "all") -> str:
+        """Execute a SQL command and return a string representing the results.
+
+        If the statement returns rows, a string of the first rows is returned.
+        If the statement returns no rows, an empty string is returned.
+        """
+        if fetch == "all":
+            result = self.query(command)
+        elif fetch == "one":
+            result = self.query(command, max_rows=1, count_scan_rows=0)
+        else:
+            raise ValueError("Fetch parameter must be either 'one' or 'all'")
+        if result is None:
+            return ""
+        # pretty format
+        return self.format_result(result)
@@ -0,0 +1,123 @@
+"""Disk cache of SQL query results and schema renderings, keyed by database version."""
+import hashlib
+import os
+import pickle
+import re
+from typing import Any, Dict, Optional
+
+import sqlparse
+from loguru import logger
+
+SQL_CACHE_DIR = os.getenv("SQL_CACHE_DIR", ".sql_cache")
+SQL_CACHE_MAX_BYTES = int(os.getenv("SQL_CACHE_MAX_BYTES", 256 * 1024**2))
+MAX_ENTRY_BYTES = 4 * 1024 * 1024
+
+# Functions whose result changes from one execution to the other
+VOLATILE_PATTERN = re.compile(
+    r"\b(random|randomblob|uuid|gen_random_uuid|now|current_timestamp|current_date|current_time|localtimestamp)\b"
+    r"|'now'",
+    re.IGNORECASE,
+)
+
+
+def normalize_sql(command: str) -> str:
+    """Same string for queries only differing by whitespace, comments or keyword case."""
+    normalized = sqlparse.format(command, keyword_case="upper", strip_comments=True, strip_whitespace=True)
+    return normalized.strip().rstrip(";").strip()
+
+
+def is_read_only(command: str) -> bool:
+    """Whether all the statements are queries, e.g., `WITH ... SELECT`, a conservative check."""
+    statements = [statement for statement in sqlparse.parse(command) if statement.token_first() is not None]
+    return len(statements) > 0 and all(statement.get_type() == "SELECT" for statement in statements)
+
+
+def is_volatile(command: str) -> bool:
+    return VOLATILE_PATTERN.search(command) is not None
+
+
+class SQLResultCache:
+    """Query results shared by the agent processes, the least recently used ones are evicted by total size."""
+
+    def __init__(
+        self,
+        cache_dir: str = SQL_CACHE_DIR,
+        max_bytes: int = SQL_CACHE_MAX_BYTES,
+        max_entry_bytes: int = MAX_ENTRY_BYTES,
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+
+    @staticmethod
+    def make_key(database_version: str, command: str, *options: Any) -> str:
+        digest = hashlib.sha256()
+        digest.update(database_version.encode("utf-8"))
+        digest.update(b"\0" + normalize_sql(command).encode("utf-8"))
+        for option in options:
+            digest.update(b"\0" + str(option).encode("utf-8"))
+        return digest.hexdigest()
+
+    @staticmethod
+    def make_render_key(database_version: str, *options: Any) -> str:
+        """Key of a text rendered from the database, e.g., the table info given to the LLM."""
+        digest = hashlib.sha256()
+        digest.update(b"render\0" + database_version.encode("utf-8"))
+        for option in options:
+            digest.update(b"\0" + str(option).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + ".pkl")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                result = pickle.load(f)
+            os.utime(path)  # the mtime is the last use, for the LRU eviction
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+        logger.bind(msg_head="SQL cache hit").trace(key)
+        return result
+
+    def set(self, key: str, result: Dict[str, Any]) -> None:
+        try:
+            data = pickle.dumps(result)
+        except Exception as e:
+            # e.g., a value of a driver specific type
+            logger.bind(msg_head="SQL result not cacheable").trace(e)
+            return
+        if len(data) > self.max_entry_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._prune()
+
+    def _prune(self) -> None:
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".pkl"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+        total_bytes = sum(size for _, size, _ in entries)
+        if total_bytes <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_bytes -= size
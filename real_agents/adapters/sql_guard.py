@@ -0,0 +1,269 @@
+"""Cost guard of the SQL queries: plan preflight, statement timeout and cancellation."""
+
+import json
+import math
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Set
+
+from loguru import logger
+
+# Below the stream timeout of the chat, so that the agent gets the error in time to rewrite the query
+SQL_STATEMENT_TIMEOUT = float(os.getenv("SQL_STATEMENT_TIMEOUT", 60))
+# Exports stream full results to the client, which takes longer than the agent queries
+SQL_EXPORT_TIMEOUT = float(os.getenv("SQL_EXPORT_TIMEOUT", 600))
+# Rows streamed at most by an export, the rest of the result is cut
+SQL_EXPORT_MAX_ROWS = int(os.getenv("SQL_EXPORT_MAX_ROWS", 10**7))
+# Nested loop joins estimated to give more rows than this are rejected before running
+SQL_MAX_JOIN_ROWS = int(os.getenv("SQL_MAX_JOIN_ROWS", 10**8))
+# Share of the row combinations kept by a join condition no index serves (e.g., an inequality), the default
+# selectivity of an inequality in PostgreSQL
+JOIN_CONDITION_SELECTIVITY = 1 / 3
+# SQLite virtual machine instructions between two checks of the progress handler
+PROGRESS_HANDLER_STEPS = 10000
+# DuckDB operators joining every row of one side with every row of the other
+DUCKDB_NESTED_LOOP_OPERATORS = {"CROSS_PRODUCT", "NESTED_LOOP_JOIN", "BLOCKWISE_NL_JOIN"}
+DUCKDB_LIMIT_OPERATORS = {"LIMIT", "STREAMING_LIMIT"}
+# Operators passing the rows on as they come, a LIMIT above them stops the join below once it has enough rows
+DUCKDB_STREAMING_OPERATORS = DUCKDB_LIMIT_OPERATORS | {"PROJECTION", "FILTER"}
+# Steps of a SQLite plan reading the whole join before the first row is returned
+SQLITE_BLOCKING_STEPS = ("USE TEMP B-TREE", "MATERIALIZE")
+
+# Estimated cardinality in the extra info string of the older DuckDB JSON plans
+DUCKDB_CARDINALITY_PATTERN = re.compile(r"(?:\bEC|Estimated Cardinality):\s*~?(\d+(?:\.\d+)?)")
+
+# "SCAN t", "SCAN TABLE t AS a" (SQLite < 3.36), "SCAN t USING COVERING INDEX ix"
+SQLITE_SCAN_PATTERN = re.compile(r'^SCAN (?:TABLE )?("[^"]+"|\S+)(?: AS (\S+))?')
+# Table name and alias after FROM, JOIN or a comma, to find the table of an aliased scan
+TABLE_ALIAS_PATTERN = re.compile(
+    r'(?:\bFROM|\bJOIN|,)\s+("[^"]+"|[\w.]+)\s+(?:AS\s+)?(?!(?:ON|USING|WHERE|JOIN|INNER|LEFT|RIGHT|FULL|CROSS|'
+    r"NATURAL|GROUP|ORDER|LIMIT|HAVING|UNION|EXCEPT|INTERSECT|WINDOW)\b)(\w+)",
+    re.IGNORECASE,
+)
+
+# LIMIT of the outer query, "LIMIT n", "LIMIT n OFFSET m" or "LIMIT m, n"
+LIMIT_PATTERN = re.compile(r"\bLIMIT\s+(\d+)(?:\s*(?:,|\bOFFSET\b)\s*(\d+))?\s*;?\s*$", re.IGNORECASE)
+AGGREGATE_PATTERN = re.compile(
+    r"\b(?:COUNT|SUM|AVG|MIN|MAX|TOTAL|GROUP_CONCAT|STRING_AGG|ARRAY_AGG|LIST)\s*\(", re.IGNORECASE
+)
+_IDENTIFIER = r'(?:"[^"]+"|[A-Za-z_]\w*)(?:\.(?:"[^"]+"|[A-Za-z_]\w*))?'
+# A column compared with another column, e.g., `a.start < b.end`, rather than with a value
+COLUMN_COMPARISON_PATTERN = re.compile(
+    rf"({_IDENTIFIER})\s*(?:=|==|<>|!=|<=|>=|<|>)\s*({_IDENTIFIER})(?!\s*[(.])|\bBETWEEN\s+({_IDENTIFIER})(?!\s*[(.])"
+)
+NON_COLUMN_WORDS = {"NULL", "TRUE", "FALSE", "CURRENT_DATE", "CURRENT_TIME", "CURRENT_TIMESTAMP"}
+USING_PATTERN = re.compile(r"\bUSING\s*\(|\bNATURAL\s+(?:\w+\s+)*?JOIN\b", re.IGNORECASE)
+
+_cancelled = threading.Event()
+_running_connections: Set[Any] = set()
+_running_lock = threading.Lock()
+
+
+def _interrupt(dbapi_connection: Any) -> None:
+    """Abort the statement running on the connection, e.g., sqlite3 and duckdb interrupt, psycopg2 cancels."""
+    for method in ("interrupt", "cancel"):
+        if hasattr(dbapi_connection, method):
+            try:
+                getattr(dbapi_connection, method)()
+            except Exception as e:
+                logger.bind(msg_head="SQL interrupt failed").debug(e)
+            return
+
+
+def interrupt_queries() -> None:
+    """Interrupt the running queries of the process, and refuse the next ones."""
+    _cancelled.set()
+    with _running_lock:
+        connections = list(_running_connections)
+    for dbapi_connection in connections:
+        _interrupt(dbapi_connection)
+
+
+def watch_cancellation(cancel_event: Any) -> threading.Thread:
+    """Interrupt the queries of this process once cancel_event (e.g., shared with the chat server) is set."""
+
+    def watch() -> None:
+        cancel_event.wait()
+        logger.bind(msg_head="SQL queries cancelled").debug(os.getpid())
+        interrupt_queries()
+
+    thread = threading.Thread(target=watch, daemon=True)
+    thread.start()
+    return thread
+
+
+@contextmanager
+def statement_guard(dbapi_connection: Any, timeout: Optional[float] = SQL_STATEMENT_TIMEOUT) -> Iterator[None]:
+    """Abort the statements run on the connection within the block after timeout seconds or once cancelled.
+
+    SQLite checks the deadline from a progress handler, the other drivers are interrupted by a timer.
+    """
+    if _cancelled.is_set():
+        raise InterruptedError("The query was cancelled.")
+    deadline = time.monotonic() + timeout if timeout else None
+    timer = None
+    if hasattr(dbapi_connection, "set_progress_handler"):
+
+        def progress_handler() -> int:
+            # A non-zero return aborts the statement
+            return int(_cancelled.is_set() or (deadline is not None and time.monotonic() > deadline))
+
+        dbapi_connection.set_progress_handler(progress_handler, PROGRESS_HANDLER_STEPS)
+    elif deadline is not None:
+        timer = threading.Timer(timeout, _interrupt, args=(dbapi_connection,))
+        timer.daemon = True
+        timer.start()
+    with _running_lock:
+        _running_connections.add(dbapi_connection)
+    try:
+        yield
+    except Exception:
+        if _cancelled.is_set():
+            raise InterruptedError("The query was cancelled.")
+        if deadline is not None and time.monotonic() > deadline:
+            raise TimeoutError(
+                f"The query was stopped after running for more than {timeout:g} seconds, "
+                "rewrite it to read less data, e.g., with filters, join conditions or a LIMIT."
+            )
+        raise
+    finally:
+        with _running_lock:
+            _running_connections.discard(dbapi_connection)
+        if timer is not None:
+            timer.cancel()
+        if hasattr(dbapi_connection, "set_progress_handler"):
+            dbapi_connection.set_progress_handler(None, 0)
+
+
+def _unquote(name: str) -> str:
+    return name[1:-1].replace('""', '"') if name.startswith('"') else name
+
+
+def find_sqlite_nested_scans(command: str, plan: List[Any]) -> List[List[str]]:
+    """Tables fully scanned in a nested loop, by SELECT of the EXPLAIN QUERY PLAN rows (id, parent, _, detail).
+
+    A second full scan in the same SELECT means that the join had no usable condition (a SEARCH otherwise).
+    """
+    aliases = {alias.lower(): _unquote(table) for table, alias in TABLE_ALIAS_PATTERN.findall(command)}
+    scans_by_parent: Dict[int, List[str]] = {}
+    for _, parent, _, detail in plan:
+        match = SQLITE_SCAN_PATTERN.match(detail)
+        if match is None or detail.startswith("SCAN CONSTANT ROW"):
+            continue
+        name = _unquote(match.group(2) or match.group(1))
+        scans_by_parent.setdefault(parent, []).append(aliases.get(name.lower(), name))
+    return [tables for tables in scans_by_parent.values() if len(tables) > 1]
+
+
+class NestedLoop(NamedTuple):
+    """Nested loop join of a DuckDB plan."""
+
+    # Estimated rows of each side
+    sides: List[float]
+    # Estimated rows of the join
+    estimated_rows: float
+    # False for a cross product
+    has_condition: bool
+    # Under a LIMIT through streaming operators only, the join stops once the LIMIT has its rows
+    under_limit: bool
+
+
+def find_duckdb_nested_loops(plan_json: str) -> List[NestedLoop]:
+    """Nested loop joins of a DuckDB `EXPLAIN (FORMAT JSON)` plan, with their estimated cardinalities."""
+
+    def estimate(node: Dict[str, Any]) -> Optional[float]:
+        extra_info = node.get("extra_info", {})
+        if isinstance(extra_info, dict):
+            estimate = extra_info.get("Estimated Cardinality")
+        else:
+            # A string in the older versions, e.g., "...\n[INFOSEPARATOR]\nEC: 1000"
+            match = DUCKDB_CARDINALITY_PATTERN.search(str(extra_info))
+            estimate = match.group(1) if match else None
+        return float(str(estimate).lstrip("~")) if estimate is not None else None
+
+    def cardinality(node: Dict[str, Any]) -> Optional[float]:
+        rows = estimate(node)
+        if rows is not None:
+            return rows
+        children = node.get("children", [])
+        return cardinality(children[0]) if len(children) == 1 else None
+
+    nested_loops = []
+
+    def walk(node: Dict[str, Any], under_limit: bool) -> None:
+        name = node.get("name")
+        children = node.get("children", [])
+        if name in DUCKDB_NESTED_LOOP_OPERATORS and len(children) == 2:
+            sides = [cardinality(child) for child in children]
+            if None not in sides:
+                # A cross product has no estimate of its own
+                has_condition = name != "CROSS_PRODUCT"
+                rows = estimate(node) if has_condition else None
+                rows = rows if rows is not None else math.prod(sides)
+                nested_loops.append(NestedLoop(sides, rows, has_condition, under_limit))
+        if name in DUCKDB_LIMIT_OPERATORS:
+            under_limit = True
+        elif name not in DUCKDB_STREAMING_OPERATORS:
+            under_limit = False
+        for child in children:
+            walk(child, under_limit)
+
+    for root in json.loads(plan_json):
+        walk(root, False)
+    return nested_loops
+
+
+def get_row_limit(command: str) -> Optional[int]:
+    """Rows of the result read at most because of the LIMIT of the outer query, None without one."""
+    match = LIMIT_PATTERN.search(command.strip())
+    if match is None:
+        return None
+    return sum(int(number) for number in match.groups() if number is not None)
+
+
+def is_streamed_sqlite_plan(command: str, plan: List[Any]) -> bool:
+    """Whether SQLite returns the rows of the query as its joins produce them, so that a LIMIT stops them early,
+    i.e., no sorting, grouping, distinct, materialized subquery nor aggregate."""
+    if any(str(detail).startswith(SQLITE_BLOCKING_STEPS) for *_, detail in plan):
+        return False
+    return AGGREGATE_PATTERN.search(command) is None
+
+
+def has_join_condition(command: str) -> bool:
+    """Whether the query compares columns with each other (e.g., `a.start < b.end`) or joins with USING or NATURAL,
+    which SQLite plans as a nested loop when no index serves the condition."""
+    if USING_PATTERN.search(command):
+        return True
+    for match in COLUMN_COMPARISON_PATTERN.finditer(command):
+        names = [name for name in match.groups() if name is not None]
+        if not any(name.upper() in NON_COLUMN_WORDS for name in names):
+            return True
+    return False
+
+
+def estimate_join_rows(combinations: float, has_condition: bool, row_limit: Optional[int] = None) -> float:
+    """Rows given by a nested loop join of so many row combinations, at most row_limit if a LIMIT stops it."""
+    rows = combinations * JOIN_CONDITION_SELECTIVITY if has_condition else combinations
+    return min(rows, row_limit) if row_limit is not None else rows
+
+
+def check_join_rows(
+    join_rows: float, description: str, has_condition: bool = False, max_join_rows: int = SQL_MAX_JOIN_ROWS
+) -> None:
+    """Reject a query whose nested loop join is estimated to give more rows than max_join_rows."""
+    if join_rows <= max_join_rows:
+        return
+    if has_condition:
+        raise ValueError(
+            f"The query was not run: it joins {description} on a condition no index serves (e.g., an inequality), "
+            f"estimated to give about {join_rows:,.0f} rows. Join on equal keys (e.g., `JOIN ... ON a.key = b.key`), "
+            f"filter the tables first or add a LIMIT."
+        )
+    raise ValueError(
+        f"The query was not run: it joins {description} without a join condition, i.e., about "
+        f"{join_rows:,.0f} row combinations. Add a join condition (e.g., `JOIN ... ON a.key = b.key`), "
+        f"filter the tables first or add a LIMIT."
+    )
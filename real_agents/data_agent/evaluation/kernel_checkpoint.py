@@ -0,0 +1,141 @@
+"""Code run inside a kernel to checkpoint its variables to disk and restore them into a fresh kernel.
+
+The restore is lazy: the modules are imported in the new kernel at once, each variable is only loaded by the first
+execution using it, so that a chat resuming with one dataframe does not wait for all of them.
+"""
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+KERNEL_CHECKPOINT_ENABLED = os.getenv("KERNEL_CHECKPOINT_ENABLED", "false").lower() == "true"
+# Relative to the kernel working directory, i.e., the user's home in the code interpreter
+KERNEL_CHECKPOINT_DIR = os.getenv("KERNEL_CHECKPOINT_DIR", ".kernel_checkpoints")
+KERNEL_CHECKPOINT_MAX_BYTES = int(os.getenv("KERNEL_CHECKPOINT_MAX_BYTES", 1024**3))
+RESTORED_PREFIX = "[RESTORED]: "
+
+# Dataframes are written as parquet (pickle if pyarrow is missing or a dtype is not supported),
+# the other variables with dill (pickle if not installed). Modules are re-imported by name. The variables of an
+# earlier checkpoint not restored yet (nor redefined) are kept.
+# Everything is wrapped in a function deleted afterwards to keep the kernel namespace clean.
+CHECKPOINT_CODE = """
+def __checkpoint(path, max_bytes):
+    import json, os, pickle, shutil, types
+    import pandas as pd
+    try:
+        import dill as serializer
+    except ImportError:
+        serializer = pickle
+    manifest, written = {{"modules": {{}}, "variables": {{}}}}, 0
+    manifest_path = os.path.join(path, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            pending = json.load(f)["variables"]
+        for name, entry in pending.items():
+            if name not in globals() and os.path.exists(entry["file"]):
+                manifest["variables"][name] = entry
+                written += os.path.getsize(entry["file"])
+    else:
+        shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+    for name, value in list(globals().items()):
+        if name.startswith("_") or name in ("In", "Out", "exit", "quit", "get_ipython"):
+            continue
+        if isinstance(value, types.ModuleType):
+            manifest["modules"][name] = value.__name__
+            continue
+        file_path = os.path.join(path, name)
+        try:
+            if isinstance(value, pd.DataFrame):
+                try:
+                    file_path, fmt = file_path + ".parquet", "parquet"
+                    value.to_parquet(file_path)
+                except Exception:
+                    file_path, fmt = file_path + ".pkl", "pandas"
+                    value.to_pickle(file_path)
+            else:
+                file_path, fmt = file_path + ".pkl", serializer.__name__
+                with open(file_path, "wb") as f:
+                    serializer.dump(value, f)
+        except Exception:
+            # Not serializable, e.g., an open connection
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            continue
+        written += os.path.getsize(file_path)
+        if written > max_bytes:
+            os.remove(file_path)
+            break
+        manifest["variables"][name] = {{"format": fmt, "file": file_path}}
+    with open(os.path.join(path, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+__checkpoint({path!r}, {max_bytes})
+del __checkpoint
+"""
+
+# Restores the modules and the variables in names (all if None), the others are left in the checkpoint
+RESTORE_CODE = """
+def __restore(path, names):
+    import importlib, json, os, pickle, shutil
+    import pandas as pd
+    manifest_path = os.path.join(path, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return {{"restored": [], "pending": []}}
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    restored = []
+    for name, module in manifest["modules"].items():
+        try:
+            globals()[name] = importlib.import_module(module)
+        except Exception:
+            pass
+    for name, entry in list(manifest["variables"].items()):
+        if names is not None and name not in names:
+            continue
+        del manifest["variables"][name]
+        try:
+            if entry["format"] == "parquet":
+                globals()[name] = pd.read_parquet(entry["file"])
+            elif entry["format"] == "pandas":
+                globals()[name] = pd.read_pickle(entry["file"])
+            else:
+                serializer = importlib.import_module(entry["format"])
+                with open(entry["file"], "rb") as f:
+                    globals()[name] = serializer.load(f)
+            restored.append(name)
+            os.remove(entry["file"])
+        except Exception:
+            pass
+    if manifest["variables"]:
+        manifest["modules"] = {{}}
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f)
+    else:
+        # A checkpoint is restored once, later evictions write a new one
+        shutil.rmtree(path, ignore_errors=True)
+    return {{"restored": restored, "pending": list(manifest["variables"])}}
+print({prefix!r} + __import__("json").dumps(__restore({path!r}, {names!r})))
+del __restore
+"""
+
+
+def _get_checkpoint_path(chat_id: str) -> str:
+    return os.path.join(KERNEL_CHECKPOINT_DIR, chat_id)
+
+
+def get_checkpoint_code(chat_id: str, max_bytes: int = KERNEL_CHECKPOINT_MAX_BYTES) -> str:
+    return CHECKPOINT_CODE.format(path=_get_checkpoint_path(chat_id), max_bytes=max_bytes)
+
+
+def get_restore_code(chat_id: str, names: Optional[List[str]] = None) -> str:
+    """Restore the variables in names (all if None, none but the modules if empty) from the chat's checkpoint."""
+    names = sorted(names) if names is not None else None
+    return RESTORE_CODE.format(path=_get_checkpoint_path(chat_id), names=names, prefix=RESTORED_PREFIX)
+
+
+def parse_restored_variables(stdout: str) -> Dict[str, Any]:
+    """Get the names of the restored variables and of the ones still in the checkpoint from the output of the
+    restore code."""
+    for line in stdout.split("\n"):
+        if line.startswith(RESTORED_PREFIX):
+            return json.loads(line[len(RESTORED_PREFIX) :])
+    return {"restored": [], "pending": []}
@@ -0,0 +1,49 @@
+"""Code run inside a kernel to write a dataframe variable to a file, to be streamed out by the export API."""
+import json
+import os
+import uuid
+from typing import Tuple
+
+# Relative to the kernel working directory, i.e., the user's home in the code interpreter
+KERNEL_EXPORT_DIR = os.getenv("KERNEL_EXPORT_DIR", ".exports")
+EXPORTED_PREFIX = "[EXPORTED]: "
+
+# Written by pandas with pyarrow for Parquet and Arrow IPC, wrapped in a function deleted afterwards to keep the
+# kernel namespace clean. Anything but a dataframe (or a series, as a single column) is refused.
+EXPORT_CODE = """
+def __export(name, path, fmt):
+    import os
+    import pandas as pd
+    value = globals().get(name)
+    if isinstance(value, pd.Series):
+        value = value.to_frame()
+    if not isinstance(value, pd.DataFrame):
+        raise TypeError(f"{{name}} is not a dataframe")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if fmt == "parquet":
+        value.to_parquet(path)
+    elif fmt == "arrow":
+        import pyarrow as pa
+        table = pa.Table.from_pandas(value)
+        with pa.ipc.new_stream(path, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        value.to_csv(path)
+    return len(value)
+print({prefix!r} + __import__("json").dumps(__export({name!r}, {path!r}, {fmt!r})))
+del __export
+"""
+
+
+def get_export_code(variable: str, export_format: str) -> Tuple[str, str]:
+    """The code writing the variable in the export format, and the file it writes (relative to the kernel)."""
+    path = os.path.join(KERNEL_EXPORT_DIR, f"{uuid.uuid4().hex}.{export_format}")
+    return EXPORT_CODE.format(name=variable, path=path, fmt=export_format, prefix=EXPORTED_PREFIX), path
+
+
+def parse_exported_rows(stdout: str) -> int:
+    """Get the number of rows written from the output of the export code, -1 if not found."""
+    for line in stdout.split("\n"):
+        if line.startswith(EXPORTED_PREFIX):
+            return json.loads(line[len(EXPORTED_PREFIX) :])
+    return -1
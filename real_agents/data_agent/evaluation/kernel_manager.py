@@ -0,0 +1,295 @@
+"""Lifecycle management of the docker jupyter kernels."""
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+from loguru import logger
+
+from real_agents.data_agent.evaluation.kernel_checkpoint import (
+    KERNEL_CHECKPOINT_ENABLED,
+    get_checkpoint_code,
+    get_restore_code,
+    parse_restored_variables,
+)
+from real_agents.data_agent.evaluation.kernel_export import get_export_code, parse_exported_rows
+from real_agents.data_agent.evaluation.kernel_page import get_page_code, parse_paged_rows
+from real_agents.data_agent.evaluation.output_budget import get_output_budget_code
+
+# Kernels unused for longer than this are stopped by the reaper
+KERNEL_IDLE_TTL = int(os.getenv("KERNEL_IDLE_TTL", 30 * 60))
+KERNEL_REAP_INTERVAL = int(os.getenv("KERNEL_REAP_INTERVAL", 60))
+KERNEL_PROBE_TIMEOUT = 5
+KERNEL_CHECKPOINT_TIMEOUT = 120
+KERNEL_EXPORT_TIMEOUT = int(os.getenv("KERNEL_EXPORT_TIMEOUT", 600))
+KERNEL_PAGE_TIMEOUT = int(os.getenv("KERNEL_PAGE_TIMEOUT", 30))
+# Busy marks expire after this, so that a process dying while executing does not keep its kernel busy forever
+KERNEL_BUSY_TTL = int(os.getenv("KERNEL_BUSY_TTL", 3600))
+GB = 1024**3
+
+# Redis hashes: kid -> kernel info, "<user_id>:<chat_id>" -> eviction info
+REGISTRY_KEY = "kernel_registry"
+EVICTION_KEY = "kernel_evictions"
+# Redis hash: kid -> variables of the chat's checkpoint not restored into the kernel yet
+PENDING_RESTORE_KEY = "kernel_pending_restores"
+# Redis counters: number of executions running in the kernel
+BUSY_KEY_PREFIX = "kernel_busy:"
+# Resident memory of the kernel process, written as a one-liner to keep the kernel namespace clean
+RSS_PROBE_CODE = "print(int(open('/proc/self/statm').read().split()[1]) * __import__('os').sysconf('SC_PAGE_SIZE'))"
+
+
+class KernelLifecycleManager:
+    """Track last use and memory of each kernel, evict kernels when a user runs out of them and reap idle ones.
+
+    The state is kept in redis since kernels are used from the agent processes and reaped from the backend.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        redis_client: Any,
+        idle_ttl: int = KERNEL_IDLE_TTL,
+        reap_interval: int = KERNEL_REAP_INTERVAL,
+        checkpoint_enabled: bool = KERNEL_CHECKPOINT_ENABLED,
+    ):
+        self.base_url = base_url
+        self.r = redis_client
+        self.idle_ttl = idle_ttl
+        self.reap_interval = reap_interval
+        self.checkpoint_enabled = checkpoint_enabled
+
+    def get_kernel_info(self, kid: str) -> Optional[Dict[str, Any]]:
+        info = self.r.hget(REGISTRY_KEY, kid)
+        return json.loads(info) if info is not None else None
+
+    def list_kernels(self, user_id: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        kernels = {kid: json.loads(info) for kid, info in self.r.hgetall(REGISTRY_KEY).items()}
+        if user_id is not None:
+            kernels = {kid: info for kid, info in kernels.items() if info["user_id"] == user_id}
+        return kernels
+
+    def find_kernel(self, user_id: str, chat_id: str) -> Optional[str]:
+        """Find the kernel of a chat, e.g., when the backend restarted and lost its kernel pool."""
+        for kid, info in self.list_kernels(user_id).items():
+            if info["chat_id"] == chat_id:
+                return kid
+        return None
+
+    def touch(self, user_id: str, chat_id: str, kid: str, rss: Optional[int] = None) -> None:
+        """Record a use of the kernel."""
+        info = self.get_kernel_info(kid) or {}
+        info.update(
+            {
+                "user_id": user_id,
+                "chat_id": chat_id,
+                "last_used": time.time(),
+                "rss": rss if rss is not None else info.get("rss", 0),
+            }
+        )
+        self.r.hset(REGISTRY_KEY, kid, json.dumps(info))
+
+    def forget(self, kid: str) -> None:
+        self.r.hdel(REGISTRY_KEY, kid)
+        self.r.hdel(PENDING_RESTORE_KEY, kid)
+
+    @contextmanager
+    def busy(self, kid: str) -> Iterator[None]:
+        """Mark the kernel as executing within, the reaper neither stops nor probes it meanwhile."""
+        key = f"{BUSY_KEY_PREFIX}{kid}"
+        self.r.incr(key)
+        self.r.expire(key, KERNEL_BUSY_TTL)
+        try:
+            yield
+        finally:
+            # Left at 0 rather than deleted, which could drop the mark of an execution started meanwhile
+            self.r.decr(key)
+
+    def is_busy(self, kid: str) -> bool:
+        return int(self.r.get(f"{BUSY_KEY_PREFIX}{kid}") or 0) > 0
+
+    def _exec(self, user_id: str, kid: str, code: str, timeout: float) -> str:
+        """Execute code in the kernel and return its stdout."""
+        with self.busy(kid):
+            response = requests.post(
+                f"{self.base_url}/kernel/exec",
+                json={"username": user_id, "code": code, "kid": kid},
+                timeout=timeout,
+            ).json()
+        if response.get("shell", {}).get("status") == "error":
+            raise RuntimeError(f"{response['shell']['ename']}: {response['shell']['evalue']}")
+        stdout = ""
+        for output_dict in response.get("output", None) or []:
+            if output_dict["type"] == "stream" and output_dict["content"]["name"] == "stdout":
+                stdout += output_dict["content"]["text"]
+        return stdout
+
+    def probe_rss(self, user_id: str, kid: str) -> Optional[int]:
+        """Ask the kernel for its resident memory, None if it is busy or does not answer in time."""
+        if self.is_busy(kid):
+            # Queued behind the running cell, the probe would only time out
+            return None
+        try:
+            return int(self._exec(user_id, kid, RSS_PROBE_CODE, KERNEL_PROBE_TIMEOUT).strip())
+        except Exception as e:
+            logger.bind(user_id=user_id, msg_head="Kernel rss probe error").trace(e)
+        return None
+
+    def setup_output_budget(self, user_id: str, kid: str) -> bool:
+        """Install the output size limits in a new kernel."""
+        try:
+            self._exec(user_id, kid, get_output_budget_code(), KERNEL_PROBE_TIMEOUT)
+            return True
+        except Exception as e:
+            logger.bind(user_id=user_id, msg_head="Kernel output budget error").error(str(e))
+            return False
+
+    def checkpoint(self, user_id: str, chat_id: str, kid: str) -> bool:
+        """Save the kernel variables to disk, to be restored in the next kernel of the chat."""
+        try:
+            self._exec(user_id, kid, get_checkpoint_code(chat_id), KERNEL_CHECKPOINT_TIMEOUT)
+            return True
+        except Exception as e:
+            logger.bind(user_id=user_id, chat_id=chat_id, msg_head="Kernel checkpoint error").error(str(e))
+            return False
+
+    def restore(self, user_id: str, chat_id: str, kid: str, names: Optional[List[str]] = None) -> List[str]:
+        """Load the variables in names (all if None) of the chat's checkpoint (if any) into the kernel and return
+        the restored variables. The others are left pending, to be restored by `restore_used`."""
+        try:
+            restore = parse_restored_variables(
+                self._exec(user_id, kid, get_restore_code(chat_id, names), KERNEL_CHECKPOINT_TIMEOUT)
+            )
+        except Exception as e:
+            logger.bind(user_id=user_id, chat_id=chat_id, msg_head="Kernel restore error").error(str(e))
+            return []
+        if restore["pending"]:
+            self.r.hset(PENDING_RESTORE_KEY, kid, json.dumps(restore["pending"]))
+        else:
+            self.r.hdel(PENDING_RESTORE_KEY, kid)
+
+        logger.bind(user_id=user_id, chat_id=chat_id, msg_head="Kernel variables restored").debug(restore)
+
+        return restore["restored"]
+
+    def get_pending_restore(self, kid: str) -> List[str]:
+        pending = self.r.hget(PENDING_RESTORE_KEY, kid)
+        return json.loads(pending) if pending is not None else []
+
+    def restore_used(self, user_id: str, chat_id: str, kid: str, names: Iterable[str]) -> List[str]:
+        """Restore the pending variables among names, e.g., the variables a cell reads, before using them."""
+        used = [name for name in self.get_pending_restore(kid) if name in set(names)]
+        return self.restore(user_id, chat_id, kid, used) if used else []
+
+    def export(self, user_id: str, chat_id: str, kid: str, variable: str, export_format: str) -> str:
+        """Write a dataframe variable of the kernel to a file, returned relative to the kernel working directory."""
+        self.restore_used(user_id, chat_id, kid, [variable])
+        code, path = get_export_code(variable, export_format)
+        rows = parse_exported_rows(self._exec(user_id, kid, code, KERNEL_EXPORT_TIMEOUT))
+        self.touch(user_id, chat_id, kid)
+
+        logger.bind(user_id=user_id, chat_id=chat_id, msg_head="Kernel variable exported").debug(
+            {"kid": kid, "variable": variable, "format": export_format, "rows": rows}
+        )
+
+        return path
+
+    def page(
+        self,
+        user_id: str,
+        chat_id: str,
+        kid: str,
+        variable: str,
+        start: int,
+        stop: int,
+        sorting: Optional[List[Dict[str, Any]]] = None,
+        filters: Optional[List[Dict[str, Any]]] = None,
+    ) -> Tuple[str, int]:
+        """Write a page of a dataframe variable of the kernel to a Parquet file, returned relative to the kernel
+        working directory along with the number of rows matching the filters."""
+        self.restore_used(user_id, chat_id, kid, [variable])
+        code, path = get_page_code(variable, start, stop, sorting, filters)
+        total = parse_paged_rows(self._exec(user_id, kid, code, KERNEL_PAGE_TIMEOUT))
+        self.touch(user_id, chat_id, kid)
+        return path, total
+
+    @staticmethod
+    def eviction_score(info: Optional[Dict[str, Any]], now: float) -> float:
+        """LRU weighted by memory, the higher the score the sooner the kernel is evicted."""
+        if info is None:
+            # Kernels we know nothing about, e.g., created before a backend restart, go first
+            return float("inf")
+        idle_seconds = max(now - info["last_used"], 0.0)
+        return idle_seconds * (1 + info.get("rss", 0) / GB)
+
+    def select_victim(self, kernel_ids: List[str]) -> str:
+        now = time.time()
+        return max(kernel_ids, key=lambda kid: self.eviction_score(self.get_kernel_info(kid), now))
+
+    def evict(self, user_id: str, kid: str, reason: str) -> Dict[str, Any]:
+        """Stop the kernel and record the eviction so that its chat knows the kernel state is gone.
+
+        With checkpoints enabled, the kernel variables are saved first and restored in the chat's next kernel.
+        """
+        info = self.get_kernel_info(kid)
+        checkpointed = self.checkpoint_enabled and info is not None and self.checkpoint(user_id, info["chat_id"], kid)
+        response = requests.post(f"{self.base_url}/kernel/stop", json={"username": user_id, "kid": kid}).json()
+        if info is not None:
+            eviction = {
+                "kid": kid,
+                "reason": reason,
+                "time": time.time(),
+                "rss": info.get("rss", 0),
+                "checkpointed": checkpointed,
+            }
+            self.r.hset(EVICTION_KEY, f"{user_id}:{info['chat_id']}", json.dumps(eviction))
+        self.forget(kid)
+
+        logger.bind(user_id=user_id, msg_head="Kernel evicted").debug({"kid": kid, "reason": reason, "info": info})
+
+        return response
+
+    def pop_eviction(self, user_id: str, chat_id: str) -> Optional[Dict[str, Any]]:
+        """Get (and clear) the eviction of the chat's kernel, if it has been evicted."""
+        key = f"{user_id}:{chat_id}"
+        eviction = self.r.hget(EVICTION_KEY, key)
+        if eviction is None:
+            return None
+        self.r.hdel(EVICTION_KEY, key)
+        return json.loads(eviction)
+
+    def reap_idle(self) -> List[str]:
+        """Stop the kernels idle for longer than the ttl and refresh the memory of the others, the busy kernels are
+        left alone."""
+        now = time.time()
+        reaped = []
+        for kid, info in self.list_kernels().items():
+            try:
+                if self.is_busy(kid):
+                    # Running a cell, e.g., longer than the ttl, it is in use
+                    continue
+                if now - info["last_used"] > self.idle_ttl:
+                    self.evict(info["user_id"], kid, reason="idle")
+                    reaped.append(kid)
+                else:
+                    rss = self.probe_rss(info["user_id"], kid)
+                    # Re-read the info as the kernel may have been used in the meantime
+                    current_info = self.get_kernel_info(kid)
+                    if rss is not None and current_info is not None:
+                        current_info["rss"] = rss
+                        self.r.hset(REGISTRY_KEY, kid, json.dumps(current_info))
+            except Exception as e:
+                logger.bind(user_id=info.get("user_id"), msg_head="Kernel reaping error").error(str(e))
+        return reaped
+
+    def run_reaper(self) -> None:
+        """Reap idle kernels forever, meant to run in a daemon thread of the backend."""
+        while True:
+            time.sleep(self.reap_interval)
+            try:
+                reaped = self.reap_idle()
+                if reaped:
+                    logger.bind(msg_head="Idle kernels reaped").debug(reaped)
+            except Exception as e:
+                logger.bind(msg_head="Kernel reaper error").error(str(e))
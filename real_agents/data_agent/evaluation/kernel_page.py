@@ -0,0 +1,86 @@
+"""Code run inside a kernel to write a page of a dataframe variable to a file, for the table page API."""
+import json
+import os
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from real_agents.data_agent.evaluation.kernel_export import KERNEL_EXPORT_DIR
+
+PAGED_PREFIX = "[PAGED]: "
+
+# The sorting and filters of `real_agents.adapters.data_model.pagination`, the page is written as Parquet, since the
+# stdout of the kernel is capped, and the number of rows matching the filters is printed. Wrapped in a function
+# deleted afterwards to keep the kernel namespace clean.
+PAGE_CODE = """
+def __page(name, path, start, stop, sorting, filters):
+    import os
+    import pandas as pd
+    value = globals().get(name)
+    if isinstance(value, pd.Series):
+        value = value.to_frame()
+    if not isinstance(value, pd.DataFrame):
+        raise TypeError(f"{{name}} is not a dataframe")
+    columns = {{str(column): column for column in value.columns}}
+
+    def bound(series, bound_value):
+        if pd.api.types.is_datetime64_any_dtype(series):
+            return pd.Timestamp(bound_value)
+        return float(bound_value) if pd.api.types.is_numeric_dtype(series) else str(bound_value)
+
+    mask = pd.Series(True, index=value.index)
+    for column_filter in filters:
+        series, filter_value = value[columns[str(column_filter["id"])]], column_filter.get("value")
+        if isinstance(filter_value, list) and len(filter_value) == 2:
+            mask &= series.notna()
+            if filter_value[0] not in (None, ""):
+                mask &= series >= bound(series, filter_value[0])
+            if filter_value[1] not in (None, ""):
+                mask &= series <= bound(series, filter_value[1])
+        elif filter_value not in (None, "", []):
+            mask &= series.notna() & series.astype(str).str.lower().str.contains(str(filter_value).lower(), regex=False)
+    rows = value[mask.to_numpy()]
+    if sorting:
+        rows = rows.sort_values(
+            by=[columns[str(sort["id"])] for sort in sorting],
+            ascending=[not sort.get("desc", False) for sort in sorting],
+            kind="stable",
+            na_position="last",
+        )
+    page = rows.iloc[start:stop].copy()
+    page.columns = [str(column) for column in page.columns]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    page.reset_index(drop=True).to_parquet(path)
+    return len(rows)
+print({prefix!r} + __import__("json").dumps(__page({name!r}, {path!r}, {start!r}, {stop!r}, {sorting!r}, {filters!r})))
+del __page
+"""
+
+
+def get_page_code(
+    variable: str,
+    start: int,
+    stop: int,
+    sorting: Optional[List[Dict[str, Any]]] = None,
+    filters: Optional[List[Dict[str, Any]]] = None,
+) -> Tuple[str, str]:
+    """The code writing the rows from start to stop of the sorted and filtered variable, and the file it writes
+    (relative to the kernel)."""
+    path = os.path.join(KERNEL_EXPORT_DIR, f"{uuid.uuid4().hex}.parquet")
+    code = PAGE_CODE.format(
+        name=variable,
+        path=path,
+        start=start,
+        stop=stop,
+        sorting=sorting or [],
+        filters=filters or [],
+        prefix=PAGED_PREFIX,
+    )
+    return code, path
+
+
+def parse_paged_rows(stdout: str) -> int:
+    """Get the number of rows matching the filters from the output of the page code, -1 if not found."""
+    for line in stdout.split("\n"):
+        if line.startswith(PAGED_PREFIX):
+            return json.loads(line[len(PAGED_PREFIX) :])
+    return -1
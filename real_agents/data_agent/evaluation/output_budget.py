@@ -0,0 +1,116 @@
+"""Code run once in each kernel to cap the size of its outputs at the source."""
+import os
+
+OUTPUT_MAX_REPR_BYTES = int(os.getenv("OUTPUT_MAX_REPR_BYTES", 16 * 1024))
+OUTPUT_MAX_ROWS = int(os.getenv("OUTPUT_MAX_ROWS", 30))
+OUTPUT_MAX_STDOUT_BYTES = int(os.getenv("OUTPUT_MAX_STDOUT_BYTES", 64 * 1024))
+
+# - pandas/numpy/IPython pretty printing options limit the rows and items rendered by repr and print, the pandas and
+#   numpy ones only while a cell runs, the local mode shell shares the process with the backend
+# - the display hook cuts the rendered text result and drops an HTML one over the budget (the client shows the text
+#   instead, HTML cut in a tag or an entity would not render), the full object is still stored in Out[n] by IPython
+# - stdout/stderr are wrapped at the start of each cell to stop writing once the byte budget is spent
+# The budgets are in UTF-8 bytes, a multi-byte character split by a cut is dropped.
+# The hooks are installed once per shell, everything is wrapped in a function to keep the namespace clean.
+OUTPUT_BUDGET_CODE = """
+def __setup_output_budget(max_repr_bytes, max_rows, max_stdout_bytes):
+    import contextlib
+    import sys
+    from IPython import get_ipython
+
+    ip = get_ipython()
+    if getattr(ip, "_output_budget_installed", False):
+        return
+    display_options = []
+
+    def enter_display_options(*args):
+        stack = contextlib.ExitStack()
+        try:
+            import pandas as pd
+            stack.enter_context(
+                pd.option_context(
+                    "display.max_rows", max_rows,
+                    "display.min_rows", min(10, max_rows),
+                    "display.max_columns", 20,
+                    "display.max_colwidth", 100,
+                )
+            )
+        except ImportError:
+            pass
+        try:
+            import numpy as np
+            stack.enter_context(np.printoptions(threshold=max_rows * 10, edgeitems=3))
+        except ImportError:
+            pass
+        display_options.append(stack)
+
+    def exit_display_options(*args):
+        while display_options:
+            display_options.pop().close()
+
+    ip.display_formatter.formatters["text/plain"].max_seq_length = max_rows * 10
+
+    compute_format_data = ip.displayhook.compute_format_data
+
+    def cut(text, max_bytes):
+        return text.encode("utf-8")[:max_bytes].decode("utf-8", errors="ignore")
+
+    def capped_compute_format_data(result):
+        format_dict, md_dict = compute_format_data(result)
+        html = format_dict.get("text/html", None)
+        if isinstance(html, str) and len(html.encode("utf-8")) > max_repr_bytes and "text/plain" in format_dict:
+            del format_dict["text/html"]
+        text = format_dict.get("text/plain", None)
+        if isinstance(text, str) and len(text.encode("utf-8")) > max_repr_bytes:
+            format_dict["text/plain"] = cut(text, max_repr_bytes) + (
+                "\\n...\\n[output truncated, the full object is kept as Out[%d]]" % ip.execution_count
+            )
+        return format_dict, md_dict
+
+    ip.displayhook.compute_format_data = capped_compute_format_data
+
+    class BudgetedStream:
+        def __init__(self, stream):
+            self.stream = stream
+            self.written = 0
+
+        def write(self, text):
+            remaining = max_stdout_bytes - self.written
+            size = len(text.encode("utf-8"))
+            if remaining > 0:
+                if size > remaining:
+                    self.stream.write(cut(text, remaining) + "\\n...\\n[output truncated, too much printed]\\n")
+                else:
+                    self.stream.write(text)
+            self.written += size
+            return len(text)
+
+        def __getattr__(self, item):
+            return getattr(self.stream, item)
+
+    def reset_output_budget(*args):
+        # The streams may have been replaced since the last cell, e.g., by capture_output
+        for name in ("stdout", "stderr"):
+            stream = getattr(sys, name)
+            if isinstance(stream, BudgetedStream):
+                stream.written = 0
+            else:
+                setattr(sys, name, BudgetedStream(stream))
+
+    ip.events.register("pre_run_cell", reset_output_budget)
+    ip.events.register("pre_run_cell", enter_display_options)
+    ip.events.register("post_run_cell", exit_display_options)
+    ip._output_budget_installed = True
+__setup_output_budget({max_repr_bytes}, {max_rows}, {max_stdout_bytes})
+del __setup_output_budget
+"""
+
+
+def get_output_budget_code(
+    max_repr_bytes: int = OUTPUT_MAX_REPR_BYTES,
+    max_rows: int = OUTPUT_MAX_ROWS,
+    max_stdout_bytes: int = OUTPUT_MAX_STDOUT_BYTES,
+) -> str:
+    return OUTPUT_BUDGET_CODE.format(
+        max_repr_bytes=max_repr_bytes, max_rows=max_rows, max_stdout_bytes=max_stdout_bytes
+    )
@@ -1,9 +1,11 @@
 import os
-from typing import Any, List, Optional, Tuple, Dict
+import sys
+from typing import Any, Callable, List, Optional, Tuple, Dict
 from pydantic import BaseModel
 import requests
 import time
 import ast
+import uuid
 
 import pandas as pd
 from io import StringIO
@@ -14,6 +16,12 @@ from IPython.core.interactiveshell import InteractiveShell
 from IPython.core.getipython import get_ipython
 from IPython.utils.capture import capture_output
 
+from real_agents.data_agent.evaluation.kernel_manager import KernelLifecycleManager
+from real_agents.data_agent.evaluation.output_budget import get_output_budget_code
+from real_agents.adapters.data_model.sampling import APPROXIMATE_RESULT_FOOTER, APPROXIMATE_RESULT_HEADER
+from real_agents.data_agent.evaluation.result_cache import CellAnalysis, ExecutionResultCache, analyze_cell
+from real_agents.data_agent.evaluation.sample_run import get_sample_run_code
+
 
 # subscribed channels
 SUBMIT_EVENT = "job_submitted"
@@ -21,6 +29,16 @@ RUNNING_EVENT = "job_started"
 COMPLETE_EVENT = "job_completed"
 # Error render prefix
 ERROR_PREFIX = "[ERROR]: "
+# Max bytes of stdout/stderr forwarded to the client while a single cell is running
+STREAM_MAX_BYTES = 32 * 1024
+# Redis hash of kernel id -> number of state changing executions in the kernel
+KERNEL_EPOCH_KEY = "kernel_state_epoch"
+STREAM_TRUNCATION_MARKER = "\n...\n[output too long, the rest is hidden until the cell finishes]\n"
+KERNEL_EVICTED_NOTICE = (
+    "\nNote: the kernel of this chat was restarted ({reason}), "
+    "variables defined in previous code executions are lost and need to be re-created."
+)
+KERNEL_RESTORED_NOTICE = " Only these variables were restored: {variables}."
 
 
 def check_danger_code(code):
@@ -60,6 +78,53 @@ class DisplayData(BaseModel):
         }
 
 
+class OutputStreamer:
+    """Forward the stdout/stderr of a running cell to a callback within a per-cell byte budget."""
+
+    def __init__(self, on_output: Callable[[str, str], None], max_bytes: int = STREAM_MAX_BYTES):
+        self.on_output = on_output
+        self.max_bytes = max_bytes
+        self.sent_bytes = 0
+        self.truncated = False
+
+    def write(self, text: str, name: str = "stdout") -> None:
+        if self.truncated or not text:
+            return
+        encoded = text.encode("utf-8")
+        remaining = self.max_bytes - self.sent_bytes
+        if len(encoded) > remaining:
+            # Cut on the byte budget, dropping a possibly split multi-byte char
+            text = encoded[:remaining].decode("utf-8", errors="ignore")
+            encoded = text.encode("utf-8")
+            self.truncated = True
+        self.sent_bytes += len(encoded)
+        try:
+            if text:
+                self.on_output(text, name)
+            if self.truncated:
+                self.on_output(STREAM_TRUNCATION_MARKER, name)
+        except Exception as e:
+            # Streaming is best effort, never break the execution because of it
+            logger.bind(msg_head="Output streaming error").trace(e)
+
+
+class _ForwardingIO:
+    """Wrap a captured stream so that writes are also forwarded to an OutputStreamer."""
+
+    def __init__(self, target: Any, name: str, streamer: OutputStreamer):
+        self._target = target
+        self._name = name
+        self._streamer = streamer
+
+    def write(self, text: str) -> int:
+        self._target.write(text)
+        self._streamer.write(text, self._name)
+        return len(text)
+
+    def __getattr__(self, item: str) -> Any:
+        return getattr(self._target, item)
+
+
 class PythonEvaluator:
     """
     Util class for Python code evaluation.
@@ -69,9 +134,44 @@ class PythonEvaluator:
     base_url = "http://{0}:8100".format(os.getenv("CODE_INTER_SERVER"))
     r: redis.Redis = redis.Redis(host=os.getenv("REDIS_SERVER"), port=6379, decode_responses=True)
 
+    result_cache: ExecutionResultCache = ExecutionResultCache(redis_client=r)
+    kernel_manager: KernelLifecycleManager = KernelLifecycleManager(base_url=base_url, redis_client=r)
+    # The local ipython shell lives as long as the agent process, so are its epochs. It is identified by a random id
+    # per process, a recycled pid must not find the epochs and cached results of a previous process
+    _local_epochs: Dict[str, int] = {}
+    _local_kernel_ids: Dict[int, str] = {}
+
     def __init__(self, code_execution_mode: str = "local", jupyter_kernel_pool: Optional[Any] = None):
         self.code_execution_mode = code_execution_mode
         self.jupyter_kernel_pool = jupyter_kernel_pool
+        # Eviction of the chat's previous kernel, found when applying for a kernel
+        self.kernel_eviction: Optional[Dict[str, Any]] = None
+
+    def _get_kernel_key(self, kernel_id: Optional[str], user_id: str, chat_id: str) -> str:
+        """Identify the kernel the program runs in, i.e., the scope of its state."""
+        if self.code_execution_mode == "local":
+            return f"local-{self._local_kernel_ids.setdefault(os.getpid(), uuid.uuid4().hex)}"
+        if kernel_id is None:
+            kernel_info = self.jupyter_kernel_pool.get_pool_info_with_id(user_id, chat_id, None)
+            kernel_id = kernel_info["kid"] if kernel_info is not None else None
+        # No kernel yet means a fresh kernel will be created with an empty state
+        return kernel_id if kernel_id is not None else "fresh"
+
+    def get_kernel_state(self, kernel_id: Optional[str], user_id: str, chat_id: str) -> str:
+        """The kernel state epoch, bumped by each execution that may change the kernel variables."""
+        kernel_key = self._get_kernel_key(kernel_id, user_id, chat_id)
+        if self.code_execution_mode == "local":
+            epoch = self._local_epochs.get(kernel_key, 0)
+        else:
+            epoch = int(self.r.hget(KERNEL_EPOCH_KEY, kernel_key) or 0)
+        return f"{kernel_key}:{epoch}"
+
+    def bump_kernel_state(self, kernel_id: Optional[str], user_id: str, chat_id: str) -> None:
+        kernel_key = self._get_kernel_key(kernel_id, user_id, chat_id)
+        if self.code_execution_mode == "local":
+            self._local_epochs[kernel_key] = self._local_epochs.get(kernel_key, 0) + 1
+        else:
+            self.r.hincrby(KERNEL_EPOCH_KEY, kernel_key, 1)
 
     @staticmethod
     def parse_command(program: str) -> List[str]:
@@ -79,7 +179,12 @@ class PythonEvaluator:
         program_lines = program.strip().split("\n")
         return program_lines
 
-    def run_program_local(self, program: str, user_id: Optional[str] = "u" * 24):
+    def run_program_local(
+        self,
+        program: str,
+        user_id: Optional[str] = "u" * 24,
+        on_output: Optional[Callable[[str, str], None]] = None,
+    ):
         """Run python program on the local machine using Ipython shell."""
         is_safe, ast_failed, danger_pcks = check_danger_code(program)
         if ast_failed != False:
@@ -96,7 +201,15 @@ class PythonEvaluator:
             shell = InteractiveShell.instance()
             shell.enable_gui = lambda x: False
             with capture_output() as captured:
+                if on_output is not None:
+                    # Forward the output as soon as it is written, capture_output restores sys streams on exit
+                    streamer = OutputStreamer(on_output)
+                    sys.stdout = _ForwardingIO(sys.stdout, "stdout", streamer)
+                    sys.stderr = _ForwardingIO(sys.stderr, "stderr", streamer)
                 ip = get_ipython()
+                if not getattr(ip, "_output_budget_installed", False):
+                    # Cap the size of what the cells print and display, once per shell
+                    ip.run_cell(get_output_budget_code(), store_history=False, silent=True)
                 code = "%matplotlib inline\n" + program  # magic command to display matplotlib plots
                 result = ip.run_cell(code)
 
@@ -143,6 +256,9 @@ class PythonEvaluator:
             # If kernel id is not provided, apply for a new kernel
             kernel_info = self.jupyter_kernel_pool.get_pool_info_with_id(user_id, chat_id, None)
             cur_kid = kernel_info["kid"] if kernel_info is not None else None
+            if cur_kid is None:
+                # The kernel pool may have been lost by a backend restart while the kernel is still alive
+                cur_kid = self.kernel_manager.find_kernel(user_id, chat_id)
             user_exists = requests.get(f"{self.base_url}/user/status/{user_id}").json()["exists"]
 
             logger.bind(user_id=user_id, chat_id=chat_id, msg_head="user exists").trace(user_exists)
@@ -158,15 +274,19 @@ class PythonEvaluator:
             logger.bind(user_id=user_id, chat_id=chat_id, msg_head="kernel list").trace(response)
 
             if cur_kid not in existing_kernel_list:
+                if cur_kid is not None:
+                    # The chat had a kernel which is gone, let the caller know its state is lost
+                    self.kernel_eviction = self.kernel_manager.pop_eviction(user_id, chat_id) or {
+                        "kid": cur_kid,
+                        "reason": "unknown",
+                    }
                 response = requests.post(f"{self.base_url}/kernel/create", json={"username": user_id}).json()
                 if response["code"] != 0 and response["msg"] == "Too many kernels":
-                    # kill oldest kernel
-                    oldest_kernel_id = existing_kernel_list[0]
-                    response = requests.post(
-                        f"{self.base_url}/kernel/stop", json={"username": user_id, "kid": oldest_kernel_id}
-                    ).json()
+                    # Evict the least recently used kernel, weighted by its memory
+                    victim_kernel_id = self.kernel_manager.select_victim(existing_kernel_list)
+                    response = self.kernel_manager.evict(user_id, victim_kernel_id, reason="too many kernels")
 
-                    logger.bind(user_id=user_id, chat_id=chat_id, msg_head="kill oldest kernel").trace(response)
+                    logger.bind(user_id=user_id, chat_id=chat_id, msg_head="evict kernel").trace(response)
 
                     response = requests.post(f"{self.base_url}/kernel/create", json={"username": user_id}).json()
                 cur_kid = response["id"]
@@ -177,6 +297,19 @@ class PythonEvaluator:
                     user_id, chat_id, {"kid": cur_kid, "ktime": time.time()}
                 )
 
+                self.kernel_manager.setup_output_budget(user_id, cur_kid)
+
+                if self.kernel_manager.checkpoint_enabled:
+                    # Bring back the modules of the chat's evicted kernel, if checkpointed, its variables are restored
+                    # by the first executions using them
+                    self.kernel_manager.restore(user_id, chat_id, cur_kid, names=[])
+                    if self.kernel_eviction is not None:
+                        self.kernel_eviction["restored"] = self.kernel_manager.get_pending_restore(cur_kid)
+            elif kernel_info is None:
+                self.jupyter_kernel_pool.set_pool_info_with_id(
+                    user_id, chat_id, {"kid": cur_kid, "ktime": time.time()}
+                )
+
         logger.bind(user_id=user_id, chat_id=chat_id, msg_head="current kernel id").trace(cur_kid)
 
         return cur_kid
@@ -188,7 +321,11 @@ class PythonEvaluator:
         user_id: Optional[str] = "u" * 24,
         chat_id: Optional[str] = "c" * 24,
     ):
-        """Run python program on the docker container(jupyter client)."""
+        """Run python program on the docker container(jupyter client).
+
+        The output is not streamed: the /kernel/exec api of the code interpreter answers once the cell finishes, with
+        all its output, which comes with the result.
+        """
         is_safe, ast_failed, danger_pcks = check_danger_code(program)
         if not is_safe:
             return {
@@ -218,12 +355,18 @@ class PythonEvaluator:
                 time.sleep(1)
             # Get kernel id(i.e., the real jupyter kernel to run the program) to execute program
             cur_kid = self._apply_for_kernel(kernel_id, user_id, chat_id)
-            # Execute program
-            response = requests.post(
-                f"{self.base_url}/kernel/exec", json={"username": user_id, "code": program, "kid": cur_kid}
-            ).json()
+            # Mark the kernel as in use so that it is not reaped while running
+            self.kernel_manager.touch(user_id, chat_id, cur_kid)
+            # The checkpointed variables the program reads, if the kernel replaced an evicted one
+            self.kernel_manager.restore_used(user_id, chat_id, cur_kid, analyze_cell(program).external_names)
+            # Execute program, the kernel is busy meanwhile
+            with self.kernel_manager.busy(cur_kid):
+                response = requests.post(
+                    f"{self.base_url}/kernel/exec", json={"username": user_id, "code": program, "kid": cur_kid}
+                ).json()
             # Notify Redis that a job has been completed
             self.r.publish(COMPLETE_EVENT, chat_id)
+            self.kernel_manager.touch(user_id, chat_id, cur_kid)
 
             # Parse jupyter kernel output
             result, stdout, stderr, outputs, displays, error_message = None, "", "", None, [], None
@@ -234,10 +377,11 @@ class PythonEvaluator:
                         if output_dict["type"] == "stream":
                             content = output_dict.get("content", None)
                             if content is not None:
+                                # A cell printing in several steps gets several stream messages
                                 if content["name"] == "stdout":
-                                    stdout = content["text"]
+                                    stdout += content["text"]
                                 if content["name"] == "stderr":
-                                    stderr = content["text"]
+                                    stderr += content["text"]
                         elif output_dict["type"] == "execute_result":
                             content = output_dict.get("content", None)
                             if content is not None:
@@ -282,6 +426,12 @@ class PythonEvaluator:
                 }
             elif shell_msg["status"] == "error":
                 error_message = f"{shell_msg['ename']}: {shell_msg['evalue']}"
+                if self.kernel_eviction is not None:
+                    error_message += KERNEL_EVICTED_NOTICE.format(reason=self.kernel_eviction["reason"])
+                    if self.kernel_eviction.get("restored"):
+                        error_message += KERNEL_RESTORED_NOTICE.format(
+                            variables=", ".join(self.kernel_eviction["restored"])
+                        )
                 return {"success": False, "error_message": f"{ERROR_PREFIX}{error_message}", "outputs": outputs}
         except Exception as e:
             logger.bind(user_id=user_id, chat_id=chat_id, msg_head="Python evaluator running error").trace(e)
@@ -300,6 +450,54 @@ class PythonEvaluator:
                 "error_message": f"{ERROR_PREFIX}{str(e)}",
             }
 
+    def _get_cache_key(
+        self,
+        program: str,
+        analysis: CellAnalysis,
+        data_fingerprints: List[str],
+        kernel_id: Optional[str],
+        user_id: str,
+        chat_id: str,
+    ) -> str:
+        # Cells not touching the kernel variables at all can be shared across kernels
+        kernel_state = None if analysis.is_kernel_independent else self.get_kernel_state(kernel_id, user_id, chat_id)
+        # The cell runs in the user's folder, where its relative paths are resolved
+        working_dir = os.path.abspath(os.path.join("backend/data/", user_id))
+        return self.result_cache.make_key(program, data_fingerprints, kernel_state, user_id, working_dir)
+
+    def run_on_samples(
+        self,
+        program: str,
+        sample_dir: str,
+        sample_description: str,
+        on_output: Callable[[str, str], None],
+        kernel_id: Optional[str] = None,
+        user_id: Optional[str] = "u" * 24,
+        chat_id: Optional[str] = "c" * 24,
+    ) -> None:
+        """Run the program on the samples in sample_dir and stream its output marked as approximate, nothing if it
+        fails. The kernel namespace is left untouched."""
+        chunks: List[str] = []
+
+        def on_sample_output(text: str, stream_name: str) -> None:
+            # Streamed at once if the run succeeds, the warnings are left out
+            if stream_name == "stdout":
+                chunks.append(text)
+
+        code = get_sample_run_code(program, sample_dir)
+        if self.code_execution_mode == "local":
+            result = self.run_program_local(code, user_id, on_sample_output)
+        else:
+            result = self.run_program_docker(code, kernel_id, user_id, chat_id)
+            chunks.append(result.get("stdout", ""))
+        if not result.get("success", False):
+            logger.bind(user_id=user_id, chat_id=chat_id, msg_head="Approximate result skipped").trace(
+                result.get("error_message")
+            )
+            return
+        header = APPROXIMATE_RESULT_HEADER.format(description=sample_description)
+        on_output(header + "".join(chunks) + APPROXIMATE_RESULT_FOOTER, "stdout")
+
     def run(
         self,
         program: str,
@@ -307,8 +505,21 @@ class PythonEvaluator:
         kernel_id: Optional[str] = None,
         user_id: Optional[str] = "u" * 24,
         chat_id: Optional[str] = "c" * 24,
+        on_output: Optional[Callable[[str, str], None]] = None,
+        data_fingerprints: Optional[List[str]] = None,
+        bypass_cache: bool = False,
+        sample_dir: Optional[str] = None,
+        sample_description: str = "",
     ) -> Any:
-        """run generated code in certain environment"""
+        """run generated code in certain environment
+
+        on_output(text, stream_name) receives stdout/stderr incrementally while the cell is running, in local mode only
+        (see `run_program_docker`).
+        Results of pure cells are cached by (code, data_fingerprints, kernel state) when data_fingerprints are given,
+        unless bypass_cache is set.
+        With a sample_dir (progressive mode), pure cells only reading the uploads are first run on the samples there,
+        and their approximate output is streamed before the exact run.
+        """
 
         lines_code = self.parse_command(program)
         program = "\n".join(lines_code)
@@ -316,9 +527,55 @@ class PythonEvaluator:
 
         logger.bind(user_id=user_id, chat_id=chat_id, msg_head="Code execution mode").trace(self.code_execution_mode)
 
+        if self.code_execution_mode not in ["local", "docker"]:
+            raise ValueError("Invalid code execution mode")
+
+        analysis = analyze_cell(program)
+        use_cache = data_fingerprints is not None and analysis.is_cacheable
+        if use_cache and bypass_cache:
+            self.result_cache.record_bypass()
+            use_cache = False
+        if use_cache:
+            try:
+                cache_key = self._get_cache_key(program, analysis, data_fingerprints, kernel_id, user_id, chat_id)
+                cached_result = self.result_cache.get(cache_key)
+            except Exception as e:
+                logger.bind(user_id=user_id, chat_id=chat_id, msg_head="Execution cache error").trace(e)
+                use_cache, cached_result = False, None
+            logger.bind(user_id=user_id, chat_id=chat_id, msg_head="Execution cache hit").trace(
+                cached_result is not None
+            )
+            if cached_result is not None:
+                if on_output is not None:
+                    streamer = OutputStreamer(on_output)
+                    streamer.write(cached_result.get("stdout", ""), "stdout")
+                    streamer.write(cached_result.get("stderr", ""), "stderr")
+                return cached_result
+        else:
+            logger.bind(user_id=user_id, chat_id=chat_id, msg_head="Execution not cacheable").trace(
+                analysis.impure_reasons
+            )
+
+        if sample_dir is not None and on_output is not None and analysis.is_pure and analysis.is_self_contained:
+            self.run_on_samples(program, sample_dir, sample_description, on_output, kernel_id, user_id, chat_id)
+
         if self.code_execution_mode == "local":
-            return self.run_program_local(program, user_id)
-        elif self.code_execution_mode == "docker":
-            return self.run_program_docker(program, kernel_id, user_id, chat_id)
+            result = self.run_program_local(program, user_id, on_output)
         else:
-            raise ValueError("Invalid code execution mode")
+            result = self.run_program_docker(program, kernel_id, user_id, chat_id)
+
+        try:
+            if analysis.changes_state:
+                self.bump_kernel_state(kernel_id, user_id, chat_id)
+            if use_cache and result.get("success", False):
+                # Keyed by the state after execution, the one a replay of this cell would observe
+                cache_key = self._get_cache_key(program, analysis, data_fingerprints, kernel_id, user_id, chat_id)
+                self.result_cache.set(cache_key, result)
+        except Exception as e:
+            logger.bind(user_id=user_id, chat_id=chat_id, msg_head="Execution cache error").trace(e)
+        return result
+
+    @classmethod
+    def get_cache_stats(cls) -> Dict[str, float]:
+        """Hit rate of the execution result cache, shared by all the agent processes."""
+        return cls.result_cache.stats()
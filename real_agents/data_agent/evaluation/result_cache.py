@@ -0,0 +1,429 @@
+"""Content-addressed cache of python execution results."""
+import ast
+import builtins
+import hashlib
+import os
+import pickle
+from typing import Any, Dict, List, Optional, Set
+
+from loguru import logger
+
+EXECUTION_CACHE_DIR = os.getenv("EXECUTION_CACHE_DIR", ".exec_cache")
+# Results larger than this are not worth the disk, e.g., a huge dataframe as the last expression
+MAX_ENTRY_BYTES = 16 * 1024 * 1024
+MAX_ENTRIES = 2048
+STATS_KEY = "execution_cache_stats"
+
+# Modules whose usage makes a cell non-deterministic, touching network or the file system, by dotted path
+IMPURE_MODULES = {
+    "random", "secrets", "uuid", "time", "datetime", "numpy.random", "scipy.stats",  # randomness & clock
+    "requests", "urllib", "urllib3", "http", "socket", "aiohttp", "httpx", "ftplib", "smtplib", "kaggle",  # network
+    "os", "sys", "shutil", "subprocess", "pathlib", "glob", "tempfile", "pickle", "joblib",  # system & files
+}
+IMPURE_ATTRIBUTES = {
+    # randomness & clock
+    "random", "rand", "randn", "randint", "choice", "permutation", "shuffle", "sample", "now", "today", "utcnow",
+    "rvs", "default_rng",
+    # writes
+    "to_excel", "to_parquet", "to_feather", "to_pickle", "to_sql", "to_hdf", "to_stata", "to_clipboard", "savefig",
+    "write", "write_text", "write_bytes", "writelines", "dump", "save",
+}
+# Writers that return a string when no path is given
+PATH_OPTIONAL_WRITERS = {"to_csv", "to_json", "to_html", "to_markdown", "to_latex", "to_string", "to_xml"}
+# Functions of the impure modules called by bare name, e.g., after `from time import perf_counter`
+IMPURE_FUNCTIONS = IMPURE_ATTRIBUTES | {
+    "uniform", "gauss", "normal", "randrange", "getrandbits", "token_hex", "uuid1", "uuid4", "time", "time_ns",
+    "perf_counter", "monotonic", "process_time",
+}
+IMPURE_CALLS = {"exec", "eval", "compile", "__import__", "globals", "locals", "vars", "setattr", "delattr", "input"}
+# In-place methods of builtin containers and dataframes, the other pandas mutations go through `inplace=True`
+MUTATING_METHODS = {
+    "append", "extend", "insert", "remove", "pop", "popitem", "clear", "update", "setdefault", "sort", "reverse",
+    "add", "discard",
+}
+REMOTE_PREFIXES = ("http://", "https://", "ftp://", "s3://", "gs://")
+BUILTIN_NAMES = set(dir(builtins)) | {"display", "get_ipython"}
+
+
+def is_impure_module(module: str) -> bool:
+    """Whether the module or one of its parents is impure, e.g., numpy.random.mtrand."""
+    parts = module.split(".")
+    return any(".".join(parts[: i + 1]) in IMPURE_MODULES for i in range(len(parts)))
+
+
+class CellAnalysis:
+    """Result of the conservative purity analysis of a code cell."""
+
+    def __init__(self) -> None:
+        self.impure_reasons: List[str] = []
+        # Names read before being bound in the cell, i.e., the cell depends on the kernel state
+        self.external_names: Set[str] = set()
+        # Module level names (re)bound by the cell, imports excluded as they are idempotent
+        self.bound_names: Set[str] = set()
+
+    @property
+    def is_pure(self) -> bool:
+        return len(self.impure_reasons) == 0
+
+    @property
+    def is_self_contained(self) -> bool:
+        return len(self.external_names) == 0
+
+    @property
+    def changes_state(self) -> bool:
+        return not self.is_pure or len(self.bound_names) > 0
+
+    @property
+    def is_cacheable(self) -> bool:
+        # A cell both reading and rebinding kernel variables (e.g., x = x + 1) is not safe to replay
+        return self.is_pure and (self.is_self_contained or len(self.bound_names) == 0)
+
+    @property
+    def is_kernel_independent(self) -> bool:
+        return self.is_pure and self.is_self_contained and len(self.bound_names) == 0
+
+
+class _PurityVisitor(ast.NodeVisitor):
+    """Walk the cell in evaluation order to find kernel reads, module level bindings and side effects."""
+
+    def __init__(self, analysis: CellAnalysis) -> None:
+        self.analysis = analysis
+        self.scopes: List[Set[str]] = [set()]
+        # Names imported from the impure modules, e.g., rand of `from numpy.random import rand`
+        self.impure_names: Set[str] = set()
+
+    def _is_bound(self, name: str) -> bool:
+        return any(name in scope for scope in self.scopes) or name in BUILTIN_NAMES
+
+    def _bind(self, name: str, from_import: bool = False) -> None:
+        self.scopes[-1].add(name)
+        if len(self.scopes) == 1 and not from_import:
+            self.analysis.bound_names.add(name)
+
+    def _impure(self, reason: str) -> None:
+        self.analysis.impure_reasons.append(reason)
+
+    def _root_name(self, node: ast.AST) -> Optional[str]:
+        while isinstance(node, (ast.Attribute, ast.Subscript, ast.Call)):
+            node = node.func if isinstance(node, ast.Call) else node.value
+        return node.id if isinstance(node, ast.Name) else None
+
+    def _check_mutation(self, node: ast.AST, what: str) -> None:
+        root = self._root_name(node)
+        if root is None or not any(root in scope for scope in self.scopes):
+            # Mutating an object owned by the kernel, not created by the cell
+            self._impure(f"{what} of {root or 'an expression'}")
+
+    def _visit_in_scope(self, names: List[str], nodes: List[ast.AST]) -> None:
+        self.scopes.append(set(names))
+        for node in nodes:
+            self.visit(node)
+        self.scopes.pop()
+
+    def visit_Name(self, node: ast.Name) -> None:
+        if isinstance(node.ctx, ast.Load):
+            if node.id in IMPURE_MODULES and not self._is_bound(node.id):
+                self._impure(f"uses {node.id}")
+            if not self._is_bound(node.id):
+                self.analysis.external_names.add(node.id)
+        elif isinstance(node.ctx, ast.Store):
+            self._bind(node.id)
+        else:
+            self._impure(f"deletes {node.id}")
+
+    def visit_Import(self, node: ast.Import) -> None:
+        for alias in node.names:
+            name = (alias.asname or alias.name).split(".")[0]
+            if is_impure_module(alias.name):
+                self._impure(f"imports {alias.name}")
+                self.impure_names.add(name)
+            self._bind(name, from_import=True)
+
+    def visit_ImportFrom(self, node: ast.ImportFrom) -> None:
+        module = node.module or ""
+        if is_impure_module(module):
+            self._impure(f"imports {module}")
+        for alias in node.names:
+            name = alias.asname or alias.name
+            # The name may be a module itself, e.g., `from numpy import random`
+            if is_impure_module(f"{module}.{alias.name}"):
+                self._impure(f"imports {module}.{alias.name}")
+                self.impure_names.add(name)
+            self._bind(name, from_import=True)
+
+    def visit_Assign(self, node: ast.Assign) -> None:
+        self.visit(node.value)
+        for target in node.targets:
+            if isinstance(target, (ast.Attribute, ast.Subscript)):
+                self._check_mutation(target, "item assignment")
+            self.visit(target)
+
+    def visit_AnnAssign(self, node: ast.AnnAssign) -> None:
+        if node.value is not None:
+            self.visit(node.value)
+        if isinstance(node.target, (ast.Attribute, ast.Subscript)):
+            self._check_mutation(node.target, "item assignment")
+        self.visit(node.target)
+
+    def visit_AugAssign(self, node: ast.AugAssign) -> None:
+        self.visit(node.value)
+        if isinstance(node.target, ast.Name):
+            if not self._is_bound(node.target.id):
+                self.analysis.external_names.add(node.target.id)
+            self._bind(node.target.id)
+        else:
+            self._check_mutation(node.target, "augmented assignment")
+            self.visit(node.target)
+
+    def visit_Delete(self, node: ast.Delete) -> None:
+        self._impure("del statement")
+
+    def visit_Global(self, node: ast.Global) -> None:
+        self._impure("global statement")
+
+    def visit_Nonlocal(self, node: ast.Nonlocal) -> None:
+        self._impure("nonlocal statement")
+
+    def visit_For(self, node: ast.For) -> None:
+        self.visit(node.iter)
+        self.visit(node.target)
+        for child in node.body + node.orelse:
+            self.visit(child)
+
+    def visit_NamedExpr(self, node: ast.NamedExpr) -> None:
+        self.visit(node.value)
+        self.visit(node.target)
+
+    def visit_ExceptHandler(self, node: ast.ExceptHandler) -> None:
+        if node.type is not None:
+            self.visit(node.type)
+        if node.name:
+            # Not a kernel binding, the exception name is unbound at the end of the handler
+            self.scopes[-1].add(node.name)
+        for child in node.body:
+            self.visit(child)
+
+    def visit_FunctionDef(self, node: ast.FunctionDef) -> None:
+        for decorator in node.decorator_list:
+            self.visit(decorator)
+        self._bind(node.name)
+        args = node.args
+        names = [a.arg for a in args.posonlyargs + args.args + args.kwonlyargs]
+        names += [a.arg for a in (args.vararg, args.kwarg) if a is not None]
+        self._visit_in_scope(names, args.defaults + [d for d in args.kw_defaults if d is not None] + node.body)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Lambda(self, node: ast.Lambda) -> None:
+        args = node.args
+        names = [a.arg for a in args.posonlyargs + args.args + args.kwonlyargs]
+        self._visit_in_scope(names, [node.body])
+
+    def visit_ClassDef(self, node: ast.ClassDef) -> None:
+        for base in node.bases:
+            self.visit(base)
+        self._bind(node.name)
+        self._visit_in_scope([], node.body)
+
+    def _visit_comprehension(self, node: ast.AST, elements: List[ast.AST]) -> None:
+        self.scopes.append(set())
+        for generator in node.generators:
+            self.visit(generator.iter)
+            self.visit(generator.target)
+            for condition in generator.ifs:
+                self.visit(condition)
+        for element in elements:
+            self.visit(element)
+        self.scopes.pop()
+
+    def visit_ListComp(self, node: ast.ListComp) -> None:
+        self._visit_comprehension(node, [node.elt])
+
+    visit_SetComp = visit_ListComp
+    visit_GeneratorExp = visit_ListComp
+
+    def visit_DictComp(self, node: ast.DictComp) -> None:
+        self._visit_comprehension(node, [node.key, node.value])
+
+    def visit_Call(self, node: ast.Call) -> None:
+        root = self._root_name(node.func)
+        if root in self.impure_names:
+            self._impure(f"calls {root}")
+        if isinstance(node.func, ast.Name):
+            if node.func.id in IMPURE_CALLS:
+                self._impure(f"calls {node.func.id}")
+            elif node.func.id in IMPURE_FUNCTIONS and not self._is_bound(node.func.id):
+                # Bound by the kernel, e.g., imported from random in a previous cell
+                self._impure(f"calls {node.func.id}")
+            elif node.func.id == "open":
+                mode = node.args[1] if len(node.args) > 1 else None
+                for keyword in node.keywords:
+                    if keyword.arg == "mode":
+                        mode = keyword.value
+                if mode is not None and not (
+                    isinstance(mode, ast.Constant) and isinstance(mode.value, str) and not set(mode.value) & set("wax+")
+                ):
+                    self._impure("opens a file for writing")
+        elif isinstance(node.func, ast.Attribute):
+            attr = node.func.attr
+            if attr in IMPURE_ATTRIBUTES:
+                self._impure(f"calls {attr}")
+            elif attr in PATH_OPTIONAL_WRITERS and (
+                node.args or any(keyword.arg in ("path_or_buf", "buf") for keyword in node.keywords)
+            ):
+                self._impure(f"calls {attr} with a path")
+            elif attr in MUTATING_METHODS:
+                self._check_mutation(node.func.value, f"{attr} call")
+        for keyword in node.keywords:
+            if keyword.arg == "inplace" and not (isinstance(keyword.value, ast.Constant) and not keyword.value.value):
+                self._check_mutation(node.func, "inplace call")
+        self.generic_visit(node)
+
+    def visit_Attribute(self, node: ast.Attribute) -> None:
+        if node.attr in IMPURE_ATTRIBUTES and isinstance(node.ctx, ast.Load):
+            self._impure(f"uses {node.attr}")
+        self.generic_visit(node)
+
+    def visit_Constant(self, node: ast.Constant) -> None:
+        if isinstance(node.value, str) and node.value.lower().startswith(REMOTE_PREFIXES):
+            self._impure("reads a remote resource")
+
+
+def analyze_cell(program: str) -> CellAnalysis:
+    """Conservatively check whether a cell is a pure function of its code, the data and the kernel state."""
+    analysis = CellAnalysis()
+    code_lines = []
+    for line in program.split("\n"):
+        stripped = line.strip()
+        if stripped.startswith("!") or (stripped.startswith("%") and stripped != "%matplotlib inline"):
+            analysis.impure_reasons.append("uses magic or shell command")
+        elif not stripped.startswith("%"):
+            code_lines.append(line)
+    try:
+        tree = ast.parse("\n".join(code_lines))
+    except SyntaxError as e:
+        analysis.impure_reasons.append(f"unparsable code: {e}")
+        return analysis
+    _PurityVisitor(analysis).visit(tree)
+    return analysis
+
+
+def normalize_code(program: str) -> str:
+    """Normalize the code so that formatting and comments do not change its cache key."""
+    magic_lines = [line.strip() for line in program.split("\n") if line.strip().startswith(("%", "!"))]
+    code = "\n".join(line for line in program.split("\n") if not line.strip().startswith(("%", "!")))
+    try:
+        code = ast.dump(ast.parse(code))
+    except SyntaxError:
+        code = "\n".join(line.rstrip() for line in code.strip().split("\n") if line.strip())
+    return "\n".join(magic_lines + [code])
+
+
+class ExecutionResultCache:
+    """Disk cache of successful execution results keyed by code, grounding data and kernel state.
+
+    Hit/miss counters are kept in redis (if given) as the cache is shared by all the agent processes.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = EXECUTION_CACHE_DIR,
+        redis_client: Optional[Any] = None,
+        max_entries: int = MAX_ENTRIES,
+        max_entry_bytes: int = MAX_ENTRY_BYTES,
+    ):
+        self.cache_dir = cache_dir
+        self.redis_client = redis_client
+        self.max_entries = max_entries
+        self.max_entry_bytes = max_entry_bytes
+
+    @staticmethod
+    def make_key(
+        program: str,
+        data_fingerprints: List[str],
+        kernel_state: Optional[str],
+        user_id: Optional[str] = None,
+        working_dir: Optional[str] = None,
+    ) -> str:
+        """Key of the result of the program, scoped to the user and the working directory even for the cells not
+        depending on the kernel, the same code may read files of the same name with other contents."""
+        digest = hashlib.sha256()
+        digest.update(normalize_code(program).encode("utf-8"))
+        for fingerprint in sorted(data_fingerprints):
+            digest.update(b"\0" + fingerprint.encode("utf-8"))
+        digest.update(b"\0" + str(kernel_state).encode("utf-8"))
+        digest.update(b"\0" + str(user_id).encode("utf-8"))
+        digest.update(b"\0" + hashlib.sha256(str(working_dir).encode("utf-8")).digest())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + ".pkl")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                result = pickle.load(f)
+            os.utime(path)  # keep recently used entries from being pruned
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            result = None
+        self._record("hits" if result is not None else "misses")
+        return result
+
+    def set(self, key: str, result: Dict[str, Any]) -> None:
+        entry = {name: result.get(name) for name in ["success", "result", "stdout", "stderr", "outputs"]}
+        try:
+            data = pickle.dumps(entry)
+        except Exception as e:
+            # e.g., a matplotlib figure or a generator as the result
+            logger.bind(msg_head="Execution result not cacheable").trace(e)
+            return
+        if len(data) > self.max_entry_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._prune()
+
+    def _prune(self) -> None:
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            entries.extend(os.path.join(root, name) for name in files if name.endswith(".pkl"))
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0)
+        for path in entries[: len(entries) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def record_bypass(self) -> None:
+        self._record("bypasses")
+
+    def _record(self, counter: str) -> None:
+        if self.redis_client is None:
+            return
+        try:
+            self.redis_client.hincrby(STATS_KEY, counter, 1)
+        except Exception as e:
+            logger.bind(msg_head="Execution cache stats error").trace(e)
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters and hit rate over all the lookups."""
+        counters = {}
+        if self.redis_client is not None:
+            try:
+                counters = self.redis_client.hgetall(STATS_KEY)
+            except Exception as e:
+                logger.bind(msg_head="Execution cache stats error").trace(e)
+        hits, misses = int(counters.get("hits", 0)), int(counters.get("misses", 0))
+        return {
+            "hits": hits,
+            "misses": misses,
+            "bypasses": int(counters.get("bypasses", 0)),
+            "hit_rate": hits / (hits + misses) if hits + misses > 0 else 0.0,
+        }
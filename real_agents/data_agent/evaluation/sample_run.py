@@ -0,0 +1,37 @@
+"""Code run inside a kernel to run a cell on the samples of the tables, for the approximate result of the progressive
+mode, without touching the kernel namespace."""
+from typing import List
+
+# The cell runs in a fresh namespace from the sample directory, where the samples have the paths of the uploads, and
+# the value of its last expression is printed as the kernel would display it. The wrapper deletes itself afterwards.
+SAMPLE_RUN_CODE = """
+def __sample_run(code, sample_dir):
+    import ast
+    import os
+    tree = ast.parse(code)
+    last = tree.body.pop() if tree.body and isinstance(tree.body[-1], ast.Expr) else None
+    namespace = {{"__name__": "__main__"}}
+    cwd = os.getcwd()
+    os.chdir(sample_dir)
+    try:
+        exec(compile(tree, "<sample>", "exec"), namespace)
+        if last is not None:
+            value = eval(compile(ast.Expression(last.value), "<sample>", "eval"), namespace)
+            if value is not None:
+                print(repr(value))
+    finally:
+        os.chdir(cwd)
+__sample_run({code!r}, {sample_dir!r})
+del __sample_run
+"""
+
+
+def _strip_magics(lines: List[str]) -> List[str]:
+    # Magics and shell escapes are IPython syntax, not Python
+    return [line for line in lines if not line.lstrip().startswith(("%", "!"))]
+
+
+def get_sample_run_code(program: str, sample_dir: str) -> str:
+    """The code running the program on the samples, sample_dir being relative to the kernel working directory."""
+    code = "\n".join(_strip_magics(program.split("\n")))
+    return SAMPLE_RUN_CODE.format(code=code, sample_dir=sample_dir)
@@ -34,10 +34,11 @@ class SQLEvaluator:
     def run(self, program: str, environment: SQLDatabase) -> Any:
         """run generated code in certain environment"""
         try:
-            output = environment.run(program)
+            # Only the first rows are formatted, along with the handle paging through the full result if truncated
+            query_result = environment.query(program)
             return {
                 "success": True,
-                "result": output,
+                "result": environment.format_result(query_result) if query_result is not None else "",
             }
         except Exception as e:
             traceback.print_exc()
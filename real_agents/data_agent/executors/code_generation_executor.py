@@ -1,8 +1,9 @@
-from typing import Any, Dict, List, Literal, Optional, Union
+from typing import Any, Callable, Dict, List, Literal, Optional, Union
 
 from langchain.base_language import BaseLanguageModel
 
 from real_agents.adapters.data_model import DatabaseDataModel, TableDataModel, ImageDataModel
+from real_agents.adapters.data_model.sampling import SAMPLE_DIR, describe_samples, write_sample_file
 from real_agents.adapters.memory import ReadOnlySharedStringMemory
 from real_agents.adapters.schema import SQLDatabase
 from real_agents.data_agent.python.base import PythonChain
@@ -56,6 +57,9 @@ class CodeGenerationExecutor:
         chat_id: str = None,
         code_execution_mode: str = "local",
         jupyter_kernel_pool: Any = None,
+        on_output: Optional[Callable[[str, str], None]] = None,
+        bypass_cache: bool = False,
+        progressive_tables: Optional[List[TableDataModel]] = None,
         return_intermediate_steps: bool = True,
         return_direct: bool = True,
         verbose: bool = True,
@@ -66,6 +70,11 @@ class CodeGenerationExecutor:
             user_intent: User intent to execute.
             grounding_source: Grounding source to execute the program on. should be {file_name: data}
             llm: Language model to use.
+            on_output: Callback receiving (text, stream_name) while the generated python code is running, and the
+                approximate results of the progressive mode.
+            bypass_cache: Whether to execute the generated python code even if its result is cached.
+            progressive_tables: Grounded tables to first run the program on the samples of (progressive mode), the
+                approximate result is given to on_output before the exact one is computed.
             return_intermediate_steps: Whether to return the intermediate steps, e.g., the program.
             return_direct: Whether to return the result of program execution directly.
             verbose: Whether to print the logging.
@@ -81,6 +90,27 @@ class CodeGenerationExecutor:
                 table_schema += f"{gs.get_llm_side_data()}\n"
             return table_schema
 
+        progressive_tables = progressive_tables or []
+        sampled_tables = [table for table in progressive_tables if table.sample is not None]
+        sample_description = describe_samples(sampled_tables)
+
+        def _get_sample_database() -> Optional[SQLDatabase]:
+            if not sampled_tables or on_output is None:
+                return None
+            # The small tables are queried in full along the samples of the large ones
+            tables = [table.sample for table in sampled_tables]
+            tables += [table for table in progressive_tables if table.sample is None]
+            sample_db = DatabaseDataModel.from_table_data_model(tables[0])
+            sample_db.sync_tables(tables)
+            return sample_db.raw_data
+
+        def _get_sample_dir() -> Optional[str]:
+            if not sampled_tables or on_output is None:
+                return None
+            # Every file is written first, any() would stop at the first sample
+            written = [write_sample_file(table) for table in progressive_tables]
+            return SAMPLE_DIR if any(written) else None
+
         if self._programming_language == "sql":
             db = grounding_source.raw_data
             assert isinstance(db, SQLDatabase)
@@ -92,6 +122,9 @@ class CodeGenerationExecutor:
                 return_direct=return_direct,
                 return_intermediate_steps=return_intermediate_steps,
                 verbose=verbose,
+                sample_database=_get_sample_database(),
+                sample_description=sample_description,
+                on_output=on_output,
             )
             _input = {"user_intent": user_intent}
             result = method(_input)
@@ -107,6 +140,11 @@ class CodeGenerationExecutor:
                     chat_id=chat_id,
                     code_execution_mode=code_execution_mode,
                     jupyter_kernel_pool=jupyter_kernel_pool,
+                    on_output=on_output,
+                    data_fingerprints=[gs.get_fingerprint() for gs in grounding_source or []],
+                    bypass_cache=bypass_cache,
+                    sample_dir=_get_sample_dir(),
+                    sample_description=sample_description,
                 )
                 # Get each source_item (table, db, files...) from the grounding_source
                 _input = {"question": user_intent, "data_info": _concat_grounding_source()}
@@ -122,6 +160,9 @@ class CodeGenerationExecutor:
                     chat_id=chat_id,
                     code_execution_mode=code_execution_mode,
                     jupyter_kernel_pool=jupyter_kernel_pool,
+                    on_output=on_output,
+                    data_fingerprints=[gs.get_fingerprint() for gs in grounding_source or []],
+                    bypass_cache=bypass_cache,
                 )
                 _input = {"question": user_intent, "data_info": _concat_grounding_source()}
                 result = method(_input)
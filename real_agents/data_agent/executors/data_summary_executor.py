@@ -6,6 +6,7 @@ from langchain import PromptTemplate
 
 from real_agents.adapters.callbacks.executor_streaming import ExecutorStreamingChainHandler
 from real_agents.adapters.data_model import DatabaseDataModel, TableDataModel, ImageDataModel
+from real_agents.adapters.data_model.profile import summarize_profile
 from real_agents.adapters.llm import LLMChain
 
 
@@ -39,13 +40,17 @@ Begin."
     ) -> Dict[str, Any]:
         summary = ""
         if isinstance(grounding_source, TableDataModel):
-            df = grounding_source.raw_data
             df_name = grounding_source.raw_data_name
+            # Computed at upload, the table is not scanned again
+            table_profile = summarize_profile(grounding_source.get_profile())
             # Basic summary
-            summary += f"Your table {df_name} contains {df.shape[0]} rows and {df.shape[1]} columns. "
+            summary += (
+                f"Your table {df_name} contains {table_profile['num_rows']} rows "
+                f"and {table_profile['num_columns']} columns. "
+            )
 
-            null_count = df.isnull().sum().sum()  # Get total number of null values
-            unique_values_avg = df.nunique().mean()  # Get average number of unique values
+            null_count = table_profile["null_count"]  # Get total number of null values
+            unique_values_avg = table_profile["distinct_avg"]  # Get average number of unique values
 
             summary += f"On average, each column has about {unique_values_avg:.0f} unique values. "
             if null_count > 0:
@@ -2,7 +2,7 @@
 from __future__ import annotations
 
 import re
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional
 
 from bs4 import BeautifulSoup
 from langchain.base_language import BaseLanguageModel
@@ -41,6 +41,14 @@ class PythonChain(Chain, BaseModel):
     code_execution_mode: str = "local"
     jupyter_kernel_pool: Optional[Any] = None
     reference_code: str = ""
+    on_output: Optional[Callable[[str, str], None]] = None
+    """Receives stdout/stderr of the running cell incrementally."""
+    data_fingerprints: Optional[List[str]] = None
+    """Fingerprints of the grounding sources, enables the execution result cache."""
+    bypass_cache: bool = False
+    sample_dir: Optional[str] = None
+    """Directory of the samples of the tables, the program runs on them first in the progressive mode."""
+    sample_description: str = ""
 
     chat_id: Optional[str] = None
     user_id: Optional[str] = None
@@ -132,7 +140,16 @@ class PythonChain(Chain, BaseModel):
         Since there will be error if we try to launch matplotlib GUI in the server,
         I add this line to avoid backend execution of matplotlib for now.
         """
-        result = repl.run(code + f"\n{self.get_answer_expr}", user_id=self.user_id, chat_id=self.chat_id)
+        result = repl.run(
+            code + f"\n{self.get_answer_expr}",
+            user_id=self.user_id,
+            chat_id=self.chat_id,
+            on_output=self.on_output,
+            data_fingerprints=self.data_fingerprints,
+            bypass_cache=self.bypass_cache,
+            sample_dir=self.sample_dir,
+            sample_description=self.sample_description,
+        )
 
         logger.bind(msg_head="PythonChain execution result").trace(result)
 
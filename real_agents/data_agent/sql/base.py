@@ -1,17 +1,19 @@
 """Chain for interacting with SQL Database."""
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional
 from pydantic import BaseModel, Extra, Field
 from loguru import logger
 
 from langchain.base_language import BaseLanguageModel
 from langchain.callbacks.manager import CallbackManagerForChainRun
 from langchain.chains.base import Chain
-from langchain import BasePromptTemplate, FewShotPromptTemplate
+from langchain import BasePromptTemplate
 
 from real_agents.data_agent.evaluation.sql_evaluator import SQLEvaluator
-from real_agents.adapters.schema import SQLDatabase
+from real_agents.adapters.data_model.sampling import APPROXIMATE_RESULT_FOOTER, APPROXIMATE_RESULT_HEADER
+from real_agents.adapters.schema import SQL_RESULT_MAX_ROWS, SQLDatabase
+from real_agents.adapters.sql_cache import is_read_only
 from real_agents.adapters.memory import ReadOnlySharedStringMemory
 from real_agents.data_agent.sql.prompt import (
     EXAMPLE_PROMPT,
@@ -20,6 +22,7 @@ from real_agents.data_agent.sql.prompt import (
     FEW_SHOT_SUFFIX,
     PROMPT,
 )
+from real_agents.data_agent.sql.example_selector import get_few_shot_prompt
 from real_agents.adapters.llm import LLMChain
 from real_agents.adapters.data_model import MessageDataModel
 
@@ -43,6 +46,12 @@ class SQLDatabaseChain(Chain, BaseModel):
     """Whether or not to return the intermediate steps along with the final answer."""
     return_direct: bool = False
     """Whether or not to return the result of querying the SQL table directly."""
+    sample_database: Optional[SQLDatabase] = Field(default=None, exclude=True)
+    """Database of the samples of the tables, queried first in the progressive mode."""
+    sample_description: str = ""
+    """Description of the samples, e.g., their sizes, given along the approximate result."""
+    on_output: Optional[Callable[[str, str], None]] = None
+    """Callback receiving the approximate result of the progressive mode, before the exact one is computed."""
 
     class Config:
         """Configuration for this pydantic object."""
@@ -77,8 +86,8 @@ class SQLDatabaseChain(Chain, BaseModel):
 
         _run_manager = run_manager or CallbackManagerForChainRun.get_noop_manager()
         if self.example_selector is not None:
-            self.prompt = FewShotPromptTemplate(
-                example_selector=self.example_selector,
+            self.prompt = get_few_shot_prompt(
+                self.example_selector,
                 example_prompt=EXAMPLE_PROMPT,
                 prefix=FEW_SHOT_PREFIX,
                 suffix=FEW_SHOT_SUFFIX,
@@ -96,6 +105,8 @@ class SQLDatabaseChain(Chain, BaseModel):
             "dialect": self.database.dialect,
             "table_info": table_info,
             "chat_history": "",
+            # Results beyond are truncated anyway, for the few-shot prompt
+            "top_k": SQL_RESULT_MAX_ROWS,
             "stop": ["\nSQLResult:"],
         }
 
@@ -115,6 +126,8 @@ class SQLDatabaseChain(Chain, BaseModel):
 
         # Call SQL/binder evaluator to execute the SQL command
         sql_evaluator = SQLEvaluator()
+        if self.sample_database is not None and self.on_output is not None and is_read_only(sql_cmd):
+            self._stream_approximate_result(sql_evaluator, sql_cmd)
         result = sql_evaluator.run(sql_cmd, self.database)
 
         logger.bind(msg_head="SQLChain execution result").trace(result)
@@ -132,6 +145,19 @@ class SQLDatabaseChain(Chain, BaseModel):
             chain_result["intermediate_steps"] = sql_cmd
         return chain_result
 
+    def _stream_approximate_result(self, sql_evaluator: SQLEvaluator, sql_cmd: str) -> None:
+        """Run the query on the samples and stream its result marked as approximate, nothing if it fails."""
+        result = sql_evaluator.run(sql_cmd, self.sample_database)
+        if not result["success"]:
+            logger.bind(msg_head="SQLChain approximate result skipped").trace(result["error_message"])
+            return
+        self.on_output(
+            APPROXIMATE_RESULT_HEADER.format(description=self.sample_description)
+            + result["result"]
+            + APPROXIMATE_RESULT_FOOTER,
+            "stdout",
+        )
+
     @property
     def _chain_type(self) -> str:
         return "sql_database_chain"
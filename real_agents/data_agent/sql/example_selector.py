@@ -0,0 +1,208 @@
+"""Offline few-shot example selection for the text-to-SQL chain, by BM25 over a local corpus of examples."""
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import os
+import pickle
+import re
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain import FewShotPromptTemplate
+from langchain.prompts.base import DEFAULT_FORMATTER_MAPPING
+from langchain.prompts.example_selector.base import BaseExampleSelector
+from loguru import logger
+from pydantic import BaseModel, Extra, PrivateAttr
+
+# JSON lines of {"question": ..., "table_info": ..., "query": ...}, no few-shot examples if unset
+SQL_EXAMPLES_PATH = os.getenv("SQL_EXAMPLES_PATH")
+MAX_COMPILED_PROMPTS = 256
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOP_WORDS = frozenset(
+    "a an and are as at be by for from how in is it of on or that the this to was what when where which who with"
+    " sqlquery".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased words, identifiers split on underscores, e.g., "customer_id" -> ["customer", "id"]."""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOP_WORDS]
+
+
+class BM25ExampleSelector(BaseExampleSelector, BaseModel):
+    """Select the k examples whose question and schema best match the input question, by Okapi BM25.
+
+    The inverted index holds the BM25 weight of each (term, example) as arrays, so that selecting only adds up
+    the postings of the input terms. It is persisted to index_path, keyed by the content of the examples.
+    """
+
+    examples: List[dict]
+    """Examples with the input variables of the example prompt, e.g., question, table_info and query."""
+    k: int = 3
+    """Number of examples to select, examples sharing no term with the input are never selected."""
+    index_keys: List[str] = ["question", "table_info"]
+    """Example fields indexed."""
+    input_keys: List[str] = ["question"]
+    """Input variables matched against the index."""
+    k1: float = 1.5
+    b: float = 0.75
+    index_path: Optional[str] = None
+    """Where to persist the index, not persisted if None."""
+
+    # Term -> (example ids, BM25 weights)
+    _postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = PrivateAttr(default_factory=dict)
+    _example_set_id: str = PrivateAttr(default="")
+
+    class Config:
+        """Configuration for this pydantic object."""
+
+        extra = Extra.forbid
+
+    def __init__(self, **data: Any):
+        super().__init__(**data)
+        self._load_or_build_index()
+
+    @classmethod
+    def from_jsonl(cls, path: str, **kwargs: Any) -> BM25ExampleSelector:
+        """Load the examples of a JSON lines file, with the index persisted next to it by default."""
+        with open(path, "r", encoding="utf-8") as f:
+            examples = [json.loads(line) for line in f if line.strip()]
+        kwargs.setdefault("index_path", f"{os.path.splitext(path)[0]}.bm25.pkl")
+        return cls(examples=examples, **kwargs)
+
+    @property
+    def example_set_id(self) -> str:
+        """Content hash of the examples and the index parameters."""
+        return self._example_set_id
+
+    def _load_or_build_index(self) -> None:
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(json.dumps([self.examples, self.index_keys, self.k1, self.b], sort_keys=True).encode("utf-8"))
+        self._example_set_id = digest.hexdigest()
+        if self.index_path is not None and os.path.isfile(self.index_path):
+            try:
+                with open(self.index_path, "rb") as f:
+                    index = pickle.load(f)
+                if index["example_set_id"] == self._example_set_id:
+                    self._postings = index["postings"]
+                    return
+            except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+                pass
+        self._build_index()
+        if self.index_path is not None:
+            tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump({"example_set_id": self._example_set_id, "postings": self._postings}, f)
+            os.replace(tmp_path, self.index_path)
+        logger.bind(msg_head="SQL example index built").debug(f"{len(self.examples)} examples")
+
+    def _build_index(self) -> None:
+        term_counts = [
+            Counter(tokenize(" ".join(str(example.get(key, "")) for key in self.index_keys)))
+            for example in self.examples
+        ]
+        lengths = [sum(counts.values()) for counts in term_counts]
+        avg_length = sum(lengths) / len(lengths) if lengths else 0.0
+        document_frequency = Counter(term for counts in term_counts for term in counts)
+        num_examples = len(self.examples)
+        postings: Dict[str, List[Tuple[int, float]]] = {}
+        for example_id, (counts, length) in enumerate(zip(term_counts, lengths)):
+            norm = self.k1 * (1 - self.b + self.b * length / avg_length) if avg_length else self.k1
+            for term, count in counts.items():
+                df = document_frequency[term]
+                idf = math.log(1 + (num_examples - df + 0.5) / (df + 0.5))
+                postings.setdefault(term, []).append((example_id, idf * count * (self.k1 + 1) / (count + norm)))
+        self._postings = {
+            term: (
+                np.array([example_id for example_id, _ in entries], dtype=np.int32),
+                np.array([weight for _, weight in entries]),
+            )
+            for term, entries in postings.items()
+        }
+
+    def add_example(self, example: Dict[str, str]) -> None:
+        """Add an example, which re-weights the whole index since BM25 depends on corpus statistics."""
+        self.examples.append(example)
+        self._load_or_build_index()
+
+    def select_example_ids(self, input_variables: Dict[str, Any]) -> List[int]:
+        """Indices of the selected examples, best match first."""
+        terms = set(tokenize(" ".join(str(input_variables.get(key, "")) for key in self.input_keys)))
+        scores = np.zeros(len(self.examples))
+        for term in terms:
+            if term in self._postings:
+                example_ids, weights = self._postings[term]
+                # An example appears once in the postings of a term
+                scores[example_ids] += weights
+        k = min(self.k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [int(example_id) for example_id in top if scores[example_id] > 0]
+
+    def select_examples(self, input_variables: Dict[str, str]) -> List[dict]:
+        return [self.examples[example_id] for example_id in self.select_example_ids(input_variables)]
+
+
+class CompiledFewShotPromptTemplate(FewShotPromptTemplate):
+    """Few-shot prompt over a BM25ExampleSelector, reusing the template compiled for each set of selected examples.
+
+    The examples are formatted and joined with the prefix and suffix once per set, instead of at every format.
+    """
+
+    _compiled_templates: "OrderedDict[Tuple[int, ...], str]" = PrivateAttr(default_factory=OrderedDict)
+
+    def format(self, **kwargs: Any) -> str:
+        kwargs = self._merge_partial_and_user_variables(**kwargs)
+        example_ids = tuple(self.example_selector.select_example_ids(kwargs))
+        template = self._compiled_templates.get(example_ids)
+        if template is None:
+            examples = self.example_selector.examples
+            example_strings = [
+                self.example_prompt.format(
+                    **{key: examples[example_id][key] for key in self.example_prompt.input_variables}
+                )
+                for example_id in example_ids
+            ]
+            pieces = [self.prefix, *example_strings, self.suffix]
+            template = self._compiled_templates[example_ids] = self.example_separator.join(
+                [piece for piece in pieces if piece]
+            )
+            if len(self._compiled_templates) > MAX_COMPILED_PROMPTS:
+                self._compiled_templates.popitem(last=False)
+        else:
+            self._compiled_templates.move_to_end(example_ids)
+        return DEFAULT_FORMATTER_MAPPING[self.template_format](template, **kwargs)
+
+
+# Example set id and prompt strings -> few-shot prompt, so that the compiled templates outlive the chains built for each query
+_few_shot_prompts: Dict[str, CompiledFewShotPromptTemplate] = {}
+
+
+def get_few_shot_prompt(example_selector: Any, **prompt_kwargs: Any) -> FewShotPromptTemplate:
+    """Few-shot prompt over the selector, cached per example set for BM25 selectors."""
+    if not isinstance(example_selector, BM25ExampleSelector):
+        return FewShotPromptTemplate(example_selector=example_selector, **prompt_kwargs)
+    key = example_selector.example_set_id + json.dumps(
+        {name: value for name, value in prompt_kwargs.items() if isinstance(value, (str, list))}, sort_keys=True
+    )
+    if key not in _few_shot_prompts:
+        _few_shot_prompts[key] = CompiledFewShotPromptTemplate(example_selector=example_selector, **prompt_kwargs)
+    return _few_shot_prompts[key]
+
+
+_default_example_selector: Optional[BM25ExampleSelector] = None
+
+
+def get_default_example_selector() -> Optional[BM25ExampleSelector]:
+    """Selector over the corpus at SQL_EXAMPLES_PATH, loaded once per process, None if unset."""
+    global _default_example_selector
+    if SQL_EXAMPLES_PATH is None:
+        return None
+    if _default_example_selector is None:
+        _default_example_selector = BM25ExampleSelector.from_jsonl(SQL_EXAMPLES_PATH)
+    return _default_example_selector
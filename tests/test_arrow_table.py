@@ -0,0 +1,78 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from real_agents.adapters.data_model.arrow_table import ArrowTable  # noqa: E402
+from real_agents.adapters.data_model.sampling import stratified_sample  # noqa: E402
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame(
+        {
+            "id": np.arange(1000),
+            "name": [f"item{i}" if i % 7 else None for i in range(1000)],
+            "price": np.arange(1000) * 0.5,
+        }
+    )
+
+
+@pytest.fixture(params=["arrow", "parquet"])
+def table(request, df, tmp_path):
+    if request.param == "arrow":
+        path = tmp_path / "table.arrow"
+        df.to_feather(path)
+    else:
+        path = tmp_path / "table.parquet"
+        # Several row groups, for the reads to span them
+        df.to_parquet(path, row_group_size=128, index=False)
+    return ArrowTable(str(path))
+
+
+def test_shape_and_columns(table, df):
+    assert len(table) == 1000
+    assert table.shape == (1000, 3)
+    assert table.columns.tolist() == df.columns.tolist()
+    assert table.dtypes.equals(df.dtypes)
+
+
+def test_slice_indexed_by_position(table, df):
+    pd.testing.assert_frame_equal(table.slice(120, 260), df.iloc[120:260])
+    pd.testing.assert_frame_equal(table.slice(990, 2000), df.iloc[990:])
+    assert table.slice(500, 400).empty
+
+
+def test_take_across_row_groups(table, df):
+    positions = [0, 5, 127, 128, 129, 640, 999]
+    pd.testing.assert_frame_equal(table.take(positions), df.iloc[positions])
+    assert table.take([]).columns.tolist() == df.columns.tolist()
+
+
+def test_head_column_and_batches(table, df):
+    pd.testing.assert_frame_equal(table.head(3), df.head(3))
+    pd.testing.assert_series_equal(table["price"], df["price"])
+    batches = list(table.iter_batches(300))
+    assert all(len(batch) <= 300 for batch in batches)
+    pd.testing.assert_frame_equal(pd.concat(batches), df)
+
+
+def test_null_count(table, df):
+    assert table.null_count().to_dict() == df.isna().sum().to_dict()
+
+
+def test_pickled_as_its_path(table, df):
+    data = pickle.dumps(table)
+    assert len(data) < 1000
+    pd.testing.assert_frame_equal(pickle.loads(data).to_pandas(), df)
+
+
+def test_same_sample_as_the_dataframe(tmp_path):
+    df = pd.DataFrame({"region": np.where(np.arange(10000) % 3, "east", "west"), "amount": np.arange(10000) * 0.5})
+    path = str(tmp_path / "sales.arrow")
+    df.to_feather(path)
+
+    pd.testing.assert_frame_equal(stratified_sample(ArrowTable(path), 1000), stratified_sample(df, 1000))
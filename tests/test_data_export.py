@@ -0,0 +1,50 @@
+import io
+
+import pytest
+
+from real_agents.adapters.data_export import encode_batches
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+
+def read_export(batches, export_format):
+    data = b"".join(encode_batches(batches, export_format))
+    if export_format == "parquet":
+        return pq.read_table(io.BytesIO(data))
+    return pa.ipc.open_stream(data).read_all()
+
+
+@pytest.mark.parametrize("export_format", ["parquet", "arrow"])
+def test_float_in_a_later_batch_of_an_int_column(export_format):
+    table = read_export([(["x"], [(1,), (2,)]), (["x"], [(1.5,), (None,)])], export_format)
+    assert table.schema.field("x").type == pa.float64()
+    assert table.column("x").to_pylist() == [1.0, 2.0, 1.5, None]
+
+
+@pytest.mark.parametrize("export_format", ["parquet", "arrow"])
+def test_all_null_first_batch(export_format):
+    batches = [(["x", "y"], [(None, None), (None, None)]), (["x", "y"], [(3, None), (4, None)])]
+    table = read_export(batches, export_format)
+    assert table.schema.field("x").type == pa.int64()
+    assert table.column("x").to_pylist() == [None, None, 3, 4]
+    # Never given a value
+    assert table.schema.field("y").type == pa.string()
+
+
+def test_mixed_columns_as_strings():
+    batches = [(["x", "y"], [(1, "a"), (2, 3)]), (["x", "y"], [("b", 4)])]
+    table = read_export(batches, "parquet")
+    assert table.column("x").to_pylist() == ["1", "2", "b"]
+    assert table.column("y").to_pylist() == ["a", "3", "4"]
+
+
+def test_empty_result_keeps_the_headers():
+    table = read_export([(["x", "y"], [])], "arrow")
+    assert table.num_rows == 0
+    assert table.schema.names == ["x", "y"]
+
+
+def test_csv():
+    data = b"".join(encode_batches([(["x"], [(1,)]), (["x"], [(1.5,)])], "csv"))
+    assert data.decode("utf-8").splitlines() == ["x", "1", "1.5"]
@@ -0,0 +1,45 @@
+import sqlite3
+
+import pytest
+
+from real_agents.adapters.engine_registry import EngineRegistry
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "test.db")
+    connection = sqlite3.connect(path)
+    for name in ("a", "b", "c"):
+        connection.execute(f"CREATE TABLE {name} (x INTEGER)")
+    connection.commit()
+    connection.close()
+    return path
+
+
+def test_shared_engine_and_metadata(db_path):
+    registry = EngineRegistry(max_size=2)
+    engine = registry.get_sqlite_engine(db_path)
+
+    assert registry.get_sqlite_engine(db_path) is engine
+    assert registry.get_metadata(engine) is registry.get_metadata(engine) is not None
+
+
+def test_pending_reflections_merged_and_dropped_once_reflected(db_path):
+    registry = EngineRegistry()
+    engine = registry.get_sqlite_engine(db_path)
+    metadata = registry.get_metadata(engine)
+    for _ in range(100):
+        metadata.reflect(bind=engine, only=["a"])
+        metadata.reflect(bind=engine, only=["b"])
+
+    assert len(metadata._pending_reflections) == 1
+    metadata.ensure_reflected()
+    assert sorted(metadata.tables) == ["a", "b"]
+    assert not metadata._pending_reflections
+
+    # The tables already reflected are not queued again
+    metadata.reflect(bind=engine, only=["a", "b"])
+    assert not metadata._pending_reflections
+    metadata.reflect(bind=engine, only=["a", "c"])
+    metadata.ensure_reflected()
+    assert sorted(metadata.tables) == ["a", "b", "c"]
@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+pytest.importorskip("langchain")
+
+from real_agents.data_agent.sql.example_selector import BM25ExampleSelector, tokenize  # noqa: E402
+
+EXAMPLES = [
+    {"question": "How many orders per customer?", "table_info": "orders(order_id, customer_id)", "query": "q0"},
+    {"question": "What is the average price of products?", "table_info": "products(price)", "query": "q1"},
+    {"question": "Which employees earn the highest salary?", "table_info": "employees(salary)", "query": "q2"},
+    {"question": "Total revenue of orders by month", "table_info": "orders(order_date, amount)", "query": "q3"},
+]
+
+
+def test_tokenize_splits_identifiers_and_drops_stop_words():
+    assert tokenize("What is the customer_id of Orders?") == ["customer", "id", "orders"]
+
+
+def test_selects_the_best_matches_first():
+    selector = BM25ExampleSelector(examples=list(EXAMPLES), k=2)
+
+    assert selector.select_example_ids({"question": "number of orders for each customer"}) == [0, 3]
+    assert selector.select_examples({"question": "highest salary"}) == [EXAMPLES[2]]
+
+
+def test_examples_sharing_no_term_are_never_selected():
+    selector = BM25ExampleSelector(examples=list(EXAMPLES), k=3)
+
+    assert selector.select_examples({"question": "weather tomorrow"}) == []
+    assert BM25ExampleSelector(examples=[]).select_examples({"question": "orders"}) == []
+
+
+def test_added_examples_are_selected():
+    selector = BM25ExampleSelector(examples=list(EXAMPLES), k=1)
+    example_set_id = selector.example_set_id
+    selector.add_example({"question": "Count the weather stations", "table_info": "stations(city)", "query": "q4"})
+
+    assert selector.example_set_id != example_set_id
+    assert selector.select_example_ids({"question": "weather stations"}) == [4]
+
+
+def test_index_persisted_next_to_the_examples(tmp_path):
+    path = tmp_path / "examples.jsonl"
+    path.write_text("".join(json.dumps(example) + "\n" for example in EXAMPLES))
+    selector = BM25ExampleSelector.from_jsonl(str(path), k=2)
+
+    assert (tmp_path / "examples.bm25.pkl").is_file()
+    reloaded = BM25ExampleSelector.from_jsonl(str(path), k=2)
+    assert reloaded.example_set_id == selector.example_set_id
+    question = {"question": "average product price"}
+    assert reloaded.select_example_ids(question) == selector.select_example_ids(question) == [1]
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from real_agents.adapters.data_model.pagination import MAX_PAGE_SIZE, get_table_page, page_window
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame(
+        {
+            "city": ["Paris", "London", "Berlin", "paris", "Rome", "Madrid"],
+            "sales": [10.0, np.nan, 30.0, 5.0, 30.0, 20.0],
+            "date": pd.to_datetime(["2023-01-01", "2023-02-01", "2023-03-01", "2023-04-01", "2023-05-01", None]),
+        }
+    )
+
+
+@pytest.fixture(params=["dataframe", "arrow"])
+def table(request, df, tmp_path):
+    if request.param == "dataframe":
+        return df
+    pytest.importorskip("pyarrow")
+    from real_agents.adapters.data_model.arrow_table import ArrowTable
+
+    path = tmp_path / "table.parquet"
+    df.to_parquet(path, row_group_size=2, index=False)
+    return ArrowTable(str(path))
+
+
+def _column(page, name):
+    return [row[name] for row in page["data"]]
+
+
+def test_page_window():
+    assert page_window(2, 10) == (20, 30)
+    assert page_window(-1, 0) == (0, 1)
+    assert page_window(0, MAX_PAGE_SIZE + 1) == (0, MAX_PAGE_SIZE)
+
+
+def test_window_of_an_unsorted_table(table):
+    page = get_table_page(table, page_index=1, page_size=4)
+
+    assert page["total"] == 6
+    assert (page["page_index"], page["page_size"]) == (1, 4)
+    assert _column(page, "city") == ["Rome", "Madrid"]
+    assert [column["accessorKey"] for column in page["columns"]] == ["city", "sales", "date"]
+    assert page["data"][1]["date"] is None
+
+
+def test_sorted_descending_with_missing_values_last(table):
+    page = get_table_page(table, 0, 10, sorting=[{"id": "sales", "desc": True}])
+
+    # Stable, the rows of equal values keep their order
+    assert _column(page, "city") == ["Berlin", "Rome", "Madrid", "Paris", "paris", "London"]
+    assert _column(page, "sales")[-1] is None
+
+
+def test_sorted_on_several_columns_and_paged(table):
+    sorting = [{"id": "sales", "desc": True}, {"id": "city", "desc": True}]
+
+    assert _column(get_table_page(table, 0, 2, sorting=sorting), "city") == ["Rome", "Berlin"]
+    assert _column(get_table_page(table, 1, 2, sorting=sorting), "city") == ["Madrid", "Paris"]
+
+
+def test_substring_filter_is_case_insensitive(table):
+    page = get_table_page(table, 0, 10, filters=[{"id": "city", "value": "PAR"}])
+
+    assert page["total"] == 2
+    assert _column(page, "city") == ["Paris", "paris"]
+
+
+def test_range_filters(table):
+    page = get_table_page(table, 0, 10, filters=[{"id": "sales", "value": [10, None]}])
+    assert _column(page, "city") == ["Paris", "Berlin", "Rome", "Madrid"]
+
+    page = get_table_page(
+        table, 0, 10, filters=[{"id": "date", "value": ["2023-02-01", "2023-04-01"]}, {"id": "sales", "value": [0, 20]}]
+    )
+    assert page["total"] == 1
+    assert _column(page, "city") == ["paris"]
+
+
+def test_filtered_sorted_and_paged(table):
+    page = get_table_page(
+        table,
+        page_index=1,
+        page_size=2,
+        sorting=[{"id": "sales", "desc": False}],
+        filters=[{"id": "sales", "value": ["", 30]}, {"id": "city", "value": ""}],
+    )
+
+    assert page["total"] == 5
+    assert _column(page, "city") == ["Madrid", "Berlin"]
+
+
+def test_unknown_column(table):
+    with pytest.raises(KeyError):
+        get_table_page(table, sorting=[{"id": "country"}])
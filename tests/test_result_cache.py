@@ -0,0 +1,87 @@
+from real_agents.data_agent.evaluation.result_cache import ExecutionResultCache, analyze_cell
+
+
+def test_self_contained_pure_cell_is_kernel_independent():
+    analysis = analyze_cell("import pandas as pd\ndf = pd.read_csv('a.csv')\nprint(df.describe())")
+    assert analysis.is_pure
+    assert analysis.is_self_contained
+    assert analysis.bound_names == {"df"}
+    assert analysis.is_cacheable
+    assert not analysis.is_kernel_independent
+
+
+def test_cell_reading_the_kernel_without_rebinding_is_cacheable():
+    analysis = analyze_cell("print(df.groupby('a').size())")
+    assert analysis.external_names == {"df"}
+    assert analysis.is_cacheable
+    assert not analysis.changes_state
+
+
+def test_cell_reading_and_rebinding_the_kernel_is_not_cacheable():
+    analysis = analyze_cell("x = x + 1")
+    assert analysis.external_names == {"x"}
+    assert not analysis.is_cacheable
+
+    analysis = analyze_cell("x += 1")
+    assert analysis.external_names == {"x"}
+    assert not analysis.is_cacheable
+
+
+def test_side_effects_are_impure():
+    for program in [
+        "import random\nprint(random.random())",
+        "df.to_csv('out.csv')",
+        "df.sort_values('a', inplace=True)",
+        "items.append(1)",
+        "open('a.txt', 'w').write('x')",
+        "pd.read_csv('https://example.com/a.csv')",
+        "del df",
+        "exec('x = 1')",
+    ]:
+        assert not analyze_cell(program).is_pure, program
+
+
+def test_writers_returning_strings_are_pure():
+    assert analyze_cell("print(df.to_csv())").is_pure
+    assert analyze_cell("items = []\nitems.append(1)").is_pure
+
+
+def test_local_scopes_are_not_kernel_reads():
+    analysis = analyze_cell("def f(a):\n    return [b * a for b in range(a)]\nprint(f(3), len([1]))")
+    assert analysis.is_self_contained
+    assert analysis.bound_names == {"f"}
+
+
+def test_magics_and_unparsable_cells():
+    assert analyze_cell("%matplotlib inline\nprint(1)").is_pure
+    assert not analyze_cell("!pip install x").is_pure
+    assert not analyze_cell("print(").is_pure
+
+
+def test_key_scoped_to_user_and_working_directory():
+    key = ExecutionResultCache.make_key("print(1)", ["fp"], None, "u1", "/data/u1")
+    assert key == ExecutionResultCache.make_key("print(1)  ", ["fp"], None, "u1", "/data/u1")
+    assert key != ExecutionResultCache.make_key("print(1)", ["fp"], None, "u2", "/data/u1")
+    assert key != ExecutionResultCache.make_key("print(1)", ["fp"], None, "u1", "/data/u2")
+    assert key != ExecutionResultCache.make_key("print(1)", ["other"], None, "u1", "/data/u1")
+
+
+def test_randomness_imported_by_name_is_impure():
+    for program in [
+        "from numpy.random import rand\nprint(rand(3))",
+        "from numpy import random as npr\nprint(npr.default_rng().integers(5))",
+        "import numpy.random\nprint(numpy.random.rand())",
+        "from scipy.stats import norm\nprint(norm.rvs())",
+        # Imported by a previous cell
+        "print(randint(0, 5))",
+        "print(perf_counter())",
+        "print(uuid4())",
+    ]:
+        analysis = analyze_cell(program)
+        assert not analysis.is_pure, program
+        assert not analysis.is_cacheable, program
+
+
+def test_deterministic_imports_by_name_are_pure():
+    assert analyze_cell("from numpy.linalg import norm\nprint(norm([3, 4]))").is_pure
+    assert analyze_cell("def sample(x):\n    return x\nprint(sample(1))").is_pure
@@ -0,0 +1,61 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from real_agents.adapters.data_model.sampling import (
+    APPROXIMATE_RESULT_HEADER,
+    SAMPLE_MIN_STRATUM_ROWS,
+    describe_samples,
+    stratified_sample,
+)
+
+
+def _sales(n_rows=10000):
+    rng = np.random.default_rng(1)
+    # A rare region, of a share too small to get SAMPLE_MIN_STRATUM_ROWS rows in proportion
+    region = np.where(np.arange(n_rows) % 1000 == 0, "north", np.where(np.arange(n_rows) % 2, "east", "west"))
+    return pd.DataFrame({"region": region, "amount": rng.random(n_rows)})
+
+
+def test_small_tables_are_kept_whole():
+    df = _sales(100)
+    assert stratified_sample(df, 1000) is df
+
+
+def test_strata_in_proportion_with_a_minimum_per_stratum():
+    df = _sales()
+    sample = stratified_sample(df, 1000)
+
+    counts = sample["region"].value_counts()
+    assert counts["north"] == SAMPLE_MIN_STRATUM_ROWS
+    assert (counts["east"], counts["west"]) == (500, 499)
+    # The rows keep their order and values
+    assert sample.index.is_monotonic_increasing
+    pd.testing.assert_frame_equal(sample, df.loc[sample.index])
+
+
+def test_deterministic_for_a_seed():
+    df = _sales()
+    pd.testing.assert_frame_equal(stratified_sample(df, 500), stratified_sample(df, 500))
+    assert not stratified_sample(df, 500, seed=1).index.equals(stratified_sample(df, 500).index)
+
+
+def test_uniform_without_a_categorical_column():
+    df = pd.DataFrame({"id": np.arange(5000), "amount": np.arange(5000) * 0.5})
+    sample = stratified_sample(df, 200)
+
+    assert len(sample) == 200
+    assert sample.index.is_unique and sample.index.is_monotonic_increasing
+
+
+
+def test_approximate_results_say_the_share_sampled_and_that_totals_are_not_extrapolated():
+    df = _sales()
+    table = SimpleNamespace(raw_data_name="sales.csv", raw_data=df, sample=SimpleNamespace(raw_data=df.iloc[:83]))
+    whole = SimpleNamespace(raw_data_name="small.csv", raw_data=df, sample=None)
+    description = describe_samples([table, whole])
+
+    assert description == 'stratified samples of "sales.csv" (0.83%: 83 of 10,000 rows)'
+    header = APPROXIMATE_RESULT_HEADER.format(description=description)
+    assert "0.83%" in header and "not extrapolated" in header
@@ -0,0 +1,48 @@
+import pytest
+
+from real_agents.adapters.sql_cache import SQLResultCache, is_read_only, is_volatile, normalize_sql
+
+
+@pytest.mark.parametrize(
+    "command",
+    [
+        "SELECT * FROM sales",
+        "select a, count(*) from sales group by a;",
+        "WITH t AS (SELECT a FROM sales) SELECT * FROM t",
+        "-- the top rows\nSELECT * FROM sales LIMIT 5",
+        "SELECT 1; SELECT 2",
+    ],
+)
+def test_queries_are_read_only(command):
+    assert is_read_only(command)
+
+
+@pytest.mark.parametrize(
+    "command",
+    [
+        "",
+        "DELETE FROM sales",
+        "UPDATE sales SET a = 1",
+        "INSERT INTO sales VALUES (1)",
+        "DROP TABLE sales",
+        "CREATE TABLE t AS SELECT * FROM sales",
+        "SELECT * FROM sales; DELETE FROM sales",
+        "PRAGMA table_info(sales)",
+    ],
+)
+def test_other_statements_are_not_read_only(command):
+    assert not is_read_only(command)
+
+
+def test_volatile_functions():
+    assert is_volatile("SELECT * FROM sales ORDER BY RANDOM() LIMIT 5")
+    assert is_volatile("SELECT date('now')")
+    assert is_volatile("SELECT CURRENT_TIMESTAMP")
+    assert not is_volatile("SELECT randomness FROM sales")
+
+
+def test_normalized_queries_share_the_key():
+    assert normalize_sql("select  a\nfrom sales -- all\n;") == normalize_sql("SELECT a FROM sales")
+    key = SQLResultCache.make_key("v1", "select a from sales")
+    assert key == SQLResultCache.make_key("v1", "SELECT a\n  FROM sales;")
+    assert key != SQLResultCache.make_key("v2", "SELECT a FROM sales")
@@ -0,0 +1,105 @@
+import json
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine
+
+from real_agents.adapters.schema import SQLDatabase
+from real_agents.adapters.sql_guard import (
+    find_duckdb_nested_loops,
+    find_sqlite_nested_scans,
+    get_row_limit,
+    has_join_condition,
+)
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.setattr(SQLDatabase, "result_cache", None)
+    path = str(tmp_path / "test.db")
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE a (x INTEGER)")
+    connection.execute("CREATE TABLE b (y INTEGER)")
+    connection.executemany("INSERT INTO a VALUES (?)", [(i,) for i in range(20000)])
+    connection.executemany("INSERT INTO b VALUES (?)", [(i,) for i in range(10000)])
+    connection.commit()
+    connection.close()
+    return SQLDatabase(create_engine(f"sqlite:///{path}"))
+
+
+def test_row_limit():
+    assert get_row_limit("SELECT * FROM a, b LIMIT 10") == 10
+    assert get_row_limit("SELECT * FROM a, b LIMIT 10 OFFSET 5;") == 15
+    assert get_row_limit("SELECT * FROM a WHERE x IN (SELECT y FROM b LIMIT 10)") is None
+    assert get_row_limit("SELECT * FROM a, b") is None
+
+
+def test_join_condition():
+    assert has_join_condition("SELECT * FROM a JOIN b ON a.x < b.y")
+    assert has_join_condition('SELECT * FROM a, b WHERE a.x BETWEEN b.y AND b."end"')
+    assert has_join_condition("SELECT * FROM a JOIN b USING (x)")
+    assert not has_join_condition("SELECT * FROM a, b WHERE a.x > 5 AND b.name = 'y'")
+    assert not has_join_condition("SELECT * FROM a CROSS JOIN b WHERE a.x IS NOT NULL AND b.y = NULL")
+
+
+def test_sqlite_nested_scans_by_table():
+    plan = [(4, 0, 0, "SCAN a AS t1"), (6, 0, 0, "SCAN TABLE b"), (9, 0, 0, "SEARCH c USING INDEX ix (z=?)")]
+    assert find_sqlite_nested_scans("SELECT * FROM a AS t1, b, c", plan) == [["a", "b"]]
+
+
+def test_cross_join_rejected(database):
+    with pytest.raises(ValueError, match="without a join condition"):
+        database.preflight("SELECT * FROM a, b")
+    with pytest.raises(ValueError, match="without a join condition"):
+        database.preflight("SELECT * FROM a, b ORDER BY a.x LIMIT 10")
+    with pytest.raises(ValueError, match="without a join condition"):
+        database.preflight("SELECT COUNT(*) FROM a, b LIMIT 10")
+
+
+def test_bounded_joins_run(database):
+    database.preflight("SELECT * FROM a, b LIMIT 10")
+    database.preflight("SELECT * FROM a JOIN b ON a.x = b.y")
+    # 20,000 x 10,000 / 3 rows
+    database.preflight("SELECT * FROM a JOIN b ON a.x < b.y")
+    assert len(database.query("SELECT * FROM a, b LIMIT 10").rows) == 10
+
+
+def test_inequality_join_over_the_threshold(database):
+    # 20,000 x 20,000 / 3 rows
+    with pytest.raises(ValueError, match="on a condition no index serves"):
+        database.preflight("SELECT * FROM a AS a1 JOIN a AS a2 ON a1.x < a2.x")
+
+
+def test_duckdb_nested_loops():
+    plan = [
+        {
+            "name": "PROJECTION",
+            "children": [
+                {
+                    "name": "STREAMING_LIMIT",
+                    "children": [
+                        {
+                            "name": "CROSS_PRODUCT",
+                            "children": [
+                                {"name": "SEQ_SCAN", "extra_info": {"Estimated Cardinality": "30000"}},
+                                {"name": "SEQ_SCAN", "extra_info": "a\n[INFOSEPARATOR]\nEC: ~20000"},
+                            ],
+                        }
+                    ],
+                }
+            ],
+        },
+        {
+            "name": "NESTED_LOOP_JOIN",
+            "extra_info": {"Conditions": "x <> y", "Estimated Cardinality": "5000"},
+            "children": [
+                {"name": "SEQ_SCAN", "extra_info": {"Estimated Cardinality": "100"}},
+                {"name": "SEQ_SCAN", "extra_info": {"Estimated Cardinality": "100"}},
+            ],
+        },
+    ]
+    cross_product, nested_loop = find_duckdb_nested_loops(json.dumps(plan))
+
+    assert (cross_product.sides, cross_product.estimated_rows) == ([30000, 20000], 6 * 10**8)
+    assert not cross_product.has_condition and cross_product.under_limit
+    assert (nested_loop.estimated_rows, nested_loop.has_condition, nested_loop.under_limit) == (5000, True, False)
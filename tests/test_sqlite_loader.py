@@ -0,0 +1,98 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+
+from real_agents.adapters.data_model.sqlite_loader import bulk_load
+
+
+def _read(db_path, query):
+    connection = sqlite3.connect(db_path)
+    try:
+        return connection.execute(query).fetchall()
+    finally:
+        connection.close()
+
+
+def test_rows_and_index_loaded_by_chunks(tmp_path):
+    db_path = str(tmp_path / "test.db")
+    df = pd.DataFrame({"a": range(10), "b": [f"x{i}" for i in range(10)]}, index=range(100, 110))
+
+    assert bulk_load(df, "table", db_path, chunk_rows=3) == 10
+    rows = _read(db_path, 'SELECT * FROM "table" ORDER BY "index"')
+    assert rows == [(100 + i, i, f"x{i}") for i in range(10)]
+    assert _read(db_path, "PRAGMA journal_mode") == [("delete",)]
+
+
+def test_types_and_values_read_as_to_sql(tmp_path):
+    df = pd.DataFrame(
+        {
+            "flag": [True, False, True],
+            "count": [1, 2, 3],
+            "price": [1.5, np.nan, 3.0],
+            "name": ["a", None, "c"],
+            "date": pd.to_datetime(["2023-01-01", None, "2023-01-03 12:30"]),
+        }
+    )
+    bulk_path, to_sql_path = str(tmp_path / "bulk.db"), str(tmp_path / "to_sql.db")
+    bulk_load(df, "sales", bulk_path)
+    df.to_sql("sales", create_engine(f"sqlite:///{to_sql_path}"))
+
+    query = 'SELECT * FROM "sales"'
+    assert _read(bulk_path, query) == _read(to_sql_path, query)
+    column_types = "SELECT name, type FROM pragma_table_info('sales')"
+    assert _read(bulk_path, column_types) == _read(to_sql_path, column_types)
+
+
+def test_replaces_the_existing_table(tmp_path):
+    db_path = str(tmp_path / "test.db")
+    bulk_load(pd.DataFrame({"a": range(5)}), "table", db_path)
+    bulk_load(pd.DataFrame({"b": ["x", "y"]}), "table", db_path)
+
+    assert _read(db_path, 'SELECT * FROM "table"') == [(0, "x"), (1, "y")]
+
+
+def test_index_named_level_0_when_a_column_is_named_index(tmp_path):
+    db_path = str(tmp_path / "test.db")
+    bulk_load(pd.DataFrame({"index": [7, 8]}), "table", db_path)
+
+    assert _read(db_path, "SELECT name FROM pragma_table_info('table')") == [("level_0",), ("index",)]
+
+
+def test_timedeltas_as_seconds(tmp_path):
+    db_path = str(tmp_path / "test.db")
+    bulk_load(pd.DataFrame({"duration": pd.to_timedelta(["1s", None, "1min 30s"])}), "table", db_path)
+
+    assert _read(db_path, 'SELECT "duration" FROM "table"') == [(1.0,), (None,), (90.0,)]
+    assert _read(db_path, "SELECT type FROM pragma_table_info('table') WHERE name = 'duration'") == [("FLOAT",)]
+
+
+def test_multi_index_levels_as_columns(tmp_path):
+    db_path = str(tmp_path / "test.db")
+    index = pd.MultiIndex.from_tuples([("a", 1), ("b", 2)], names=["key", None])
+    bulk_load(pd.DataFrame({"value": [0.5, 1.5]}, index=index), "table", db_path)
+
+    assert _read(db_path, 'SELECT * FROM "table"') == [("a", 1, 0.5), ("b", 2, 1.5)]
+    assert _read(db_path, "SELECT name FROM pragma_table_info('table')") == [("key",), ("level_1",), ("value",)]
+
+
+def test_timestamp_objects_as_datetimes(tmp_path):
+    db_path = str(tmp_path / "test.db")
+    dates = pd.Series([pd.Timestamp("2023-01-01 12:00"), None, pd.Timestamp("2023-01-03")], dtype=object)
+    bulk_load(pd.DataFrame({"date": dates}), "table", db_path)
+
+    assert _read(db_path, 'SELECT "date" FROM "table"') == [
+        ("2023-01-01 12:00:00.000000",),
+        (None,),
+        ("2023-01-03 00:00:00.000000",),
+    ]
+    assert _read(db_path, "SELECT type FROM pragma_table_info('table') WHERE name = 'date'") == [("DATETIME",)]
+
+
+def test_other_columns_written_with_to_sql(tmp_path):
+    db_path = str(tmp_path / "test.db")
+    df = pd.DataFrame({"mixed": ["a", 1, 2.5], "a": range(3)})
+
+    assert bulk_load(df, "table", db_path) == 3
+    assert _read(db_path, 'SELECT "mixed", "a" FROM "table"') == [("a", 0), ("1", 1), ("2.5", 2)]